@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк локального бэкенда (`backend: local`): время оценки и доля токенов
+дополнения при пакетах разного размера для документов разной длины.
+
+Модель — крошечный кросс-энкодер со случайными весами (эмбеддинги, слой
+токенов и среднее по маске внимания), который собирается в ONNX во временном
+каталоге вместе со словарным токенизатором. Ответы пакетной оценки сверяются
+с оценками по одной паре без дополнения: дополнение не должно менять оценку.
+
+Нужны пакеты onnx, onnxruntime и tokenizers.
+
+Запуск из корня репозитория:
+    python benchmarks/local_backend_benchmark.py
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import onnx
+from onnx import TensorProto, helper, numpy_helper
+from tokenizers import Tokenizer, models, pre_tokenizers, processors
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models.rerank.local_backend import LocalCrossEncoder  # noqa: E402
+from models.rerank.metrics import metrics  # noqa: E402
+
+DOCUMENTS = 512
+HIDDEN = 256
+CONTEXT_SIZE = 512
+BATCH_SIZES = (512, 64, 16)
+
+WORDS = (
+    "machine learning neural network ranking document query search reranker "
+    "passage retrieval model score token batch padding length"
+).split()
+SPECIAL = ["<pad>", "<s>", "</s>", "<unk>"]
+
+
+def build_model(directory: str) -> None:
+    """Случайно инициализированный кросс-энкодер и его токенизатор"""
+    vocab = {word: index for index, word in enumerate(SPECIAL + WORDS)}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token="<unk>"))
+    tokenizer.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer.post_processor = processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B:1 </s>:1",
+        special_tokens=[("<s>", 1), ("</s>", 2)],
+    )
+    tokenizer.save(os.path.join(directory, "tokenizer.json"))
+
+    rng = np.random.default_rng(0)
+    weights = [
+        numpy_helper.from_array(rng.normal(size=shape).astype(np.float32), name)
+        for name, shape in (
+            ("embeddings", (len(vocab), HIDDEN)),
+            ("dense", (HIDDEN, HIDDEN)),
+            ("classifier", (HIDDEN, 1)),
+        )
+    ]
+    weights += [
+        numpy_helper.from_array(np.array([axis], dtype=np.int64), name)
+        for name, axis in (("hidden_axis", 2), ("token_axis", 1))
+    ]
+    nodes = [
+        helper.make_node("Gather", ["embeddings", "input_ids"], ["embedded"]),
+        helper.make_node("MatMul", ["embedded", "dense"], ["projected"]),
+        helper.make_node("Relu", ["projected"], ["hidden"]),
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("Unsqueeze", ["mask", "hidden_axis"], ["mask3"]),
+        helper.make_node("Mul", ["hidden", "mask3"], ["masked"]),
+        helper.make_node("ReduceSum", ["masked", "token_axis"], ["total"], keepdims=0),
+        helper.make_node("ReduceSum", ["mask", "token_axis"], ["count"], keepdims=1),
+        helper.make_node("Div", ["total", "count"], ["pooled"]),
+        helper.make_node("MatMul", ["pooled", "classifier"], ["logits"]),
+    ]
+    inputs = [
+        helper.make_tensor_value_info(name, TensorProto.INT64, ["batch", "tokens"])
+        for name in ("input_ids", "attention_mask")
+    ]
+    output = helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", 1])
+    graph = helper.make_graph(nodes, "tiny_cross_encoder", inputs, [output], weights)
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, os.path.join(directory, "model.onnx"))
+
+
+def make_documents() -> list[str]:
+    """Много коротких документов и немного длинных, как в выдаче поиска"""
+    random.seed(DOCUMENTS)
+    documents = []
+    for _ in range(DOCUMENTS):
+        words = random.randint(300, 400) if random.random() < 0.05 else random.randint(10, 60)
+        documents.append(" ".join(random.choice(WORDS) for _ in range(words)))
+    return documents
+
+
+def main():
+    query = "neural reranker for search"
+    documents = make_documents()
+    with tempfile.TemporaryDirectory() as directory:
+        build_model(directory)
+        encoder = LocalCrossEncoder.load(directory, max_length=CONTEXT_SIZE)
+
+        reference = np.array([encoder.score(query, [document])[0] for document in documents])
+
+        header = f"{'batch':>6} {'padding %':>10} {'time ms':>8} {'max diff':>9}"
+        print(header)
+        print("-" * len(header))
+        for batch_size in BATCH_SIZES:
+            encoder.batch_size = batch_size
+            before = metrics.snapshot()["counters"]
+            started = time.perf_counter()
+            scores = encoder.score(query, documents)
+            elapsed = (time.perf_counter() - started) * 1000
+            after = metrics.snapshot()["counters"]
+            padding = after["local.padding_tokens"] - before.get("local.padding_tokens", 0)
+            tokens = sum(len(encoding.ids) for encoding in encoder.tokenizer.encode_batch(
+                [(query, document) for document in documents]
+            ))
+            share = 100 * padding / (tokens + padding)
+            diff = float(np.abs(scores - reference).max())
+            print(f"{batch_size:>6} {share:>10.1f} {elapsed:>8.1f} {diff:>9.1e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк памяти потоковой отправки запросов /rerank: пиковый прирост памяти
+(tracemalloc) при обычной и потоковой (`stream_threshold_kb`) сериализации
+для растущего числа документов.
+
+Запрос уходит на локальный сервер-заглушку в том же процессе. Заглушка читает
+тело по частям и отвечает компактным массивом оценок, поэтому сама почти не
+расходует память. Сами документы создаются до начала измерения: в результат
+попадает только то, что транспорт выделяет поверх них.
+
+Запуск из корня репозитория:
+    python benchmarks/streaming_memory_benchmark.py
+"""
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models.rerank import wire_codecs  # noqa: E402
+from models.rerank.transport import RerankTransport  # noqa: E402
+
+SIZES = (1000, 5000, 20000)
+DOCUMENT_CHARS = 2000
+TOP_K = 10
+
+WORDS = (
+    "машинное обучение нейронная сеть ранжирование документ запрос поиск "
+    "machine learning reranker passage query retrieval 机器 学习 排序"
+).split()
+
+
+def make_documents(count: int) -> list[str]:
+    random.seed(count)
+    documents = []
+    for _ in range(count):
+        words = []
+        size = 0
+        while size < DOCUMENT_CHARS:
+            word = random.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        documents.append(" ".join(words))
+    return documents
+
+
+class SinkHandler(BaseHTTPRequestHandler):
+    """Считает документы, не собирая тело целиком, и возвращает массив оценок"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self._send(b'{"status":"ok"}')
+
+    def do_POST(self):
+        count = 0
+        for key, value in wire_codecs.iter_json_members(self._body(), ("passages",)):
+            if key == "passages":
+                count = sum(1 for _ in value)
+        scores = (f"{random.uniform(-10, 10):.4f}".encode() for _ in range(count))
+        self._send(b'{"scores":[' + b",".join(scores) + b"]}")
+
+    def _body(self):
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            while True:
+                size = int(self.rfile.readline().strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return
+                yield self.rfile.read(size)
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length", 0))
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, wire_codecs.STREAM_CHUNK_BYTES))
+            remaining -= len(chunk)
+            yield chunk
+
+    def _send(self, body: bytes):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def measure(transport: RerankTransport, documents: list[str]) -> tuple[float, float]:
+    """Пиковый прирост памяти в МБ и время запроса в мс"""
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    started = time.perf_counter()
+    results = transport.rerank("что такое машинное обучение", documents, TOP_K)
+    elapsed = (time.perf_counter() - started) * 1000
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    assert len(results) == TOP_K
+    return (peak - baseline) / 1024 / 1024, elapsed
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SinkHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    api_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    modes = {
+        "обычный": {"api_url": api_url, "response_format": "scores"},
+        "потоковый": {"api_url": api_url, "response_format": "scores", "stream_threshold_kb": "1"},
+    }
+    transports = {name: RerankTransport(credentials) for name, credentials in modes.items()}
+
+    header = f"{'docs':>6} {'body MB':>8} {'mode':<10} {'peak MB':>8} {'time ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for count in SIZES:
+        documents = make_documents(count)
+        body_mb = len(json.dumps(documents, ensure_ascii=False).encode("utf-8")) / 1024 / 1024
+        for name, transport in transports.items():
+            peak_mb, elapsed = measure(transport, documents)
+            print(f"{count:>6} {body_mb:>8.1f} {name:<10} {peak_mb:>8.1f} {elapsed:>8.0f}")
+        print()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
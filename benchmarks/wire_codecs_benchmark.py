@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк кодеков обмена с /rerank: размер тела и время CPU на кодирование
+и декодирование для типичных размеров запроса.
+
+Запуск из корня репозитория:
+    python benchmarks/wire_codecs_benchmark.py
+"""
+
+import gzip
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from models.rerank import wire_codecs  # noqa: E402
+from models.rerank.wire_codecs import WireCodec  # noqa: E402
+
+SIZES = (10, 100, 1000)
+REPEATS = 20
+
+SAMPLES = {
+    "ru": "Машинное обучение — это раздел искусственного интеллекта, изучающий методы построения алгоритмов, способных обучаться. ",
+    "zh": "机器学习是人工智能的一个分支，研究如何让计算机从数据中学习规律并做出预测。",
+    "en": "Machine learning is a field of artificial intelligence that studies algorithms which improve through experience. ",
+}
+
+
+def make_document() -> str:
+    language = random.choice(list(SAMPLES))
+    sample = SAMPLES[language]
+    if language == "zh":
+        return "".join(random.choices(sample, k=random.randint(100, 400)))
+    return " ".join(random.choices(sample.split(), k=random.randint(40, 160)))
+
+
+def make_payload(count: int) -> dict:
+    random.seed(count)
+    documents = [make_document() for _ in range(count)]
+    return {"query": "что такое машинное обучение", "passages": documents, "top_k": count}
+
+
+def make_response(count: int) -> dict:
+    return {"results": [{"index": i, "score": random.uniform(-10, 10)} for i in range(count)]}
+
+
+def decode_body(codec: WireCodec, body: bytes, headers: dict) -> object:
+    encoding = headers.get("Content-Encoding")
+    if encoding == "gzip":
+        body = gzip.decompress(body)
+    elif encoding == "zstd":
+        body = wire_codecs.zstandard.ZstdDecompressor().decompress(body)
+    if codec.wire_format == "msgpack":
+        return wire_codecs.msgpack.unpackb(body, raw=False)
+    return wire_codecs.loads_json(body)
+
+
+def timed(func, repeats: int = REPEATS) -> float:
+    started = time.perf_counter()
+    for _ in range(repeats):
+        func()
+    return (time.perf_counter() - started) / repeats * 1000
+
+
+def available_codecs() -> list[WireCodec]:
+    codecs = []
+    for wire_format in wire_codecs.WIRE_FORMATS:
+        for compression in wire_codecs.COMPRESSIONS:
+            try:
+                codecs.append(WireCodec(wire_format, compression))
+            except ValueError as e:
+                print(f"Пропущен {wire_format}+{compression}: {e}")
+    return codecs
+
+
+def main():
+    print(f"orjson: {'да' if wire_codecs.orjson else 'нет'}")
+    codecs = available_codecs()
+
+    header = f"{'docs':>5} {'codec':<14} {'request KB':>11} {'encode ms':>10} {'decode ms':>10} {'response KB':>12}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for count in SIZES:
+        payload = make_payload(count)
+        response = make_response(count)
+
+        # То, что раньше отправлял requests.post(json=payload)
+        baseline = json.dumps(payload).encode("utf-8")
+        encode_ms = timed(lambda: json.dumps(payload).encode("utf-8"))
+        decode_ms = timed(lambda: json.loads(baseline))
+        response_kb = len(json.dumps(response).encode("utf-8")) / 1024
+        print(
+            f"{count:>5} {'requests json=':<14} {len(baseline) / 1024:>11.1f} "
+            f"{encode_ms:>10.3f} {decode_ms:>10.3f} {response_kb:>12.1f}"
+        )
+
+        for codec in codecs:
+            body, headers = codec.encode(payload)
+            encode_ms = timed(lambda: codec.encode(payload))
+            decode_ms = timed(lambda: decode_body(codec, body, headers))
+            response_body, _ = codec.encode(response)
+            print(
+                f"{count:>5} {codec.name:<14} {len(body) / 1024:>11.1f} "
+                f"{encode_ms:>10.3f} {decode_ms:>10.3f} {len(response_body) / 1024:>12.1f}"
+            )
+        print()
+
+
+if __name__ == "__main__":
+    main()
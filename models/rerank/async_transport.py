@@ -0,0 +1,484 @@
+"""
+Asyncio transport for the reranker service `/rerank` and `/health` endpoints.
+
+Requests run as coroutines on one background event loop per process, over
+pooled `httpx.AsyncClient` connections, so any number of shards can be in
+flight without an OS thread each. The blocking methods inherited from
+`RerankTransport` keep working from any plugin runtime thread: they submit the
+coroutine to the loop and wait for its result.
+
+Responses are converted to `requests.Response` and transport failures to the
+matching `requests` exceptions, so callers handle errors exactly as they do
+for the blocking transport. Streamed request bodies are sent from an async
+iterator; a streamed response is kept as the chunks it arrived in and parsed
+incrementally from them, without joining or decoding the whole body at once.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Any, AsyncIterator, Awaitable, Callable, Coroutine, Iterable, Optional, Union
+
+import httpx
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from . import wire_codecs
+from .document_upload import MISSING_STATUS_CODE, missing_hashes
+from .latency_model import get_latency_model
+from .session_pool import DEFAULT_IDLE_TIMEOUT, DEFAULT_POOL_SIZE, normalize_api_url
+from .limiter import classify
+from .resilience import CircuitOpenError, get_breaker
+from .sharding import DEFAULT_SHARD_CONCURRENCY, ScoredDocument
+from .transport import RerankTransport
+
+logger = logging.getLogger(__name__)
+
+
+class _EventLoopThread:
+    """
+    Event loop running forever on a daemon thread, started on first use.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="bge-rerank-aio", daemon=True
+                ).start()
+            return self._loop
+
+    def run(self, coroutine: Coroutine) -> Any:
+        """
+        Run a coroutine on the loop and block the calling thread for its result
+
+        Every network operation inside is bounded by the client timeouts, so
+        the wait itself is not.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+_runner = _EventLoopThread()
+
+
+class _PooledClient:
+    def __init__(self, pool_size: int, idle_timeout: float):
+        self.pool_size = pool_size
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=idle_timeout,
+            ),
+        )
+
+
+# Only touched from the event loop thread, so no lock is needed.
+_clients: dict[tuple[str, int, float], _PooledClient] = {}
+
+
+def _get_client(base_url: str, credentials: dict) -> httpx.AsyncClient:
+    """
+    Return the shared async client for one replica; must run on the event loop
+
+    Reads the same `pool_size` and `pool_idle_timeout` credentials as the
+    blocking session pool, and like it keeps a client per setting, so models
+    with different settings never close a client the other is using. Idle
+    connections expire inside the client.
+    """
+    pool_size = max(1, int(credentials.get("pool_size") or DEFAULT_POOL_SIZE))
+    idle_timeout = float(credentials.get("pool_idle_timeout") or DEFAULT_IDLE_TIMEOUT)
+    key = (normalize_api_url(base_url), pool_size, idle_timeout)
+    pooled = _clients.get(key)
+    if pooled is None:
+        pooled = _clients[key] = _PooledClient(pool_size, idle_timeout)
+    return pooled.client
+
+
+class _ChunkReader:
+    """
+    File-like `raw` of a converted response, returning the received chunks
+    """
+
+    def __init__(self, chunks: list[bytes]):
+        self._chunks = chunks
+        self._position = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._position >= len(self._chunks):
+            return b""
+        chunk = self._chunks[self._position]
+        # Drop the reference so consumed chunks can be freed
+        self._chunks[self._position] = b""
+        self._position += 1
+        return chunk
+
+    def close(self) -> None:
+        self._chunks = []
+
+
+async def _aiter_chunks(chunks: Iterable[bytes]) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+def _to_requests_response(
+    response: httpx.Response, chunks: Optional[list[bytes]] = None
+) -> requests.Response:
+    """
+    Wrap a fully read httpx response as a `requests.Response`
+
+    :param response: httpx response
+    :param chunks: decoded body chunks of a streamed response, left unjoined
+    """
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.headers = CaseInsensitiveDict(response.headers)
+    if chunks is None:
+        converted._content = response.content
+        # Lets iter_content() replay the body like a read requests response
+        converted._content_consumed = True
+    else:
+        converted.raw = _ChunkReader(chunks)
+    converted.url = str(response.url)
+    converted.reason = response.reason_phrase
+    converted.encoding = response.encoding
+    return converted
+
+
+class AsyncRerankTransport(RerankTransport):
+    """
+    Asyncio client for one reranker service with a blocking facade.
+    """
+
+    def _timeout(
+        self, timeout: Union[float, tuple[float, float], None] = None
+    ) -> httpx.Timeout:
+        # Waiting for a free pooled connection is not bounded: requests
+        # queue on the client instead of failing under a burst.
+        timeout = timeout or self._request_timeout()
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect, pool=None)
+        return httpx.Timeout(timeout, pool=None)
+
+    async def _request(
+        self,
+        method: str,
+        path: str,
+        timeout: Optional[float] = None,
+        base_url: Optional[str] = None,
+        avoid: Optional[set[str]] = None,
+        size: Optional[tuple[int, float]] = None,
+        prepare: Optional[Callable[[str], Awaitable[dict[str, Any]]]] = None,
+        **kwargs: Any,
+    ) -> requests.Response:
+        """
+        Send a request to `base_url`, or to a replica picked by the balancer
+        and guarded by its breaker
+
+        :param prepare: called with the picked replica before sending,
+                        returns request arguments that depend on it
+        """
+        limit = timeout or self._request_timeout()
+        if base_url is not None:
+            return await self._send(base_url, method, path, limit, **kwargs)
+        with self.endpoints.track(avoid) as call:
+            base_url = call.replica.url
+            # Only requests of known size have a predictable latency
+            latency = None if size is None else get_latency_model(base_url, self.credentials)
+            timeout = limit if latency is None else latency.timeouts(*size, limit)
+            breaker = get_breaker(base_url, self.credentials)
+            if breaker is not None:
+                try:
+                    breaker.before_request(base_url)
+                except CircuitOpenError:
+                    call.ok = None
+                    raise
+            try:
+                if prepare is not None:
+                    kwargs = {**kwargs, **await prepare(base_url)}
+                started = time.monotonic()
+                response = await self._send(base_url, method, path, timeout, **kwargs)
+            except requests.exceptions.Timeout:
+                if latency is not None:
+                    latency.timed_out(timeout, limit)
+                if self.deadline is not None and limit < self.timeout:
+                    # Cut short by the deadline, says nothing about the replica
+                    call.ok = None
+                    if breaker is not None:
+                        breaker.release_trial()
+                elif breaker is not None:
+                    breaker.record_failure()
+                raise
+            except requests.exceptions.RequestException:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            except BaseException as e:
+                if isinstance(e, asyncio.CancelledError):
+                    # Cancelled hedges say nothing about the replica
+                    call.ok = None
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+            call.ok = response.status_code < 500
+            if latency is not None and call.ok:
+                latency.observe(*size, time.monotonic() - started)
+            if breaker is not None:
+                breaker.record(response)
+            return response
+
+    async def _send(
+        self,
+        base_url: str,
+        method: str,
+        path: str,
+        timeout: Union[float, tuple[float, float], None],
+        stream: bool = False,
+        **kwargs: Any,
+    ) -> requests.Response:
+        client = _get_client(base_url, self.credentials)
+        try:
+            if not stream:
+                response = await client.request(
+                    method, self._url(base_url, path), timeout=self._timeout(timeout), **kwargs
+                )
+                return _to_requests_response(response)
+            request = client.build_request(
+                method, self._url(base_url, path), timeout=self._timeout(timeout), **kwargs
+            )
+            response = await client.send(request, stream=True)
+            try:
+                chunks = [chunk async for chunk in response.aiter_bytes()]
+            finally:
+                await response.aclose()
+            return _to_requests_response(response, chunks)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(str(e))
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(str(e))
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(str(e))
+
+    async def _apost(
+        self,
+        path: str,
+        payload: dict,
+        avoid: Optional[set[str]] = None,
+        upload: bool = False,
+    ) -> requests.Response:
+        tried = set() if avoid is None else avoid
+        return await self.retry.acall(
+            lambda: self._apost_limited(path, payload, tried, upload),
+            lambda: len(tried) < len(self.endpoints.replicas),
+        )
+
+    async def _apost_limited(
+        self, path: str, payload: dict, avoid: set[str], upload: bool = False
+    ) -> requests.Response:
+        if self.limiter is None:
+            return await self._apost_once(path, payload, avoid, upload=upload)
+        started = await self.limiter.aacquire(self._request_timeout())
+        response, error = None, None
+        try:
+            response = await self._apost_once(path, payload, avoid, upload=upload)
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(started, self._document_count(payload), classify(response, error))
+
+    async def _apost_once(
+        self,
+        path: str,
+        payload: dict,
+        avoid: set[str],
+        base_url: Optional[str] = None,
+        upload: bool = False,
+    ) -> requests.Response:
+        size = self._payload_size(payload)
+        sent_headers: dict[str, str] = {}
+
+        def encoder(codec: wire_codecs.WireCodec) -> Callable[[str], Awaitable[dict[str, Any]]]:
+            async def prepare(replica: str) -> dict[str, Any]:
+                sent = await self._aupload_to(replica, payload) if upload else payload
+                stream = self._streams(self._payload_documents(sent))
+                if stream:
+                    chunks, headers = codec.iter_encode(sent)
+                    body = _aiter_chunks(chunks)
+                else:
+                    body, headers = codec.encode(sent)
+                sent_headers.update(headers)
+                return {"stream": stream, "content": body, "headers": headers}
+
+            return prepare
+
+        async def send(codec: wire_codecs.WireCodec) -> requests.Response:
+            prepare = encoder(codec)
+            if base_url is None:
+                return await self._request(
+                    "POST", path, avoid=avoid, size=size, prepare=prepare
+                )
+            return await self._request("POST", path, base_url=base_url, **await prepare(base_url))
+
+        response = await send(self.codec)
+        if not wire_codecs.is_rejection(self.codec, sent_headers, response):
+            return response
+
+        wire_codecs.mark_rejected(self.api_url, self.codec)
+        return await send(wire_codecs.PLAIN_CODEC)
+
+    def _post(
+        self,
+        path: str,
+        payload: dict,
+        avoid: Optional[set[str]] = None,
+        upload: bool = False,
+    ) -> requests.Response:
+        return _runner.run(self._apost(path, payload, avoid, upload))
+
+    async def _apost_to(self, base_url: str, path: str, payload: dict) -> requests.Response:
+        return await self._apost_once(path, payload, set(), base_url)
+
+    def _post_to(self, base_url: str, path: str, payload: dict) -> requests.Response:
+        return _runner.run(self._apost_to(base_url, path, payload))
+
+    async def _aupload_to(self, base_url: str, payload: dict) -> dict:
+        """
+        Coroutine version of `_upload_to`
+        """
+        uploader = self.uploader
+        hashes = self._upload_hashes(payload)
+        if hashes is None:
+            return payload
+        pending = uploader.pending(base_url, hashes)
+        if pending:
+            try:
+                response = await self._apost_to(base_url, "documents/missing", {"hashes": pending})
+                if uploader.is_unsupported(response):
+                    uploader.mark_unsupported(self.api_url)
+                    return payload
+                response.raise_for_status()
+                missing = missing_hashes(response, self.codec)
+                documents = [
+                    document for texts in self._payload_documents(payload) for document in texts
+                ]
+                for texts in uploader.upload_batches(missing, hashes, documents):
+                    response = await self._apost_to(base_url, "documents", {"documents": texts})
+                    response.raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                logger.debug(f"Document upload to {base_url} failed: {str(e)}")
+                return payload
+            uploader.acknowledge(base_url, pending)
+        return self._hashed_payload(payload, hashes)
+
+    async def _apost_rerank(
+        self, query: str, documents: list[str], top_k: int, avoid: Optional[set[str]] = None
+    ) -> requests.Response:
+        payload = self._rerank_payload(query, documents, top_k)
+        response = await self._apost("rerank", payload, avoid, upload=True)
+        if self.uploader is None or response.status_code != MISSING_STATUS_CODE:
+            return response
+        self._fall_back_to_texts(response)
+        return await self._apost("rerank", payload, avoid)
+
+    async def arerank(
+        self, query: str, documents: list[str], top_k: int
+    ) -> list[ScoredDocument]:
+        """
+        Coroutine version of `rerank`; must be awaited on the transport loop
+        """
+        if self.hedging is None:
+            response = await self._apost_rerank(query, documents, top_k)
+            return self._parse_rerank(response, documents, top_k)
+        avoid: set[str] = set()
+
+        async def attempt() -> list[ScoredDocument]:
+            response = await self._apost_rerank(query, documents, top_k, avoid)
+            return self._parse_rerank(response, documents, top_k)
+
+        return await self.hedging.arun(attempt)
+
+    def rerank(self, query: str, documents: list[str], top_k: int) -> list[ScoredDocument]:
+        """
+        Score documents against a query with one `/rerank` request
+
+        :param query: search query
+        :param documents: docs for reranking
+        :param top_k: number of results requested from the server
+        :return: at most `top_k` scored documents, indices relative to `documents`
+        """
+        return _runner.run(self.arerank(query, documents, top_k))
+
+    def rerank_many(
+        self,
+        batch: list[tuple[str, list[str], int]],
+        max_concurrency: int = DEFAULT_SHARD_CONCURRENCY,
+    ) -> list[Optional[list[ScoredDocument]]]:
+        """
+        Score several independent (query, documents, top_k) requests concurrently
+
+        All requests run as coroutines on the event loop; none holds a thread.
+        The first failure cancels the requests still in flight. With a
+        deadline, requests that time out or are still running when it passes
+        are cancelled and returned as None instead.
+
+        :param batch: list of (query, documents, top_k)
+        :param max_concurrency: maximum number of requests in flight
+        :return: per-request scored documents in request order
+        """
+        return _runner.run(self._rerank_many(batch, max_concurrency))
+
+    async def _rerank_many(
+        self, batch: list[tuple[str, list[str], int]], max_concurrency: int
+    ) -> list[Optional[list[ScoredDocument]]]:
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+
+        async def bounded(query: str, documents: list[str], top_k: int):
+            async with semaphore:
+                return await self.arerank(query, documents, top_k)
+
+        tasks = [asyncio.ensure_future(bounded(*request)) for request in batch]
+        try:
+            if self.deadline is None or not tasks:
+                return await asyncio.gather(*tasks)
+            done, _ = await asyncio.wait(tasks, timeout=max(0.0, self.deadline.remaining()))
+            results = []
+            for task in tasks:
+                error = task.exception() if task in done else None
+                if error is not None and not isinstance(error, requests.exceptions.Timeout):
+                    raise error
+                results.append(task.result() if task in done and error is None else None)
+            return results
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def ahealth(
+        self, timeout: Optional[float] = None, base_url: Optional[str] = None
+    ) -> requests.Response:
+        """
+        Coroutine version of `health`
+        """
+        return await self._request("GET", "health", timeout=timeout, base_url=base_url)
+
+    def health(
+        self, timeout: Optional[float] = None, base_url: Optional[str] = None
+    ) -> requests.Response:
+        """
+        Call the `/health` endpoint
+
+        :param timeout: request timeout, defaults to the configured timeout
+        :param base_url: replica to check, defaults to one picked by the balancer
+        :return: raw response
+        """
+        return _runner.run(self.ahealth(timeout, base_url))
@@ -0,0 +1,263 @@
+"""
+Cross-request micro-batching of concurrent rerank calls.
+
+Concurrent `_invoke` calls to the same service are collected for a short
+window (or until a pair cap is reached) and sent as one request, so the server
+sees GPU-friendly batch sizes even when Dify sends many tiny requests.
+
+The first caller to open a batch acts as its leader: it waits for the window,
+sends the whole batch and hands every other caller its share of the scores.
+Only callers with identical credentials share a request, which is sent with
+their own transport settings; others in the same window are sent separately.
+Callers with the same query are merged into one `/rerank` request; different
+queries go through `/rerank/batch` when the service supports it and fall back
+to concurrent per-query requests otherwise.
+
+Merged scores are handed back by their `index`. A service answering in a
+format without indices (`output_format: simple`) cannot be batched, so on
+the first such answer the batcher re-sends those calls one by one and stops
+batching.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from .endpoints import service_key
+from .metrics import metrics
+from .sharding import ScoredDocument
+from .transport import BatchNotSupportedError, RerankTransport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_MAX_PAIRS = 256
+# Batchers kept for services or settings not used recently are dropped
+MAX_BATCHERS = 64
+
+
+class _Pending:
+    def __init__(self, transport: RerankTransport, query: str, documents: list[str]):
+        self.transport = transport
+        # Calls are only merged with calls sent with the same settings
+        self.config = json.dumps(transport.credentials, sort_keys=True, default=str)
+        self.query = query
+        self.documents = documents
+        self.enqueued_at = time.monotonic()
+        self.queue_wait = 0.0
+        self.result: Optional[list[ScoredDocument]] = None
+        self.error: Optional[BaseException] = None
+        self.done = threading.Event()
+
+
+class _Batch:
+    def __init__(self):
+        self.items: list[_Pending] = []
+        self.pairs = 0
+        self.full = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collects concurrent rerank calls for one service into shared requests.
+    """
+
+    def __init__(self, window: float, max_pairs: int = DEFAULT_BATCH_MAX_PAIRS):
+        self.window = window
+        self.max_pairs = max_pairs
+        self.batch_supported = True
+        # Cleared once the service answers without result indices
+        self.indexed = True
+        self._open: Optional[_Batch] = None
+        self._lock = threading.Lock()
+
+    def submit(
+        self, transport: RerankTransport, query: str, documents: list[str]
+    ) -> tuple[list[ScoredDocument], float]:
+        """
+        Score documents as part of the next batch
+
+        :param transport: transport of this caller, used for its requests
+        :param query: search query
+        :param documents: docs for reranking
+        :return: (scores for every document ordered by descending score,
+                  seconds spent waiting for the batch to be sent)
+        """
+        if len(documents) >= self.max_pairs or not self.indexed:
+            return self._send_alone(transport, query, documents), 0.0
+
+        item = _Pending(transport, query, documents)
+        with self._lock:
+            batch = self._open
+            leader = batch is None or batch.pairs + len(documents) > self.max_pairs
+            if leader:
+                if batch is not None:
+                    batch.full.set()
+                batch = self._open = _Batch()
+            batch.items.append(item)
+            batch.pairs += len(documents)
+            if batch.pairs >= self.max_pairs:
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open is batch:
+                    self._open = None
+            self._dispatch(batch.items)
+
+        item.done.wait()
+        metrics.observe("batch.queue_wait_seconds", item.queue_wait)
+        if item.error is not None:
+            raise item.error
+        return item.result, item.queue_wait
+
+    @staticmethod
+    def _send_alone(
+        transport: RerankTransport, query: str, documents: list[str]
+    ) -> list[ScoredDocument]:
+        return sorted(
+            transport.rerank(query, documents, len(documents)),
+            key=lambda doc: doc.score,
+            reverse=True,
+        )
+
+    def _dispatch(self, items: list[_Pending]) -> None:
+        started = time.monotonic()
+        partitions: dict[str, list[_Pending]] = {}
+        for item in items:
+            item.queue_wait = started - item.enqueued_at
+            partitions.setdefault(item.config, []).append(item)
+
+        metrics.incr("batch.dispatched")
+        metrics.observe("batch.callers", len(items))
+        metrics.observe("batch.pairs", sum(len(item.documents) for item in items))
+        self._run_all(self._send_partition, list(partitions.values()))
+
+    @staticmethod
+    def _run_all(send, jobs: list[list[_Pending]]) -> None:
+        """Call `send` for every job, concurrently if there are several"""
+        if len(jobs) == 1:
+            send(jobs[0])
+            return
+        executor = ThreadPoolExecutor(max_workers=len(jobs), thread_name_prefix="bge-rerank-batch")
+        try:
+            for future in [executor.submit(send, job) for job in jobs]:
+                future.result()
+        finally:
+            executor.shutdown(wait=False)
+
+    def _send_partition(self, items: list[_Pending]) -> None:
+        """Send calls with identical settings with their shared transport"""
+        transport = items[0].transport
+        groups: dict[str, list[_Pending]] = {}
+        for item in items:
+            groups.setdefault(item.query, []).append(item)
+
+        group_list = list(groups.values())
+        try:
+            if len(group_list) > 1 and self.batch_supported:
+                try:
+                    results = transport.rerank_batch(
+                        [self._group_request(group) for group in group_list]
+                    )
+                except BatchNotSupportedError as e:
+                    logger.info(f"Falling back to per-query rerank requests: {str(e)}")
+                    self.batch_supported = False
+                else:
+                    for group, scored in zip(group_list, results):
+                        self._resolve(group, scored)
+                    return
+
+            self._run_all(self._send_group, group_list)
+        except BaseException as e:
+            for item in items:
+                if not item.done.is_set():
+                    item.error = e
+                    item.done.set()
+
+    @staticmethod
+    def _group_request(group: list[_Pending]) -> tuple[str, list[str], int]:
+        documents = [doc for item in group for doc in item.documents]
+        return group[0].query, documents, len(documents)
+
+    def _send_group(self, group: list[_Pending]) -> None:
+        try:
+            self._resolve(group, group[0].transport.rerank(*self._group_request(group)))
+        except BaseException as e:
+            for item in group:
+                if not item.done.is_set():
+                    item.error = e
+                    item.done.set()
+
+    def _resolve(self, group: list[_Pending], scored: list[ScoredDocument]) -> None:
+        # Split the merged documents back into each caller's own index space.
+        owners = []
+        for item in group:
+            owners.extend((item, index) for index in range(len(item.documents)))
+        if any(not 0 <= doc.index < len(owners) for doc in scored):
+            self._resolve_unindexed(group, scored)
+            return
+        per_item: dict[int, list[ScoredDocument]] = {id(item): [] for item in group}
+        for doc in sorted(scored, key=lambda doc: doc.score, reverse=True):
+            item, index = owners[doc.index]
+            per_item[id(item)].append(doc._replace(index=index))
+        for item in group:
+            item.result = per_item[id(item)]
+            item.done.set()
+
+    def _resolve_unindexed(self, group: list[_Pending], scored: list[ScoredDocument]) -> None:
+        """
+        Hand out a response without result indices, which cannot be split
+        between callers: a single caller keeps it, several are re-sent alone
+        """
+        if self.indexed:
+            logger.warning(
+                "Reranker results carry no document index, micro-batching is disabled"
+            )
+            self.indexed = False
+        if len(group) == 1:
+            group[0].result = sorted(scored, key=lambda doc: doc.score, reverse=True)
+            group[0].done.set()
+            return
+        for item in group:
+            item.result = self._send_alone(item.transport, item.query, item.documents)
+            item.done.set()
+
+
+_batchers: OrderedDict[tuple, MicroBatcher] = OrderedDict()
+_batchers_lock = threading.Lock()
+
+
+def get_batcher(credentials: dict, input_field: str) -> Optional[MicroBatcher]:
+    """
+    Return the shared batcher for these credentials, or None if disabled
+
+    The window and pair cap are read from the `batch_window_ms` and
+    `batch_max_pairs` credentials; a zero window disables micro-batching.
+
+    Batchers are shared per service, documents field, window and pair cap,
+    and only the `MAX_BATCHERS` most recently used ones are kept. Calls with
+    other settings in the same window are sent with their own transports.
+
+    :param credentials: model credentials
+    :param input_field: name of the documents field, batches never mix formats
+    :return: batcher or None
+    """
+    window = float(credentials.get("batch_window_ms") or 0) / 1000
+    if window <= 0:
+        return None
+    max_pairs = max(1, int(credentials.get("batch_max_pairs") or DEFAULT_BATCH_MAX_PAIRS))
+    key = (service_key(credentials.get("api_url", "")), input_field, window, max_pairs)
+    with _batchers_lock:
+        batcher = _batchers.get(key)
+        if batcher is None:
+            batcher = _batchers[key] = MicroBatcher(window, max_pairs)
+            # A dropped batcher's open batch is still sent by its leader
+            while len(_batchers) > MAX_BATCHERS:
+                _batchers.popitem(last=False)
+        _batchers.move_to_end(key)
+        return batcher
@@ -0,0 +1,88 @@
+"""
+End-to-end deadline of one rerank invocation.
+
+With `deadline_ms` set, the invocation has a fixed time budget instead of
+only the per-request `timeout`. The network stage (every shard request,
+including its retries, limiter wait and response parsing) must finish a small
+reserve before the deadline, which is kept for merging the results. Request
+timeouts are cut to the time that is left, so a slow shard times out at the
+deadline instead of holding the whole retrieval. Shards that did not finish
+are left out, and the invocation returns the best top-k of those that did,
+with the unscored documents ranked after them in their original order.
+"""
+
+import time
+from typing import Optional
+
+import requests
+
+DEFAULT_DEADLINE_MS = 0
+# Share of the budget kept after the network stage for merging results
+MERGE_RESERVE = 0.05
+# Never cut a request timeout below this, even right before the deadline
+MIN_REQUEST_TIMEOUT = 0.001
+
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    The invocation deadline passed before the request could be sent.
+    """
+
+
+class Deadline:
+    """
+    Point in time (monotonic clock) by which a stage must be done.
+
+    :param budget: seconds from now
+    """
+
+    def __init__(self, budget: float):
+        self.budget = budget
+        self.expires_at = time.monotonic() + budget
+
+    def remaining(self) -> float:
+        """
+        Seconds left, negative once expired
+        """
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def timeout(self, limit: float) -> float:
+        """
+        Timeout for a request started now: `limit`, cut to the time left
+
+        :param limit: configured request timeout
+        :return: timeout in seconds
+        :raises DeadlineExceeded: if no time is left
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {self.budget * 1000:.0f} ms exceeded")
+        return max(MIN_REQUEST_TIMEOUT, min(limit, remaining))
+
+    def reserve(self, share: float) -> "Deadline":
+        """
+        Deadline of a stage that must leave `share` of the whole budget
+        for the stages after it
+        """
+        stage = Deadline.__new__(Deadline)
+        stage.budget = self.budget * (1 - share)
+        stage.expires_at = self.expires_at - self.budget * share
+        return stage
+
+
+def get_deadline(credentials: dict) -> Optional[Deadline]:
+    """
+    Deadline of an invocation starting now, from the `deadline_ms` credential,
+    or None if it is 0
+
+    :param credentials: model credentials
+    :return: deadline or None
+    """
+    budget_ms = float(credentials.get("deadline_ms") or DEFAULT_DEADLINE_MS)
+    if budget_ms < 0:
+        raise ValueError(f"deadline_ms must not be negative, got {budget_ms}")
+    return Deadline(budget_ms / 1000) if budget_ms > 0 else None
@@ -0,0 +1,58 @@
+"""
+Collapsing of byte-identical documents within one rerank request.
+
+Retrieval over several datasets often returns the same chunk more than once;
+only unique texts are scored and every copy then receives the same score.
+"""
+
+from .sharding import ScoredDocument
+
+
+def collapse_duplicates(documents: list[str]) -> tuple[list[str], list[list[int]]]:
+    """
+    Keep the first occurrence of every document text
+
+    :param documents: docs for reranking
+    :return: (unique texts in first-occurrence order,
+              original indices of each unique text in ascending order)
+    """
+    first_seen: dict[str, int] = {}
+    unique: list[str] = []
+    positions: list[list[int]] = []
+    for index, document in enumerate(documents):
+        slot = first_seen.get(document)
+        if slot is None:
+            first_seen[document] = slot = len(unique)
+            unique.append(document)
+            positions.append([])
+        positions[slot].append(index)
+    return unique, positions
+
+
+def expand_duplicates(
+    scored: list[ScoredDocument],
+    positions: list[list[int]],
+    documents: list[str],
+) -> list[ScoredDocument]:
+    """
+    Fan scores of unique texts back out to every original index
+
+    The result is ordered by original index, so equal scores are broken
+    deterministically in favour of the earlier document.
+
+    :param scored: scored documents indexed into the unique texts
+    :param positions: output of `collapse_duplicates`
+    :param documents: original docs for reranking
+    :return: scored documents indexed into `documents`
+    """
+    expanded = []
+    for doc in scored:
+        if 0 <= doc.index < len(positions):
+            expanded.extend(
+                ScoredDocument(index=index, score=doc.score, text=documents[index])
+                for index in positions[doc.index]
+            )
+        else:
+            expanded.append(doc)
+    expanded.sort(key=lambda doc: doc.index)
+    return expanded
@@ -0,0 +1,172 @@
+"""
+Persistent pair-score store shared by all plugin worker processes.
+
+Scores live in a SQLite database in WAL mode, so any number of processes can
+read while one writes, and a restarted plugin starts with a warm cache.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISK_CACHE_MB = 512
+DB_FILENAME = "scores.sqlite3"
+
+# SQLite limits the number of bound parameters per statement.
+_LOOKUP_CHUNK = 500
+# How many writes happen between two size checks.
+_COMPACT_EVERY = 1000
+
+
+class DiskScoreCache:
+    """
+    SQLite-backed score store with TTL expiry and size-capped compaction.
+
+    Connections are pooled and reused across calls. Reads never write, so the
+    warm path is one indexed `SELECT` per call; the size cap is enforced by
+    periodically deleting the oldest entries and reclaiming their pages.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, ttl: float):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, DB_FILENAME)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._idle: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._connection():
+            pass
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+        if connection is None:
+            connection = self._open()
+        try:
+            yield connection
+        finally:
+            with self._lock:
+                self._idle.append(connection)
+
+    def _open(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(
+            self.path, timeout=5.0, isolation_level=None, check_same_thread=False
+        )
+        connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA mmap_size=67108864")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            " key BLOB PRIMARY KEY,"
+            " score REAL NOT NULL,"
+            " expires_at REAL NOT NULL"
+            ") WITHOUT ROWID"
+        )
+        connection.execute(
+            "CREATE INDEX IF NOT EXISTS scores_expires_at ON scores (expires_at)"
+        )
+        return connection
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, float]:
+        """
+        Look up scores that have not expired
+
+        :param keys: pair keys, see `score_cache.pair_keys`
+        :return: scores of the keys found
+        """
+        now = time.time()
+        found = {}
+        with self._connection() as connection:
+            for start in range(0, len(keys), _LOOKUP_CHUNK):
+                chunk = keys[start : start + _LOOKUP_CHUNK]
+                rows = connection.execute(
+                    "SELECT key, score FROM scores WHERE expires_at > ? AND key IN (%s)"
+                    % ",".join("?" * len(chunk)),
+                    [now, *chunk],
+                )
+                found.update(rows)
+        metrics.incr("disk_cache.hits", len(found))
+        metrics.incr("disk_cache.misses", len(keys) - len(found))
+        return found
+
+    def put_many(self, items: Iterable[tuple[bytes, float]]) -> None:
+        """
+        Store scores
+
+        :param items: (key, score) pairs
+        """
+        expires_at = time.time() + self.ttl
+        rows = [(key, score, expires_at) for key, score in items]
+        if not rows:
+            return
+        with self._connection() as connection:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO scores (key, score, expires_at) VALUES (?, ?, ?)",
+                    rows,
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        with self._lock:
+            self._writes += len(rows)
+            due = self._writes >= _COMPACT_EVERY
+            if due:
+                self._writes = 0
+        if due:
+            self.compact()
+
+    @staticmethod
+    def _size_bytes(connection: sqlite3.Connection) -> int:
+        # Pages freed by deletes stay in the file until the next vacuum.
+        page_count = connection.execute("PRAGMA page_count").fetchone()[0]
+        free_count = connection.execute("PRAGMA freelist_count").fetchone()[0]
+        page_size = connection.execute("PRAGMA page_size").fetchone()[0]
+        return (page_count - free_count) * page_size
+
+    def size_bytes(self) -> int:
+        with self._connection() as connection:
+            return self._size_bytes(connection)
+
+    def compact(self) -> None:
+        """
+        Drop expired entries and, above the size cap, the oldest quarter
+        """
+        with self._connection() as connection:
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    connection.execute(
+                        "DELETE FROM scores WHERE expires_at <= ?", (time.time(),)
+                    )
+                    if self._size_bytes(connection) > self.max_bytes:
+                        count = connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0]
+                        connection.execute(
+                            "DELETE FROM scores WHERE key IN ("
+                            " SELECT key FROM scores ORDER BY expires_at LIMIT ?)",
+                            (max(1, count // 4),),
+                        )
+                        metrics.incr("disk_cache.compactions")
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                connection.execute("PRAGMA incremental_vacuum")
+                connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+            except sqlite3.OperationalError as e:
+                # Another process holds the write lock; it will compact instead.
+                logger.debug(f"Skipped score cache compaction: {str(e)}")
@@ -0,0 +1,178 @@
+"""
+Content-addressed document upload.
+
+Knowledge base chunks rarely change between requests, so instead of sending
+their text with every `/rerank` call the client can refer to documents by
+the SHA-256 of their UTF-8 text:
+
+1. ``POST /documents/missing`` with ``{"hashes": [...]}``; the replica answers
+   which of them it does not store: ``{"missing": [...]}``;
+2. ``POST /documents`` with ``{"documents": {hash: text, ...}}`` uploads only
+   those;
+3. `/rerank` gets ``"document_hashes": [...]`` instead of the texts.
+
+Hashes a replica acknowledged are remembered per replica in a bounded LRU, so
+in the steady state steps 1 and 2 are skipped entirely. A replica that has
+evicted a document answers `/rerank` with 409 and ``{"missing": [...]}``;
+those hashes are forgotten and the request is resent with full texts.
+Services without the endpoints (404, 405, 501) are remembered and get the
+plain payload from then on.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Iterator, Optional
+
+import requests
+
+from .endpoints import service_key
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_MODES = ("off", "on")
+DEFAULT_ACK_CACHE_SIZE = 100_000
+# Upper bound of document text in one `/documents` request
+MAX_UPLOAD_CHARS = 4 * 1024 * 1024
+UNSUPPORTED_STATUS_CODES = (404, 405, 501)
+MISSING_STATUS_CODE = 409
+
+
+def document_hash(text: str) -> str:
+    """
+    Content address of a document: hex SHA-256 of its UTF-8 text
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def missing_hashes(response: requests.Response, codec) -> list[str]:
+    """
+    `missing` list of a `/documents/missing` answer or of a 409 from `/rerank`
+
+    :param response: response
+    :param codec: codec to decode it with
+    :return: hashes the replica does not store
+    """
+    try:
+        return list(codec.decode(response).get("missing", []))
+    except ValueError:
+        return []
+
+
+class DocumentUploader:
+    """
+    Per-replica record of acknowledged document hashes for one service.
+    """
+
+    def __init__(self, ack_cache_size: int = DEFAULT_ACK_CACHE_SIZE):
+        self.ack_cache_size = ack_cache_size
+        self.supported = True
+        self._acked: dict[str, OrderedDict[str, None]] = {}
+        self._lock = threading.Lock()
+
+    def mark_unsupported(self, api_url: str) -> None:
+        logger.info(f"{api_url} has no document upload endpoints, sending texts")
+        self.supported = False
+
+    def is_unsupported(self, response: requests.Response) -> bool:
+        return response.status_code in UNSUPPORTED_STATUS_CODES
+
+    def pending(self, base_url: str, hashes: list[str]) -> list[str]:
+        """
+        Distinct hashes the replica has not acknowledged yet
+
+        Acknowledged ones count as recently used.
+
+        :param base_url: replica URL
+        :param hashes: hashes of the documents of a request
+        :return: hashes to ask the replica about, in first-seen order
+        """
+        with self._lock:
+            acked = self._acked.setdefault(base_url, OrderedDict())
+            pending = []
+            for digest in dict.fromkeys(hashes):
+                if digest in acked:
+                    acked.move_to_end(digest)
+                else:
+                    pending.append(digest)
+        metrics.incr("upload.acked_documents", len(hashes) - len(pending))
+        return pending
+
+    def acknowledge(self, base_url: str, hashes: list[str]) -> None:
+        """
+        Remember that the replica stores these documents
+        """
+        with self._lock:
+            acked = self._acked.setdefault(base_url, OrderedDict())
+            for digest in hashes:
+                acked[digest] = None
+                acked.move_to_end(digest)
+            while len(acked) > self.ack_cache_size:
+                acked.popitem(last=False)
+
+    def forget(self, hashes: list[str]) -> None:
+        """
+        Drop hashes a replica no longer stores, on every replica
+        """
+        with self._lock:
+            for acked in self._acked.values():
+                for digest in hashes:
+                    acked.pop(digest, None)
+
+    def upload_batches(
+        self, missing: list[str], hashes: list[str], documents: list[str]
+    ) -> Iterator[dict[str, str]]:
+        """
+        Split the texts of missing documents into `/documents` request bodies
+
+        :param missing: hashes the replica asked for
+        :param hashes: hashes of `documents`
+        :param documents: docs of the request
+        :return: iterator of {hash: text} maps of bounded size
+        """
+        wanted = set(missing)
+        batch: dict[str, str] = {}
+        size = 0
+        for digest, text in zip(hashes, documents):
+            if digest not in wanted or digest in batch:
+                continue
+            if batch and size + len(text) > MAX_UPLOAD_CHARS:
+                metrics.incr("upload.sent_documents", len(batch))
+                yield batch
+                batch, size = {}, 0
+            batch[digest] = text
+            size += len(text)
+        if batch:
+            metrics.incr("upload.sent_documents", len(batch))
+            yield batch
+
+
+_uploaders: dict[str, DocumentUploader] = {}
+_uploaders_lock = threading.Lock()
+
+
+def get_document_uploader(credentials: dict) -> Optional[DocumentUploader]:
+    """
+    Uploader configured by the `document_upload` and `upload_ack_cache_size`
+    credentials, shared per service, or None if off
+
+    :param credentials: model credentials
+    :return: document uploader or None
+    """
+    mode = credentials.get("document_upload") or "off"
+    if mode not in UPLOAD_MODES:
+        raise ValueError(
+            f"document_upload must be one of {', '.join(UPLOAD_MODES)}, got {mode!r}"
+        )
+    if mode == "off":
+        return None
+    ack_cache_size = int(credentials.get("upload_ack_cache_size") or DEFAULT_ACK_CACHE_SIZE)
+    key = service_key(credentials.get("api_url", ""))
+    with _uploaders_lock:
+        uploader = _uploaders.get(key)
+        if uploader is None:
+            uploader = _uploaders[key] = DocumentUploader(ack_cache_size)
+        uploader.ack_cache_size = ack_cache_size
+        return uploader
@@ -0,0 +1,279 @@
+"""
+Client-side load balancing across several reranker replicas.
+
+The `api_url` credential may list several base URLs separated by commas or
+whitespace. Every request goes to one replica picked by power-of-two-choices:
+two random healthy replicas are compared by their expected wait, the EWMA of
+response latency times the number of requests already in flight plus one,
+and the cheaper one wins.
+
+Replicas are ejected passively after consecutive connection errors, timeouts
+or 5xx responses. Once the ejection period is over a background `/health`
+probe decides whether the replica is readmitted or stays out for longer.
+Replicas the health registry currently reports as down are skipped as well.
+"""
+
+import logging
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from .health import health_registry
+from .metrics import metrics
+from .session_pool import normalize_api_url
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+EJECT_AFTER_FAILURES = 3
+EJECT_SECONDS = 5.0
+MAX_EJECT_SECONDS = 60.0
+PROBE_TIMEOUT = 5.0
+
+_SEPARATOR_RE = re.compile(r"[\s,]+")
+
+
+def parse_api_urls(api_url: str) -> list[str]:
+    """
+    Split an `api_url` credential into replica base URLs
+
+    :param api_url: one URL, or several separated by commas or whitespace
+    :return: base URLs without trailing slashes, duplicates removed
+    """
+    urls: list[str] = []
+    seen = set()
+    for url in _SEPARATOR_RE.split(api_url or ""):
+        url = url.rstrip("/")
+        if url and normalize_api_url(url) not in seen:
+            seen.add(normalize_api_url(url))
+            urls.append(url)
+    return urls
+
+
+def service_key(api_url: str) -> str:
+    """
+    Key identifying the service behind an `api_url` credential
+
+    Replicas serve the same model, so the order in which they are listed
+    does not matter.
+    """
+    return ",".join(sorted(normalize_api_url(url) for url in parse_api_urls(api_url)))
+
+
+class Replica:
+    """
+    Load and health statistics of one reranker replica.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.in_flight = 0
+        self.ewma_latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejections = 0
+        self.ejected_until: Optional[float] = None
+        self.eject_seconds = EJECT_SECONDS
+        self.probing = False
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until is None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "ewma_latency": self.ewma_latency,
+            "requests": self.requests,
+            "failures": self.failures,
+            "ejections": self.ejections,
+        }
+
+
+class Call:
+    """
+    One request in flight on a replica; set `ok` once it has succeeded.
+    """
+
+    def __init__(self, replica: Replica):
+        self.replica = replica
+        self.ok: Optional[bool] = False
+
+
+class EndpointPool:
+    """
+    Thread-safe least-outstanding-requests balancer over a fixed replica set.
+    """
+
+    def __init__(self, urls: list[str]):
+        if not urls:
+            raise ValueError("api_url must contain at least one URL")
+        self.replicas = [Replica(url) for url in urls]
+        self._lock = threading.Lock()
+
+    @property
+    def urls(self) -> list[str]:
+        return [replica.url for replica in self.replicas]
+
+    def _cost(self, replica: Replica, default_latency: float) -> float:
+        latency = replica.ewma_latency if replica.ewma_latency is not None else default_latency
+        return latency * (replica.in_flight + 1)
+
+    def acquire(self, avoid: Optional[set[str]] = None) -> Replica:
+        """
+        Pick a replica for the next request and count it as in flight
+
+        If every replica is ejected, the one due back first is used anyway so
+        callers see the real error instead of an empty pool.
+
+        :param avoid: URLs to skip if another healthy replica is left; the
+                      chosen URL is added to it
+        :return: chosen replica; pass it to `release` when the request ends
+        """
+        now = time.monotonic()
+        with self._lock:
+            for replica in self.replicas:
+                if (
+                    replica.ejected_until is not None
+                    and replica.ejected_until <= now
+                    and not replica.probing
+                ):
+                    replica.probing = True
+                    threading.Thread(
+                        target=self._probe, args=(replica,), name="bge-rerank-probe", daemon=True
+                    ).start()
+
+            healthy = [replica for replica in self.replicas if replica.healthy]
+            # Skip replicas whose last health check failed while others are left
+            healthy = [r for r in healthy if not health_registry.is_down(r.url)] or healthy
+            if avoid:
+                healthy = [r for r in healthy if r.url not in avoid] or healthy
+            if not healthy:
+                chosen = min(self.replicas, key=lambda replica: replica.ejected_until)
+            elif len(healthy) == 1:
+                chosen = healthy[0]
+            else:
+                known = [r.ewma_latency for r in healthy if r.ewma_latency is not None]
+                # Unmeasured replicas are assumed to be as fast as the best one
+                default_latency = min(known) if known else 0.0
+                first, second = random.sample(healthy, 2)
+                chosen = min(
+                    (first, second), key=lambda replica: self._cost(replica, default_latency)
+                )
+            chosen.in_flight += 1
+            chosen.requests += 1
+            if avoid is not None:
+                avoid.add(chosen.url)
+            return chosen
+
+    def release(self, replica: Replica, elapsed: float, ok: Optional[bool]) -> None:
+        """
+        Record the outcome of a request started with `acquire`
+
+        :param replica: replica the request went to
+        :param elapsed: request duration in seconds
+        :param ok: False for connection errors, timeouts and 5xx responses,
+                   None for requests abandoned by the caller
+        """
+        with self._lock:
+            replica.in_flight -= 1
+            if ok is None:
+                return
+            if ok:
+                replica.consecutive_failures = 0
+                if replica.ewma_latency is None:
+                    replica.ewma_latency = elapsed
+                else:
+                    replica.ewma_latency += EWMA_ALPHA * (elapsed - replica.ewma_latency)
+                return
+
+            replica.failures += 1
+            replica.consecutive_failures += 1
+            if (
+                len(self.replicas) > 1
+                and replica.healthy
+                and replica.consecutive_failures >= EJECT_AFTER_FAILURES
+            ):
+                replica.ejected_until = time.monotonic() + replica.eject_seconds
+                replica.ejections += 1
+                metrics.incr("endpoints.ejections")
+                logger.warning(
+                    f"Ejected reranker replica {replica.url} for {replica.eject_seconds:.0f}s "
+                    f"after {replica.consecutive_failures} failures"
+                )
+
+    @contextmanager
+    def track(self, avoid: Optional[set[str]] = None) -> Iterator[Call]:
+        """
+        Run one request on a replica chosen by `acquire`
+
+        The request counts as failed unless the caller sets ``call.ok``.
+
+        :param avoid: see `acquire`
+        :return: context manager yielding the call
+        """
+        call = Call(self.acquire(avoid))
+        started = time.monotonic()
+        try:
+            yield call
+        finally:
+            self.release(call.replica, time.monotonic() - started, call.ok)
+
+    def _probe(self, replica: Replica) -> None:
+        ok = health_registry.check(replica.url, PROBE_TIMEOUT).healthy
+
+        with self._lock:
+            replica.probing = False
+            if ok:
+                replica.ejected_until = None
+                replica.consecutive_failures = 0
+                replica.eject_seconds = EJECT_SECONDS
+                # Latency measured before the ejection is no longer relevant
+                replica.ewma_latency = None
+                logger.info(f"Readmitted reranker replica {replica.url}")
+            else:
+                replica.eject_seconds = min(replica.eject_seconds * 2, MAX_EJECT_SECONDS)
+                replica.ejected_until = time.monotonic() + replica.eject_seconds
+
+    def stats(self) -> list[dict]:
+        """
+        Per-replica statistics, e.g. to spot load skew
+        """
+        with self._lock:
+            return [replica.stats() for replica in self.replicas]
+
+
+_pools: dict[str, EndpointPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_endpoint_pool(api_url: str) -> EndpointPool:
+    """
+    Return the process-wide balancer for the replicas listed in `api_url`
+
+    :param api_url: `api_url` credential
+    :return: endpoint pool shared by all transports with the same replica set
+    """
+    key = service_key(api_url)
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = _pools[key] = EndpointPool(parse_api_urls(api_url))
+        return pool
+
+
+def endpoint_stats() -> dict[str, list[dict]]:
+    """
+    Statistics of every replica set used in this process
+
+    :return: per-replica statistics keyed by the comma-joined replica URLs
+    """
+    with _pools_lock:
+        pools = list(_pools.values())
+    return {",".join(pool.urls): pool.stats() for pool in pools}
@@ -0,0 +1,231 @@
+"""
+Process-wide registry of reranker replica health.
+
+The registry keeps the result of the last `/health` check of every replica;
+any 2xx answer counts as healthy. With `health_check_interval > 0` a daemon
+prober re-checks the replica at that interval over the pooled keep-alive
+sessions, so results stay fresh without anyone waiting on them: credential
+validation answers from the cache and the load balancer skips replicas whose
+last check failed. The interval is kept per replica, and the prober only runs
+while some replica has one.
+"""
+
+import logging
+import threading
+import time
+from typing import NamedTuple, Optional
+from urllib.parse import urljoin
+
+import requests
+
+from .session_pool import get_session, normalize_api_url
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECK_INTERVAL = 0.0
+CHECK_TIMEOUT = 5.0
+# Results older than this many check intervals are not trusted
+FRESHNESS_INTERVALS = 2
+# Seconds results of on-demand checks are trusted for replicas nobody probes
+UNPROBED_TTL = 30.0
+# Replicas nobody asked about for this long are no longer probed
+FORGET_AFTER = 3600.0
+
+
+class HealthStatus(NamedTuple):
+    healthy: bool
+    status_code: Optional[int]
+    detail: str
+    checked_at: float
+
+
+class _Entry:
+    def __init__(self, url: str, credentials: dict, interval: float):
+        self.url = url
+        self.credentials = credentials
+        self.interval = interval
+        self.status: Optional[HealthStatus] = None
+        self.last_used = time.monotonic()
+
+    @property
+    def ttl(self) -> float:
+        return FRESHNESS_INTERVALS * self.interval if self.interval > 0 else UNPROBED_TTL
+
+
+class HealthRegistry:
+    """
+    TTL-cached health status of every known replica, with a background prober.
+    """
+
+    def __init__(self):
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self._prober: Optional[threading.Thread] = None
+
+    def register(self, base_url: str, credentials: Optional[dict] = None) -> None:
+        """
+        Track a replica, and probe it in the background if its credentials
+        set `health_check_interval`
+
+        :param base_url: replica URL
+        :param credentials: credentials the pooled session is configured from;
+                            `health_check_interval` sets the probe interval of
+                            this replica, 0 for none
+        """
+        key = normalize_api_url(base_url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry(base_url, credentials or {}, 0.0)
+            if credentials:
+                entry.credentials = credentials
+                entry.interval = float(
+                    credentials.get("health_check_interval") or DEFAULT_CHECK_INTERVAL
+                )
+            entry.last_used = time.monotonic()
+            if entry.interval > 0 and (self._prober is None or not self._prober.is_alive()):
+                self._prober = threading.Thread(
+                    target=self._probe_forever, name="bge-rerank-health", daemon=True
+                )
+                self._prober.start()
+
+    def cached(self, base_url: str) -> Optional[HealthStatus]:
+        """
+        Last check result if it is still fresh, without any network call
+        """
+        with self._lock:
+            entry = self._entries.get(normalize_api_url(base_url))
+            if entry is None or entry.status is None:
+                return None
+            entry.last_used = time.monotonic()
+            if time.monotonic() - entry.status.checked_at > entry.ttl:
+                return None
+            return entry.status
+
+    def is_down(self, base_url: str) -> bool:
+        """
+        Whether the fresh result of the last check says the replica is unhealthy
+        """
+        status = self.cached(base_url)
+        return status is not None and not status.healthy
+
+    def check(self, base_url: str, timeout: float = CHECK_TIMEOUT) -> HealthStatus:
+        """
+        Call `/health` of a replica now and cache the result
+
+        :param base_url: replica URL
+        :param timeout: request timeout
+        :return: fresh status
+        """
+        key = normalize_api_url(base_url)
+        with self._lock:
+            entry = self._entries.get(key)
+        credentials = entry.credentials if entry is not None else None
+        try:
+            response = get_session(base_url, credentials).get(
+                urljoin(base_url + "/", "health"), timeout=timeout
+            )
+            status = HealthStatus(
+                healthy=response.ok,
+                status_code=response.status_code,
+                detail="" if response.ok else response.text,
+                checked_at=time.monotonic(),
+            )
+        except requests.exceptions.RequestException as e:
+            status = HealthStatus(
+                healthy=False, status_code=None, detail=str(e), checked_at=time.monotonic()
+            )
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry.status is not None and entry.status.healthy != status.healthy:
+                    logger.info(
+                        f"Reranker replica {base_url} is now "
+                        f"{'healthy' if status.healthy else 'unhealthy'}"
+                    )
+                entry.status = status
+        return status
+
+    def status(
+        self, base_url: str, credentials: Optional[dict] = None, timeout: float = CHECK_TIMEOUT
+    ) -> HealthStatus:
+        """
+        Fresh cached status of a replica if it is healthy, otherwise check now
+
+        A cached failure is re-checked, so a replica that was just fixed is
+        not reported as down until the next probe.
+
+        :param base_url: replica URL
+        :param credentials: see `register`
+        :param timeout: timeout of the check, if one is needed
+        :return: health status
+        """
+        self.register(base_url, credentials)
+        status = self.cached(base_url)
+        if status is not None and status.healthy:
+            return status
+        return self.check(base_url, timeout)
+
+    def require_healthy(
+        self,
+        base_urls: list[str],
+        credentials: Optional[dict] = None,
+        timeout: float = CHECK_TIMEOUT,
+    ) -> list[str]:
+        """
+        Check every replica and fail only if none of them is healthy
+
+        Unhealthy replicas are logged; the load balancer skips them while
+        they stay down.
+
+        :param base_urls: replica URLs
+        :param credentials: see `register`
+        :param timeout: timeout of each check that is needed
+        :return: URLs of the healthy replicas
+        :raises ValueError: if no replica is healthy, listing why each failed
+        """
+        healthy, failures = [], []
+        for base_url in base_urls:
+            status = self.status(base_url, credentials, timeout)
+            if status.healthy:
+                healthy.append(base_url)
+            elif status.status_code is None:
+                failures.append(f"{base_url}: {status.detail}")
+            else:
+                failures.append(f"{base_url}: status code {status.status_code}: {status.detail}")
+        if not healthy:
+            raise ValueError(f"No healthy reranker replica: {'; '.join(failures)}")
+        for failure in failures:
+            logger.warning(f"Reranker replica is unhealthy, {failure}")
+        return healthy
+
+    def _probe_forever(self) -> None:
+        while True:
+            with self._lock:
+                intervals = [
+                    entry.interval for entry in self._entries.values() if entry.interval > 0
+                ]
+                if not intervals:
+                    # Started again by `register` once a replica needs probing
+                    self._prober = None
+                    return
+            time.sleep(min(intervals))
+            now = time.monotonic()
+            with self._lock:
+                for key, entry in list(self._entries.items()):
+                    if now - entry.last_used > FORGET_AFTER:
+                        del self._entries[key]
+                due = [
+                    entry.url
+                    for entry in self._entries.values()
+                    if entry.interval > 0
+                    and (entry.status is None or now - entry.status.checked_at >= entry.interval)
+                ]
+            for base_url in due:
+                try:
+                    self.check(base_url)
+                except Exception as e:
+                    logger.debug(f"Health probe of {base_url} failed: {str(e)}")
+
+
+health_registry = HealthRegistry()
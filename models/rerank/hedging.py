@@ -0,0 +1,274 @@
+"""
+Hedged `/rerank` requests against slow replicas.
+
+When a request has not completed after an adaptive delay, the p95 of recent
+successful latencies to the same service, a duplicate is sent to another
+replica (or over another pooled connection when there is only one). The first
+successful answer wins.
+
+The asyncio transport cancels the losing request outright. A blocking
+`requests` call cannot be interrupted, so with the blocking transport the
+loser runs on a shared thread pool until its response arrives, and that
+response is closed at once so its connection goes back to the pool. Requests
+that cannot be hedged, because too few latencies are known or the budget is
+spent, run on the caller's thread with no extra thread at all.
+
+Extra load is capped by a token bucket: every request earns `budget` tokens
+and every hedge spends one, so at most that share of requests is duplicated
+over time.
+"""
+
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable, Optional, TypeVar
+
+from .endpoints import service_key
+from .metrics import metrics
+
+T = TypeVar("T")
+
+HEDGING_MODES = ("off", "on")
+HEDGE_QUANTILE = 0.95
+DEFAULT_HEDGE_BUDGET = 10.0
+# Latencies are only trusted once this many were observed
+MIN_SAMPLES = 20
+LATENCY_WINDOW = 512
+MIN_HEDGE_DELAY = 0.005
+# Hedges that can be sent back to back after a quiet period
+MAX_HEDGE_BURST = 10.0
+# Threads of the pool running hedgeable attempts of the blocking transport
+HEDGE_WORKERS = 64
+
+
+class _Race:
+    """
+    Outcomes of the attempts of one hedged request, as
+    (hedge, value, error, elapsed); values arriving after the race was
+    decided are passed to `discard`.
+    """
+
+    def __init__(self, discard: Optional[Callable[[T], None]]):
+        self.discard = discard
+        self.results: queue.Queue = queue.Queue()
+        # Set once the first attempt got a worker thread
+        self.started = threading.Event()
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def run(self, attempt: Callable[[], T], hedge: bool) -> None:
+        self.started.set()
+        started = time.monotonic()
+        try:
+            outcome = (hedge, attempt(), None, time.monotonic() - started)
+        except Exception as e:
+            outcome = (hedge, None, e, 0.0)
+        with self._lock:
+            if not self._finished:
+                self.results.put(outcome)
+                return
+        self._discard(outcome)
+
+    def finish(self) -> None:
+        """Discard outcomes nobody will read, now and later"""
+        leftovers = []
+        with self._lock:
+            self._finished = True
+            while not self.results.empty():
+                leftovers.append(self.results.get_nowait())
+        for outcome in leftovers:
+            self._discard(outcome)
+
+    def _discard(self, outcome: tuple) -> None:
+        _, value, error, _ = outcome
+        if error is None and self.discard is not None:
+            self.discard(value)
+
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=HEDGE_WORKERS, thread_name_prefix="bge-rerank-hedge"
+            )
+        return _executor
+
+
+class HedgePolicy:
+    """
+    Latency history and hedge budget shared by all requests to one service.
+    """
+
+    def __init__(
+        self, budget: float = DEFAULT_HEDGE_BUDGET / 100, quantile: float = HEDGE_QUANTILE
+    ):
+        self.budget = budget
+        self.quantile = quantile
+        self._latencies: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+
+    def delay(self) -> Optional[float]:
+        """
+        Seconds to wait before hedging, or None until enough latencies are known
+        """
+        with self._lock:
+            if len(self._latencies) < MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return max(MIN_HEDGE_DELAY, ordered[int(self.quantile * (len(ordered) - 1))])
+
+    def record(self, elapsed: float) -> None:
+        """
+        Add the latency of a successful request to the history
+        """
+        with self._lock:
+            self._latencies.append(elapsed)
+
+    def _admit(self) -> None:
+        with self._lock:
+            self._tokens = min(self._tokens + self.budget, MAX_HEDGE_BURST)
+
+    def _has_token(self) -> bool:
+        with self._lock:
+            return self._tokens >= 1
+
+    def _spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1:
+                metrics.incr("hedge.budget_exhausted")
+                return False
+            self._tokens -= 1
+        metrics.incr("hedge.sent")
+        return True
+
+    def run(
+        self, attempt: Callable[[], T], discard: Optional[Callable[[T], None]] = None
+    ) -> T:
+        """
+        Call `attempt`, and once more concurrently if the first call is slow
+
+        `attempt` must raise on failure; a failed attempt makes the caller
+        wait for the other one instead of failing immediately.
+
+        :param attempt: blocking callable sending one request
+        :param discard: called with the result of the losing attempt, e.g. to
+                        close its response
+        :return: result of the first attempt that succeeded
+        """
+        self._admit()
+        delay = self.delay()
+        if delay is None or not self._has_token():
+            # No hedge could be sent, so there is nothing to wait for concurrently
+            started = time.monotonic()
+            value = attempt()
+            elapsed = time.monotonic() - started
+            if delay is not None and elapsed > delay:
+                metrics.incr("hedge.budget_exhausted")
+            self._won(False, elapsed)
+            return value
+
+        race = _Race(discard)
+        executor = _get_executor()
+        futures = [executor.submit(race.run, attempt, False)]
+        try:
+            # Waiting for a free worker is not the service being slow, so
+            # the hedge delay starts when the first attempt does
+            race.started.wait()
+            try:
+                outcome = race.results.get(timeout=delay)
+            except queue.Empty:
+                if self._spend():
+                    futures.append(executor.submit(race.run, attempt, True))
+                outcome = race.results.get()
+
+            outstanding = len(futures)
+            while True:
+                outstanding -= 1
+                hedge, value, error, elapsed = outcome
+                if error is None:
+                    self._won(hedge, elapsed)
+                    return value
+                if outstanding == 0:
+                    raise error
+                outcome = race.results.get()
+        finally:
+            race.finish()
+            # A hedge still queued for a thread is not sent at all
+            for future in futures:
+                future.cancel()
+
+    async def arun(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """
+        Coroutine version of `run`; the losing attempt is cancelled
+
+        :param attempt: factory of a coroutine sending one request
+        :return: result of the first attempt that succeeded
+        """
+        self._admit()
+        delay = self.delay()
+
+        async def run_attempt(hedge: bool):
+            started = time.monotonic()
+            return hedge, await attempt(), time.monotonic() - started
+
+        pending = {asyncio.ensure_future(run_attempt(False))}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done and self._spend():
+                pending.add(asyncio.ensure_future(run_attempt(True)))
+
+            error: Optional[BaseException] = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        hedge, value, elapsed = task.result()
+                        self._won(hedge, elapsed)
+                        return value
+                    error = error or task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def _won(self, hedge: bool, elapsed: float) -> None:
+        self.record(elapsed)
+        if hedge:
+            metrics.incr("hedge.won")
+
+
+_policies: dict[str, HedgePolicy] = {}
+_policies_lock = threading.Lock()
+
+
+def get_hedge_policy(credentials: dict) -> Optional[HedgePolicy]:
+    """
+    Hedge policy configured by the `hedging` and `hedge_budget` credentials,
+    shared per service, or None if hedging is off
+
+    :param credentials: model credentials
+    :return: hedge policy or None
+    """
+    mode = credentials.get("hedging") or "off"
+    if mode not in HEDGING_MODES:
+        raise ValueError(f"hedging must be one of {', '.join(HEDGING_MODES)}, got {mode!r}")
+    if mode == "off":
+        return None
+    budget = float(credentials.get("hedge_budget") or DEFAULT_HEDGE_BUDGET) / 100
+    key = service_key(credentials.get("api_url", ""))
+    with _policies_lock:
+        policy = _policies.get(key)
+        if policy is None:
+            policy = _policies[key] = HedgePolicy(budget)
+        policy.budget = budget
+        return policy
@@ -0,0 +1,162 @@
+"""
+Per-replica latency model and the request timeouts derived from it.
+
+The fixed `timeout` credential has to fit the largest legitimate request, so
+a small request to a hung replica waits just as long before failing. With
+`adaptive_timeout: on` every replica keeps an online fit of its response time
+
+    latency = base + per_document * documents + per_kb * kilobytes
+
+updated after each successful request by recursive least squares with
+exponential forgetting, so the fit follows a replica that gets faster or
+slower. Each request gets a (connect, read) timeout pair: the read timeout is
+the predicted latency times `timeout_safety_factor`, the connect timeout is
+the base latency times the same factor. Both have a floor and are capped by
+`timeout`.
+
+A request that times out on an adaptive timeout doubles the timeouts of that
+replica, and later successes bring them back down, so a model that
+underestimates cannot keep failing large batches.
+"""
+
+import threading
+from typing import Optional
+
+import numpy as np
+
+from .metrics import metrics
+from .session_pool import normalize_api_url
+
+ADAPTIVE_TIMEOUT_MODES = ("off", "on")
+DEFAULT_SAFETY_FACTOR = 4.0
+# The configured timeout is used until this many latencies were observed
+MIN_SAMPLES = 10
+# Weight of an observation halves after about 35 newer ones
+FORGETTING = 0.98
+INITIAL_COVARIANCE = 1e4
+# Forgetting is paused while the covariance is this large, which happens when
+# request sizes barely vary, to keep the fit from blowing up
+MAX_COVARIANCE_TRACE = 1e8
+MIN_CONNECT_TIMEOUT = 0.5
+MIN_READ_TIMEOUT = 1.0
+MAX_INFLATION = 64.0
+
+
+class LatencyModel:
+    """
+    Online latency fit of one replica.
+
+    :param safety_factor: multiplier applied to predicted latencies
+    """
+
+    def __init__(self, safety_factor: float = DEFAULT_SAFETY_FACTOR):
+        self.safety_factor = safety_factor
+        self.samples = 0
+        self.inflation = 1.0
+        # Coefficients of (1, documents, kilobytes)
+        self._theta = np.zeros(3)
+        self._covariance = np.eye(3) * INITIAL_COVARIANCE
+        self._lock = threading.Lock()
+
+    def observe(self, documents: int, kilobytes: float, elapsed: float) -> None:
+        """
+        Update the fit with the latency of a successful request
+
+        :param documents: documents in the request
+        :param kilobytes: text size of the request
+        :param elapsed: seconds until the response headers arrived
+        """
+        x = np.array([1.0, documents, kilobytes])
+        with self._lock:
+            px = self._covariance @ x
+            gain = px / (FORGETTING + x @ px)
+            self._theta += gain * (elapsed - self._theta @ x)
+            self._covariance -= np.outer(gain, px)
+            if np.trace(self._covariance) < MAX_COVARIANCE_TRACE:
+                self._covariance /= FORGETTING
+            self.samples += 1
+            self.inflation = max(1.0, self.inflation / 2)
+
+    def predict(self, documents: int, kilobytes: float) -> float:
+        """
+        Expected latency in seconds
+
+        Negative coefficients, which correlated inputs can produce, are taken
+        as zero, so the prediction errs on the long side.
+        """
+        with self._lock:
+            base, per_document, per_kb = np.maximum(self._theta, 0.0)
+        return float(base + per_document * documents + per_kb * kilobytes)
+
+    def timeouts(self, documents: int, kilobytes: float, limit: float) -> tuple[float, float]:
+        """
+        (connect, read) timeouts of a request, each at most `limit`
+
+        :param documents: documents in the request
+        :param kilobytes: text size of the request
+        :param limit: configured timeout
+        :return: `(limit, limit)` until enough latencies were observed
+        """
+        if self.samples < MIN_SAMPLES:
+            return limit, limit
+        with self._lock:
+            base = max(float(self._theta[0]), 0.0)
+            scale = self.safety_factor * self.inflation
+        connect = min(limit, max(MIN_CONNECT_TIMEOUT, scale * base))
+        read = min(limit, max(MIN_READ_TIMEOUT, scale * self.predict(documents, kilobytes)))
+        metrics.observe("timeout.read_seconds", read)
+        return connect, read
+
+    def timed_out(self, timeouts: tuple[float, float], limit: float) -> None:
+        """
+        Record a request that timed out with `timeouts`; if they were shorter
+        than `limit`, later requests to the replica get twice as long
+        """
+        if min(timeouts) >= limit:
+            return
+        metrics.incr("timeout.adaptive_expired")
+        with self._lock:
+            self.inflation = min(MAX_INFLATION, self.inflation * 2)
+
+    def stats(self) -> dict:
+        with self._lock:
+            base, per_document, per_kb = self._theta.tolist()
+        return {
+            "samples": self.samples,
+            "base": base,
+            "per_document": per_document,
+            "per_kb": per_kb,
+            "inflation": self.inflation,
+        }
+
+
+_models: dict[str, LatencyModel] = {}
+_models_lock = threading.Lock()
+
+
+def get_latency_model(base_url: str, credentials: dict) -> Optional[LatencyModel]:
+    """
+    Latency model of one replica, configured by the `adaptive_timeout` and
+    `timeout_safety_factor` credentials, or None if adaptive timeouts are off
+
+    :param base_url: replica URL
+    :param credentials: model credentials
+    :return: model shared by all requests to the replica, or None
+    """
+    mode = credentials.get("adaptive_timeout") or "off"
+    if mode not in ADAPTIVE_TIMEOUT_MODES:
+        raise ValueError(
+            f"adaptive_timeout must be one of {', '.join(ADAPTIVE_TIMEOUT_MODES)}, got {mode!r}"
+        )
+    if mode == "off":
+        return None
+    safety_factor = float(credentials.get("timeout_safety_factor") or DEFAULT_SAFETY_FACTOR)
+    if safety_factor < 1:
+        raise ValueError(f"timeout_safety_factor must be at least 1, got {safety_factor}")
+    key = normalize_api_url(base_url)
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            model = _models[key] = LatencyModel(safety_factor)
+        model.safety_factor = safety_factor
+        return model
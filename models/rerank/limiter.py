@@ -0,0 +1,294 @@
+"""
+Adaptive client-side concurrency limit per reranker service.
+
+The limit on requests in flight is learned from the service's answers:
+
+* overload signals (429, 503, timeouts, connection errors) halve it, at most
+  once per round trip: only requests started after the last decrease count;
+* a latency gradient shrinks it gently when the recent per-document latency
+  (short EWMA) drifts above the long-term baseline (long EWMA), i.e. when
+  requests start queueing on the server;
+* otherwise it grows additively, by about one per limit's worth of requests,
+  while the limit is actually being used or calls are queued for it.
+
+Calls above the limit wait in a FIFO queue of bounded size for a bounded time
+and fail with `ConcurrencyLimitError` if it is full or their wait runs out.
+Whenever a slot frees up or the limit grows, queued calls are admitted until
+the limit is reached again. Blocking callers and coroutines on the asyncio
+transport loop share one queue.
+"""
+
+import asyncio
+import threading
+import time
+from collections import deque
+from typing import Optional
+
+import requests
+
+from .endpoints import service_key
+from .metrics import metrics
+from .resilience import CircuitOpenError
+
+LIMITER_MODES = ("off", "adaptive")
+DEFAULT_MAX_CONCURRENCY = 64
+DEFAULT_QUEUE_SIZE = 256
+DEFAULT_QUEUE_TIMEOUT = 10.0
+INITIAL_LIMIT = 8
+MIN_LIMIT = 1
+DECREASE_RATIO = 0.5
+GRADIENT_RATIO = 0.9
+# Short-term latency this much above the long-term baseline means queueing
+LATENCY_TOLERANCE = 1.5
+SHORT_ALPHA = 0.3
+LONG_ALPHA = 0.02
+
+# Outcomes passed to `release`
+OK = "ok"
+OVERLOADED = "overloaded"
+IGNORED = "ignored"
+
+
+class ConcurrencyLimitError(requests.exceptions.RetryError):
+    """
+    Raised when a call cannot get a slot within its queue wait.
+    """
+
+
+def classify(
+    response: Optional[requests.Response] = None, error: Optional[BaseException] = None
+) -> str:
+    """
+    Outcome of a request as seen by the limiter
+
+    :param response: response, if one was received
+    :param error: exception raised instead
+    :return: `OK`, `OVERLOADED` or `IGNORED`
+    """
+    if error is not None:
+        if isinstance(error, CircuitOpenError):
+            return IGNORED
+        if isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout)):
+            return OVERLOADED
+        return IGNORED
+    if response.status_code in (429, 503):
+        return OVERLOADED
+    return OK if response.ok else IGNORED
+
+
+class _Waiter:
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop
+        self.event = loop.create_future() if loop is not None else threading.Event()
+        self.granted = False
+
+    def wake(self) -> None:
+        self.granted = True
+        if self.loop is None:
+            self.event.set()
+        else:
+            self.loop.call_soon_threadsafe(self._resolve)
+
+    def _resolve(self) -> None:
+        if not self.event.done():
+            self.event.set_result(None)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD / latency-gradient concurrency limit with a bounded wait queue.
+    """
+
+    def __init__(
+        self,
+        max_limit: int = DEFAULT_MAX_CONCURRENCY,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+    ):
+        self.max_limit = max_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._limit = float(min(INITIAL_LIMIT, max_limit))
+        self._in_flight = 0
+        self._queue: deque[_Waiter] = deque()
+        self._short: Optional[float] = None
+        self._long: Optional[float] = None
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        return max(MIN_LIMIT, int(self._limit))
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "latency_short": self._short,
+                "latency_long": self._long,
+            }
+
+    def _try_enter(self, waiter_factory) -> Optional[_Waiter]:
+        """Take a free slot (returns None) or enqueue a waiter"""
+        with self._lock:
+            if not self._queue and self._in_flight < self.limit:
+                self._in_flight += 1
+                return None
+            if len(self._queue) >= self.queue_size:
+                metrics.incr("limiter.rejected")
+                raise ConcurrencyLimitError(
+                    f"Concurrency limit {self.limit} reached and {len(self._queue)} calls queued"
+                )
+            waiter = waiter_factory()
+            self._queue.append(waiter)
+            return waiter
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        with self._lock:
+            if waiter.granted:
+                # The slot was handed over just as the wait ran out
+                self._release_slot()
+            else:
+                self._queue.remove(waiter)
+        metrics.incr("limiter.rejected")
+
+    def _wait_budget(self, deadline: Optional[float]) -> float:
+        return self.queue_timeout if deadline is None else min(self.queue_timeout, deadline)
+
+    def acquire(self, deadline: Optional[float] = None) -> float:
+        """
+        Wait for a slot, blocking the calling thread
+
+        :param deadline: longest acceptable wait in seconds, besides the queue timeout
+        :return: start time to pass to `release`
+        :raises ConcurrencyLimitError: if the queue is full or the wait runs out
+        """
+        started = time.monotonic()
+        waiter = self._try_enter(_Waiter)
+        if waiter is not None:
+            if not waiter.event.wait(self._wait_budget(deadline)):
+                self._abandon(waiter)
+                raise ConcurrencyLimitError("Timed out waiting for a concurrency slot")
+        metrics.observe("limiter.queue_wait_seconds", time.monotonic() - started)
+        return time.monotonic()
+
+    async def aacquire(self, deadline: Optional[float] = None) -> float:
+        """
+        Coroutine version of `acquire`
+        """
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        waiter = self._try_enter(lambda: _Waiter(loop))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(
+                    asyncio.shield(waiter.event), self._wait_budget(deadline)
+                )
+            except asyncio.TimeoutError:
+                self._abandon(waiter)
+                raise ConcurrencyLimitError("Timed out waiting for a concurrency slot")
+            except asyncio.CancelledError:
+                self._abandon(waiter)
+                raise
+        metrics.observe("limiter.queue_wait_seconds", time.monotonic() - started)
+        return time.monotonic()
+
+    def _release_slot(self) -> None:
+        """Free a slot and admit waiters into it; caller holds the lock"""
+        self._in_flight -= 1
+        self._admit_waiters()
+
+    def _admit_waiters(self) -> None:
+        """
+        Wake queued calls while the limit has room for them; caller holds
+        the lock. Runs after every release and limit change, so a raised
+        limit is used at once.
+        """
+        while self._queue and self._in_flight < self.limit:
+            self._in_flight += 1
+            self._queue.popleft().wake()
+
+    def release(self, started: float, documents: int, outcome: str) -> None:
+        """
+        Free a slot and adapt the limit to the outcome of its request
+
+        :param started: value returned by `acquire`
+        :param documents: number of documents sent, to normalize latency
+        :param outcome: `OK`, `OVERLOADED`, or `IGNORED` for anything that
+                        says nothing about the service load
+        """
+        elapsed = time.monotonic() - started
+        with self._lock:
+            if outcome == OVERLOADED:
+                if started >= self._last_decrease:
+                    self._limit = max(MIN_LIMIT, self._limit * DECREASE_RATIO)
+                    self._last_decrease = time.monotonic()
+            elif outcome == OK:
+                sample = elapsed / max(1, documents)
+                if self._short is None:
+                    self._short = self._long = sample
+                self._short += SHORT_ALPHA * (sample - self._short)
+                self._long += LONG_ALPHA * (sample - self._long)
+                if self._short > LATENCY_TOLERANCE * self._long:
+                    if started >= self._last_decrease:
+                        self._limit = max(MIN_LIMIT, self._limit * GRADIENT_RATIO)
+                        self._last_decrease = time.monotonic()
+                elif self._queue or self._in_flight >= self.limit:
+                    # Only grow while there is demand for more slots
+                    self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._release_slot()
+
+
+_limiters: dict[str, AdaptiveLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(credentials: dict) -> Optional[AdaptiveLimiter]:
+    """
+    Limiter configured by the `concurrency_limit`, `max_concurrency`,
+    `limiter_queue_size` and `limiter_queue_timeout` credentials, shared per
+    service, or None if off
+
+    :param credentials: model credentials
+    :return: limiter or None
+    """
+    mode = credentials.get("concurrency_limit") or "off"
+    if mode not in LIMITER_MODES:
+        raise ValueError(
+            f"concurrency_limit must be one of {', '.join(LIMITER_MODES)}, got {mode!r}"
+        )
+    if mode == "off":
+        return None
+    max_limit = max(MIN_LIMIT, int(credentials.get("max_concurrency") or DEFAULT_MAX_CONCURRENCY))
+    queue_size = int(credentials.get("limiter_queue_size") or DEFAULT_QUEUE_SIZE)
+    queue_timeout = float(credentials.get("limiter_queue_timeout") or DEFAULT_QUEUE_TIMEOUT)
+    key = service_key(credentials.get("api_url", ""))
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = AdaptiveLimiter(max_limit, queue_size, queue_timeout)
+        limiter.max_limit = max_limit
+        limiter.queue_size = queue_size
+        limiter.queue_timeout = queue_timeout
+        return limiter
+
+
+def limiter_stats() -> dict[str, dict]:
+    """
+    Current limit, requests in flight and queue depth of every service
+
+    :return: limiter statistics keyed by service
+    """
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {key: limiter.stats() for key, limiter in limiters.items()}
@@ -0,0 +1,284 @@
+"""
+In-process cross-encoder backend.
+
+With `backend: local` the plugin scores (query, document) pairs itself with an
+ONNX export of the cross-encoder instead of calling the reranker service,
+which removes the network round trip for small deployments. Int8-quantized
+exports load the same way and are the ones that fit the plugin memory limit.
+The model directory holds the `.onnx` file and the Hugging Face
+`tokenizer.json` next to it.
+
+The model is loaded on first use and kept for the life of the plugin process.
+Pairs are sorted by token length and cut into batches, each padded only to its
+own longest pair, so a few long documents do not make every short one pay for
+their padding. onnxruntime runs every batch on `local_threads` CPU threads.
+
+`onnxruntime` and `tokenizers` are optional and only needed by this backend.
+"""
+
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+
+from .metrics import metrics
+from .sharding import ScoredDocument
+from .truncation import DEFAULT_CONTEXT_SIZE
+
+try:
+    import onnxruntime
+except ImportError:  # optional backend
+    onnxruntime = None
+
+try:
+    import tokenizers
+except ImportError:  # optional backend
+    tokenizers = None
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("http", "local")
+DEFAULT_LOCAL_BATCH_SIZE = 16
+# 0 lets onnxruntime use one thread per physical core
+DEFAULT_LOCAL_THREADS = 0
+# resource.memory of manifest.yaml, used if the manifest cannot be read
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+# Loading holds the file contents and the optimized graph at the same time
+LOAD_OVERHEAD = 1.5
+MODEL_FILE_NAMES = ("model_quantized.onnx", "model.onnx")
+TOKENIZER_FILE_NAME = "tokenizer.json"
+
+_MANIFEST_PATH = Path(__file__).resolve().parents[2] / "manifest.yaml"
+_MEMORY_RE = re.compile(r"^\s*memory:\s*(\d+)\s*$", re.MULTILINE)
+
+
+def memory_limit() -> int:
+    """
+    Memory the plugin process may use, from `resource.memory` in manifest.yaml
+    """
+    try:
+        match = _MEMORY_RE.search(_MANIFEST_PATH.read_text(encoding="utf-8"))
+    except OSError:
+        match = None
+    return int(match.group(1)) if match else DEFAULT_MEMORY_LIMIT
+
+
+def resident_memory() -> int:
+    """
+    Resident set size of this process in bytes, 0 where it cannot be read
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def find_model_file(model_dir: Path) -> Path:
+    """
+    ONNX file of `model_dir`: a quantized export if present, else `model.onnx`,
+    else the only `.onnx` file there
+    """
+    for name in MODEL_FILE_NAMES:
+        if (model_dir / name).is_file():
+            return model_dir / name
+    candidates = sorted(model_dir.glob("*.onnx"))
+    if len(candidates) != 1:
+        raise ValueError(
+            f"Expected {' or '.join(MODEL_FILE_NAMES)} or a single .onnx file in {model_dir}"
+        )
+    return candidates[0]
+
+
+def check_memory(needed: int, what: str) -> None:
+    """
+    Raise ValueError if `needed` more bytes would exceed the plugin memory limit
+    """
+    limit = memory_limit()
+    used = resident_memory()
+    if used + needed > limit:
+        raise ValueError(
+            f"{what} needs about {needed // 2**20} MB on top of the {used // 2**20} MB "
+            f"already in use, but the plugin may use {limit // 2**20} MB "
+            "(resource.memory in manifest.yaml); use a quantized export or raise the limit"
+        )
+
+
+class LocalCrossEncoder:
+    """
+    Cross-encoder running on an onnxruntime session in this process.
+
+    :param session: onnxruntime session, or any object with the same
+                    `get_inputs()` and `run(None, feeds)` methods
+    :param tokenizer: `tokenizers.Tokenizer` of the model
+    :param max_length: longest pair in tokens; longer pairs are truncated
+    :param batch_size: pairs per forward pass
+    """
+
+    def __init__(
+        self,
+        session: Any,
+        tokenizer: Any,
+        max_length: int = DEFAULT_CONTEXT_SIZE,
+        batch_size: int = DEFAULT_LOCAL_BATCH_SIZE,
+    ):
+        if max_length < 1 or batch_size < 1:
+            raise ValueError("max_length and batch_size must be positive")
+        self.session = session
+        self.input_names = {model_input.name for model_input in session.get_inputs()}
+        if "input_ids" not in self.input_names:
+            raise ValueError("The model has no input_ids input")
+        self.tokenizer = tokenizer
+        tokenizer.no_padding()
+        tokenizer.enable_truncation(max_length)
+        pad_id = tokenizer.token_to_id("<pad>")
+        self.pad_id = 0 if pad_id is None else pad_id
+        self.max_length = max_length
+        self.batch_size = batch_size
+
+    @classmethod
+    def load(
+        cls,
+        model_dir: str,
+        threads: int = DEFAULT_LOCAL_THREADS,
+        max_length: int = DEFAULT_CONTEXT_SIZE,
+        batch_size: int = DEFAULT_LOCAL_BATCH_SIZE,
+    ) -> "LocalCrossEncoder":
+        """
+        Load the model of `model_dir` after checking it fits in memory
+        """
+        if onnxruntime is None or tokenizers is None:
+            raise ValueError("backend 'local' requires the onnxruntime and tokenizers packages")
+        directory = Path(model_dir).expanduser()
+        if not directory.is_dir():
+            raise ValueError(f"local_model_path {directory} is not a directory")
+        model_file = find_model_file(directory)
+        tokenizer_file = directory / TOKENIZER_FILE_NAME
+        if not tokenizer_file.is_file():
+            raise ValueError(f"{TOKENIZER_FILE_NAME} not found in {directory}")
+        check_memory(
+            int(model_file.stat().st_size * LOAD_OVERHEAD) + tokenizer_file.stat().st_size,
+            f"Model {model_file}",
+        )
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        # Batches of one request run one after another
+        options.inter_op_num_threads = 1
+        session = onnxruntime.InferenceSession(
+            str(model_file), options, providers=["CPUExecutionProvider"]
+        )
+        encoder = cls(
+            session, tokenizers.Tokenizer.from_file(str(tokenizer_file)), max_length, batch_size
+        )
+        logger.info(
+            f"Loaded {model_file}, process now uses {resident_memory() // 2**20} MB "
+            f"of {memory_limit() // 2**20} MB"
+        )
+        return encoder
+
+    def score(self, query: str, documents: list[str]) -> np.ndarray:
+        """
+        Score every (query, document) pair
+
+        :param query: search query
+        :param documents: documents to score
+        :return: float32 scores in document order
+        """
+        scores = np.empty(len(documents), dtype=np.float32)
+        if not documents:
+            return scores
+        encodings = self.tokenizer.encode_batch([(query, document) for document in documents])
+        lengths = np.fromiter(
+            (len(encoding.ids) for encoding in encodings), dtype=np.int64, count=len(encodings)
+        )
+        order = np.argsort(lengths, kind="stable")
+        padded = 0
+        for start in range(0, len(order), self.batch_size):
+            batch = order[start : start + self.batch_size]
+            width = int(lengths[batch].max())
+            padded += width * len(batch)
+            input_ids = np.full((len(batch), width), self.pad_id, dtype=np.int64)
+            attention_mask = np.zeros((len(batch), width), dtype=np.int64)
+            token_type_ids = np.zeros((len(batch), width), dtype=np.int64)
+            for row, index in enumerate(batch):
+                encoding = encodings[index]
+                length = len(encoding.ids)
+                input_ids[row, :length] = encoding.ids
+                attention_mask[row, :length] = 1
+                token_type_ids[row, :length] = encoding.type_ids
+            feeds = {
+                name: array
+                for name, array in (
+                    ("input_ids", input_ids),
+                    ("attention_mask", attention_mask),
+                    ("token_type_ids", token_type_ids),
+                )
+                if name in self.input_names
+            }
+            logits = np.asarray(self.session.run(None, feeds)[0], dtype=np.float32)
+            scores[batch] = logits.reshape(len(batch), -1)[:, 0]
+        metrics.incr("local.pairs", len(documents))
+        metrics.incr("local.padding_tokens", padded - int(lengths.sum()))
+        return scores
+
+    def rerank(self, query: str, documents: list[str]) -> list[ScoredDocument]:
+        """
+        Score every document; unlike the HTTP path there is no top-k cut,
+        since every score is computed anyway
+
+        :param query: search query
+        :param documents: documents to score
+        :return: scored documents indexed into `documents`
+        """
+        return [
+            ScoredDocument(index=index, score=float(score), text=document)
+            for index, (document, score) in enumerate(zip(documents, self.score(query, documents)))
+        ]
+
+
+_encoders: dict[str, LocalCrossEncoder] = {}
+_encoder_settings: dict[str, tuple[int, int]] = {}
+_encoders_lock = threading.Lock()
+
+
+def get_local_backend(credentials: dict) -> Optional[LocalCrossEncoder]:
+    """
+    Return the process-wide local cross-encoder, or None for `backend: http`
+
+    The model is loaded from `local_model_path` on first use and reloaded only
+    if `local_threads` or `context_size` change; `local_batch_size` applies
+    immediately.
+
+    :param credentials: model credentials
+    :return: local cross-encoder or None
+    """
+    backend = credentials.get("backend") or "http"
+    if backend not in BACKENDS:
+        raise ValueError(f"backend must be one of {', '.join(BACKENDS)}, got {backend!r}")
+    if backend == "http":
+        return None
+    model_dir = (credentials.get("local_model_path") or "").strip()
+    if not model_dir:
+        raise ValueError("backend 'local' requires local_model_path")
+    threads = int(credentials.get("local_threads") or DEFAULT_LOCAL_THREADS)
+    max_length = int(credentials.get("context_size") or DEFAULT_CONTEXT_SIZE)
+    batch_size = int(credentials.get("local_batch_size") or DEFAULT_LOCAL_BATCH_SIZE)
+    if threads < 0 or batch_size < 1:
+        raise ValueError("local_threads must be non-negative and local_batch_size positive")
+
+    with _encoders_lock:
+        encoder = _encoders.get(model_dir)
+        if encoder is None or _encoder_settings[model_dir] != (threads, max_length):
+            # Release the old session before the memory check of the new one
+            _encoders.pop(model_dir, None)
+            encoder = None
+            encoder = LocalCrossEncoder.load(model_dir, threads, max_length, batch_size)
+            _encoders[model_dir] = encoder
+            _encoder_settings[model_dir] = (threads, max_length)
+        encoder.batch_size = batch_size
+        return encoder
@@ -0,0 +1,64 @@
+"""
+In-process counters and timings for the rerank client.
+
+Values are process-wide and meant for sizing and debugging: call
+`metrics.snapshot()` from a debugger or log it periodically.
+"""
+
+import threading
+from typing import Any
+
+
+class Metrics:
+    """
+    Thread-safe registry of counters and value summaries.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: dict[str, float] = {}
+        self._summaries: dict[str, dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        """
+        Add `value` to counter `name`
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """
+        Record one observation of `name`, e.g. a duration in seconds
+        """
+        with self._lock:
+            summary = self._summaries.get(name)
+            if summary is None:
+                summary = {"count": 0, "sum": 0.0, "max": value, "last": value}
+                self._summaries[name] = summary
+            summary["count"] += 1
+            summary["sum"] += value
+            summary["max"] = max(summary["max"], value)
+            summary["last"] = value
+
+    def snapshot(self) -> dict[str, Any]:
+        """
+        Return a copy of all counters and summaries
+        """
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {
+                    name: dict(summary) for name, summary in self._summaries.items()
+                },
+            }
+
+    def reset(self) -> None:
+        """
+        Drop all recorded values
+        """
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+
+metrics = Metrics()
@@ -0,0 +1,116 @@
+"""
+Lexical BM25 prefilter run before the cross-encoder.
+
+Cross-encoder cost grows linearly with the number of candidates, while only
+the best few are returned. A cheap BM25 pass over the incoming documents keeps
+the most promising candidates; the rest are never sent to the service and get
+a fixed floor score.
+"""
+
+import math
+import re
+from collections import Counter
+from typing import Optional
+
+import numpy as np
+
+from .truncation import CJK_RANGES
+
+PREFILTER_MODES = ("off", "bm25")
+DEFAULT_FLOOR_SCORE = -1e4
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TERM_RE = re.compile(rf"[{CJK_RANGES}]|[^\W{CJK_RANGES}]+")
+
+
+def tokenize(text: str) -> list[str]:
+    """
+    Lower-cased word terms; CJK characters are terms on their own
+    """
+    return _TERM_RE.findall(text.lower())
+
+
+def bm25_scores(query: str, documents: list[str]) -> np.ndarray:
+    """
+    Okapi BM25 score of every document for `query`
+
+    Term frequencies are collected per document once; the scoring itself is
+    vectorized over all documents for each query term.
+
+    :param query: search query
+    :param documents: docs for reranking
+    :return: float array with one score per document
+    """
+    counts = [Counter(tokenize(document)) for document in documents]
+    lengths = np.fromiter((sum(c.values()) for c in counts), dtype=np.float64, count=len(counts))
+    average_length = lengths.mean() if len(lengths) and lengths.mean() > 0 else 1.0
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths / average_length)
+
+    scores = np.zeros(len(documents), dtype=np.float64)
+    for term in set(tokenize(query)):
+        tf = np.fromiter((c.get(term, 0) for c in counts), dtype=np.float64, count=len(counts))
+        df = np.count_nonzero(tf)
+        if df == 0:
+            continue
+        idf = math.log(1 + (len(documents) - df + 0.5) / (df + 0.5))
+        scores += idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+
+class BM25Prefilter:
+    """
+    Keeps the best `keep` documents by BM25, or a `ratio` of them.
+    """
+
+    def __init__(self, keep: int = 0, ratio: float = 0.0, floor_score: float = DEFAULT_FLOOR_SCORE):
+        self.keep = keep
+        self.ratio = ratio
+        self.floor_score = floor_score
+
+    def select(self, query: str, documents: list[str], top_k: int) -> list[int]:
+        """
+        Pick the candidates to send to the cross-encoder
+
+        Never keeps fewer than `top_k` documents. Equal BM25 scores keep the
+        earlier document.
+
+        :param query: search query
+        :param documents: docs for reranking
+        :param top_k: number of documents the caller will return
+        :return: indices of kept documents in ascending order
+        """
+        limits = []
+        if self.keep > 0:
+            limits.append(self.keep)
+        if self.ratio > 0:
+            limits.append(math.ceil(self.ratio * len(documents)))
+        keep = max(top_k, min(limits)) if limits else len(documents)
+        if keep >= len(documents):
+            return list(range(len(documents)))
+
+        scores = bm25_scores(query, documents)
+        kept = np.argsort(-scores, kind="stable")[:keep]
+        return sorted(kept.tolist())
+
+
+def get_prefilter(credentials: dict) -> Optional[BM25Prefilter]:
+    """
+    Build the prefilter configured by the `prefilter`, `prefilter_top_k`,
+    `prefilter_ratio` and `prefilter_floor_score` credentials, or None if off
+
+    :param credentials: model credentials
+    :return: prefilter or None
+    """
+    mode = credentials.get("prefilter") or "off"
+    if mode not in PREFILTER_MODES:
+        raise ValueError(f"prefilter must be one of {', '.join(PREFILTER_MODES)}, got {mode!r}")
+    if mode == "off":
+        return None
+    floor_score = credentials.get("prefilter_floor_score")
+    return BM25Prefilter(
+        keep=int(credentials.get("prefilter_top_k") or 0),
+        ratio=float(credentials.get("prefilter_ratio") or 0),
+        floor_score=DEFAULT_FLOOR_SCORE if floor_score in (None, "") else float(floor_score),
+    )
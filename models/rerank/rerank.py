@@ -1,7 +1,7 @@
 import json
 import logging
+import time
 from typing import Optional
-from urllib.parse import urljoin
 
 import requests
 from dify_plugin import RerankModel
@@ -23,9 +23,61 @@ from dify_plugin.errors.model import (
     InvokeServerUnavailableError,
 )
 
+from .batching import get_batcher
+from .deadline import MERGE_RESERVE, Deadline, DeadlineExceeded, get_deadline
+from .dedup import collapse_duplicates, expand_duplicates
+from .health import health_registry
+from .limiter import ConcurrencyLimitError
+from .local_backend import get_local_backend
+from .metrics import metrics
+from .prefilter import DEFAULT_FLOOR_SCORE, get_prefilter
+from .resilience import CircuitOpenError
+from .result_cache import get_result_cache, result_key
+from .score_cache import cache_namespace, get_score_cache, pair_keys
+from .shard_tuner import get_shard_tuner, save_shard_tuner
+from .sharding import (
+    DEFAULT_SHARD_CONCURRENCY,
+    ScoredDocument,
+    fan_out,
+    merge_top_k,
+    pack_by_tokens,
+    padding_efficiency,
+    split_shards,
+)
+from .transport import get_transport
+from .truncation import DEFAULT_CONTEXT_SIZE, SPECIAL_TOKENS, estimate_tokens, get_truncator
+
 logger = logging.getLogger(__name__)
 
 
+def validate_options(credentials: dict) -> None:
+    """
+    Check every option in `credentials` and that the reranker can be reached
+
+    Shared by provider and model validation, so both accept the same
+    credentials. With `backend: local` the model is loaded, so a missing file
+    or memory shortage shows here; otherwise at least one replica must pass
+    its health check, answered from the health registry while its last check
+    is fresh.
+
+    :param credentials: provider or model credentials
+    :raises ValueError: describing the first problem found
+    """
+    get_truncator(credentials)
+    get_prefilter(credentials)
+    get_shard_tuner(credentials)
+    get_result_cache(credentials)
+    if get_local_backend(credentials) is not None:
+        return
+    api_url = credentials.get("api_url", "")
+    if not api_url or not isinstance(api_url, str):
+        raise ValueError("api_url must be a non-empty string")
+    transport = get_transport(credentials)
+    health_registry.require_healthy(
+        transport.endpoints.urls, credentials, timeout=min(transport.timeout, 5)
+    )
+
+
 class BGERerankModel(RerankModel):
     """
     Model class for BGE Reranker v2 m3 model.
@@ -56,62 +108,107 @@ class BGERerankModel(RerankModel):
         if len(documents) == 0:
             return RerankResult(model=model, docs=[])
 
-        headers = {"Content-Type": "application/json"}
-        api_url = credentials.get("api_url", "").rstrip("/")
-        timeout = float(credentials.get("timeout", 30))
-        top_k = top_n or int(credentials.get("top_k", 5))
-        input_format = credentials.get("input_format", "auto")
-        
-        # Determine input field name
-        if input_format == "documents":
-            input_field = "documents"
-        else:
-            input_field = "passages"
-        
-        endpoint_url = urljoin(api_url + "/", "rerank")
-
-        payload = {
-            "query": query,
-            input_field: documents,
-            "top_k": min(top_k, len(documents))
-        }
+        top_k = min(top_n or int(credentials.get("top_k", 5)), len(documents))
+        result_cache = get_result_cache(credentials)
+        if result_cache is None:
+            result, _ = self._rerank(model, credentials, query, documents, top_k, score_threshold)
+            return result
+        return result_cache.get_or_compute(
+            result_key(model, credentials, query, documents, top_k, score_threshold),
+            lambda: self._rerank(model, credentials, query, documents, top_k, score_threshold),
+        )
+
+    def _rerank(
+        self,
+        model: str,
+        credentials: dict,
+        query: str,
+        documents: list[str],
+        top_k: int,
+        score_threshold: Optional[float],
+    ) -> tuple[RerankResult, bool]:
+        """
+        Rerank without the result cache
+
+        :param model: model name
+        :param credentials: model credentials
+        :param query: search query
+        :param documents: docs for reranking, at least one
+        :param top_k: number of documents to return
+        :param score_threshold: score threshold
+        :return: (rerank result, whether every document was scored)
+        """
+        deadline = get_deadline(credentials)
 
         try:
-            response = requests.post(
-                endpoint_url, 
-                headers=headers, 
-                json=payload, 
-                timeout=timeout
+            unique_documents, positions = collapse_duplicates(documents)
+            if len(unique_documents) < len(documents):
+                metrics.incr(
+                    "dedup.collapsed_documents", len(documents) - len(unique_documents)
+                )
+            unique_top_k = min(top_k, len(unique_documents))
+
+            candidates = list(range(len(unique_documents)))
+            prefilter = get_prefilter(credentials)
+            if prefilter is not None:
+                started = time.perf_counter()
+                candidates = prefilter.select(query, unique_documents, unique_top_k)
+                metrics.observe("stage.prefilter_seconds", time.perf_counter() - started)
+                metrics.incr(
+                    "prefilter.pruned_documents", len(unique_documents) - len(candidates)
+                )
+
+            started = time.perf_counter()
+            unique_scored, unscored = self._score_documents(
+                model,
+                credentials,
+                query,
+                [unique_documents[index] for index in candidates],
+                unique_top_k,
+                None if deadline is None else deadline.reserve(MERGE_RESERVE),
             )
-            response.raise_for_status()
-            response_data = response.json()
-
-            rerank_documents = []
-            results = response_data.get("results", [])
-            
-            if top_n is not None:
-                results = results[:top_n]
-
-            for item in results:
-                index = item.get("index", -1)
-                # Compatible with different response formats
-                if "document" in item:
-                    text = item["document"]
-                else:
-                    text = documents[index] if index >= 0 and index < len(documents) else ""
-                
-                score = item.get("score", item.get("relevance_score", 0.0))
-                
-                # Apply score threshold filter
-                if score_threshold is None or score >= score_threshold:
-                    rerank_document = RerankDocument(
-                        index=index,
-                        text=text,
-                        score=score
+            metrics.observe("stage.cross_encoder_seconds", time.perf_counter() - started)
+
+            if unscored:
+                # Best effort: what finished in time, then the rest in input order
+                metrics.incr("deadline.degraded_results")
+                metrics.incr("deadline.unscored_documents", len(unscored))
+                logger.warning(
+                    f"Deadline of {deadline.budget * 1000:.0f} ms passed, "
+                    f"{len(unscored)} of {len(candidates)} documents were not scored"
+                )
+                floor_score = DEFAULT_FLOOR_SCORE if prefilter is None else prefilter.floor_score
+                unique_scored.extend(
+                    ScoredDocument(
+                        index=index, score=floor_score, text=unique_documents[candidates[index]]
+                    )
+                    for index in unscored
+                )
+
+            if len(candidates) < len(unique_documents):
+                unique_scored = [
+                    doc._replace(index=candidates[doc.index])
+                    if 0 <= doc.index < len(candidates)
+                    else doc
+                    for doc in unique_scored
+                ]
+                kept = set(candidates)
+                # Pruned documents rank below every cross-encoder score
+                unique_scored.extend(
+                    ScoredDocument(
+                        index=index, score=prefilter.floor_score, text=unique_documents[index]
                     )
-                    rerank_documents.append(rerank_document)
+                    for index in range(len(unique_documents))
+                    if index not in kept
+                )
+
+            scored = expand_duplicates(unique_scored, positions, documents)
+            rerank_documents = [
+                RerankDocument(index=doc.index, text=doc.text, score=doc.score)
+                for doc in merge_top_k([scored], top_k, score_threshold)
+            ]
 
-            return RerankResult(model=model, docs=rerank_documents)
+            return RerankResult(model=model, docs=rerank_documents), not unscored
 
         except requests.exceptions.HTTPError as e:
             if e.response.status_code == 401:
@@ -122,6 +219,10 @@ class BGERerankModel(RerankModel):
                 raise InvokeServerUnavailableError(str(e))
             else:
                 raise InvokeBadRequestError(str(e))
+        except ConcurrencyLimitError as e:
+            raise InvokeRateLimitError(str(e))
+        except CircuitOpenError as e:
+            raise InvokeServerUnavailableError(str(e))
         except requests.exceptions.ConnectionError:
             raise InvokeConnectionError("Connection error occurred")
         except requests.exceptions.Timeout:
@@ -130,6 +231,220 @@ class BGERerankModel(RerankModel):
             logger.error(f"Unexpected error in BGE rerank: {str(e)}")
             raise InvokeError(f"Unexpected error: {str(e)}")
 
+    def _score_documents(
+        self,
+        model: str,
+        credentials: dict,
+        query: str,
+        documents: list[str],
+        top_k: int,
+        deadline: Optional[Deadline] = None,
+    ) -> tuple[list[ScoredDocument], list[int]]:
+        """
+        Score documents from the cache and the reranker service, or the local
+        cross-encoder with `backend: local`
+
+        Without a score cache only the best `top_k` documents of each request
+        to the service are guaranteed to be scored.
+
+        :param model: model name
+        :param credentials: model credentials
+        :param query: search query
+        :param documents: docs for reranking, without duplicates
+        :param top_k: number of documents the caller will keep
+        :param deadline: time by which shards must be done; later ones are dropped
+        :return: (scored documents indexed into `documents`, ascending indices
+                  of documents whose shard did not finish by the deadline)
+        """
+        shard_size = int(credentials.get("shard_size") or 0)
+        token_budget = int(credentials.get("batch_token_budget") or 0)
+        shard_concurrency = int(
+            credentials.get("shard_concurrency") or DEFAULT_SHARD_CONCURRENCY
+        )
+
+        local = get_local_backend(credentials)
+        transport, batcher, tuned = None, None, None
+        if local is None:
+            transport = get_transport(credentials, deadline)
+            # A shared batch is sent with its leader's transport and timeouts,
+            # so a call with its own deadline is never batched with others
+            if deadline is None:
+                batcher = get_batcher(credentials, transport.input_field)
+            tuned = get_shard_tuner(credentials)
+        score_cache = get_score_cache(credentials)
+        truncator = get_truncator(credentials)
+        sent_query = query
+
+        def send(offset: int, shard: list[str]) -> list[ScoredDocument]:
+            scored, queue_wait = batcher.submit(transport, sent_query, shard)
+            logger.debug(f"Rerank waited {queue_wait * 1000:.1f} ms for its batch")
+            return rebase(offset, scored)
+
+        def rebase(offset: int, scored: list[ScoredDocument]) -> list[ScoredDocument]:
+            return [
+                doc._replace(index=offset + doc.index) if doc.index >= 0 else doc
+                for doc in scored
+            ]
+
+        scored: list[ScoredDocument] = []
+        pending = list(range(len(documents)))
+        if score_cache is not None:
+            namespace = cache_namespace(model, credentials)
+            if truncator is not None:
+                # Truncated pairs may score differently from full ones
+                namespace += f"\0{truncator.strategy}:{truncator.context_size}"
+            keys = pair_keys(namespace, query, documents)
+            cached = score_cache.get_many(keys)
+            scored = [
+                ScoredDocument(index=index, score=cached[keys[index]], text=documents[index])
+                for index in pending
+                if keys[index] in cached
+            ]
+            pending = [index for index in pending if keys[index] not in cached]
+
+        unscored: list[int] = []
+        if pending:
+            pending_documents = [documents[index] for index in pending]
+            if truncator is not None:
+                sent_query, pending_documents, truncated = truncator.truncate(
+                    query, pending_documents
+                )
+                if truncated:
+                    metrics.incr("truncation.documents", truncated)
+                    logger.debug(f"Truncated {truncated} of {len(pending)} documents")
+            if tuned is not None:
+                tuner_key, tuner = tuned
+                shard_size = tuner.choose(len(pending))
+                metrics.observe("autotune.shard_size", shard_size)
+            if local is not None:
+                # The local cross-encoder batches by itself, so it scores every
+                # pending document as a single shard
+                shards = [(0, pending_documents)]
+                shard_results = [local.rerank(sent_query, pending_documents)]
+            else:
+                if token_budget > 0:
+                    pending, pending_documents, shards = self._pack_shards(
+                        credentials,
+                        sent_query,
+                        pending,
+                        pending_documents,
+                        token_budget,
+                        shard_size,
+                    )
+                else:
+                    shards = split_shards(pending_documents, shard_size)
+                started = time.perf_counter()
+                try:
+                    if batcher is not None:
+                        shard_results = fan_out(shards, send, shard_concurrency)
+                    else:
+                        # Cached scores must cover every document, not only the top-k
+                        results = transport.rerank_many(
+                            [
+                                (
+                                    sent_query,
+                                    shard,
+                                    len(shard)
+                                    if score_cache is not None
+                                    else min(top_k, len(shard)),
+                                )
+                                for _, shard in shards
+                            ],
+                            shard_concurrency,
+                        )
+                        shard_results = [
+                            None if result is None else rebase(offset, result)
+                            for (offset, _), result in zip(shards, results)
+                        ]
+                except requests.exceptions.HTTPError as e:
+                    too_large = e.response is not None and e.response.status_code == 413
+                    if tuned is not None and too_large:
+                        tuner.shrink(shard_size, too_large=True)
+                        save_shard_tuner(tuner_key, force=True)
+                    raise
+                except requests.exceptions.Timeout as e:
+                    # A deadline says nothing about the shard size
+                    if tuned is not None and not isinstance(e, DeadlineExceeded):
+                        tuner.shrink(shard_size, too_large=False)
+                        save_shard_tuner(tuner_key, force=True)
+                    raise
+                elapsed = time.perf_counter() - started
+            unscored = [
+                pending[offset + position]
+                for (offset, shard), result in zip(shards, shard_results)
+                if result is None
+                for position in range(len(shard))
+            ]
+            fresh = [
+                doc._replace(index=pending[doc.index]) if 0 <= doc.index < len(pending) else doc
+                for result in shard_results
+                if result is not None
+                for doc in result
+            ]
+            if score_cache is not None:
+                score_cache.put_many(
+                    (keys[doc.index], doc.score)
+                    for doc in fresh
+                    if 0 <= doc.index < len(keys)
+                )
+            scored.extend(fresh)
+            # Dropped shards would make the throughput look better than it is
+            if tuned is not None and not unscored:
+                changed = tuner.record(shard_size, len(pending), elapsed)
+                save_shard_tuner(tuner_key, force=changed)
+
+        return scored, unscored
+
+    @staticmethod
+    def _pack_shards(
+        credentials: dict,
+        query: str,
+        pending: list[int],
+        documents: list[str],
+        token_budget: int,
+        shard_size: int,
+    ) -> tuple[list[int], list[str], list[tuple[int, list[str]]]]:
+        """
+        Reorder documents by estimated length and cut them into shards of at
+        most `token_budget` padded tokens
+
+        Shard offsets refer to the reordered lists, so results map back to the
+        original indices through the returned `pending` like unpacked shards.
+
+        :param credentials: model credentials
+        :param query: query as it is sent
+        :param pending: indices of `documents` in the caller's list
+        :param documents: documents as they are sent
+        :param token_budget: padded tokens per shard
+        :param shard_size: maximum documents per shard, 0 for no limit
+        :return: (reordered `pending`, reordered `documents`, shards)
+        """
+        context_size = int(credentials.get("context_size") or DEFAULT_CONTEXT_SIZE)
+        query_tokens = estimate_tokens(query) + SPECIAL_TOKENS
+        # The server truncates every pair to the context size
+        tokens = [
+            min(context_size, query_tokens + estimate_tokens(document)) for document in documents
+        ]
+        batches = pack_by_tokens(tokens, token_budget, shard_size)
+        metrics.observe(
+            "packing.padding_efficiency",
+            padding_efficiency([tokens[position] for position in batch] for batch in batches),
+        )
+        # What the same documents would have cost in positional shards
+        step = shard_size or len(tokens)
+        metrics.observe(
+            "packing.unpacked_padding_efficiency",
+            padding_efficiency(tokens[start : start + step] for start in range(0, len(tokens), step)),
+        )
+
+        order = [position for batch in batches for position in batch]
+        documents = [documents[position] for position in order]
+        shards, offset = [], 0
+        for batch in batches:
+            shards.append((offset, documents[offset : offset + len(batch)]))
+            offset += len(batch)
+        return [pending[position] for position in order], documents, shards
+
     def validate_credentials(self, model: str, credentials: dict) -> None:
         """
         Validate model credentials
@@ -139,16 +454,7 @@ class BGERerankModel(RerankModel):
         :return:
         """
         try:
-            api_url = credentials.get("api_url", "").rstrip("/")
-            health_url = urljoin(api_url + "/", "health")
-            timeout = float(credentials.get("timeout", 30))
-            
-            response = requests.get(health_url, timeout=min(timeout, 5))
-            response.raise_for_status()
-        except requests.exceptions.HTTPError as ex:
-            raise CredentialsValidateFailedError(
-                f"An error occurred during credentials validation: status code {ex.response.status_code}: {ex.response.text}"
-            )
+            validate_options(credentials)
         except Exception as ex:
             raise CredentialsValidateFailedError(
                 f"An error occurred during credentials validation: {str(ex)}"
@@ -184,8 +490,9 @@ class BGERerankModel(RerankModel):
                 requests.exceptions.HTTPError,
                 requests.exceptions.InvalidURL,
             ],
-            InvokeRateLimitError: [requests.exceptions.RetryError],
+            InvokeRateLimitError: [ConcurrencyLimitError, requests.exceptions.RetryError],
             InvokeServerUnavailableError: [
+                CircuitOpenError,
                 requests.exceptions.ConnectionError,
                 requests.exceptions.HTTPError,
             ],
@@ -0,0 +1,281 @@
+"""
+Circuit breakers and bounded retries for requests to the reranker service.
+
+With `circuit_breaker_threshold` set, every replica has a circuit breaker.
+After `threshold` consecutive failures (connection errors, timeouts, 429 and
+5xx responses) it opens and requests to that replica fail fast with
+`CircuitOpenError` for `reset_timeout` seconds, or longer if the server asked
+for it with `Retry-After`. It then turns half-open and lets a single trial
+request through: success closes the circuit, failure opens it again.
+
+With `max_retries` set, transient failures are retried a bounded number of
+times with full-jitter exponential backoff, waiting at least as long as
+`Retry-After` says, and never past the configured request timeout.
+"""
+
+import asyncio
+import email.utils
+import logging
+import random
+import threading
+import time
+from typing import Awaitable, Callable, Optional
+
+import requests
+
+from .metrics import metrics
+from .session_pool import normalize_api_url
+
+logger = logging.getLogger(__name__)
+
+# Both are off unless configured: a retried request may be executed twice by
+# the backend, and an open breaker rejects requests that baseline would send
+DEFAULT_MAX_RETRIES = 0
+DEFAULT_BREAKER_THRESHOLD = 0
+DEFAULT_BREAKER_RESET = 10.0
+BACKOFF_BASE = 0.1
+BACKOFF_CAP = 2.0
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Raised without contacting the service while its circuit breaker is open.
+    """
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait according to a `Retry-After` header
+
+    :param value: header value, delay in seconds or an HTTP date
+    :return: non-negative delay, or None if absent or malformed
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+def is_failure(response: requests.Response) -> bool:
+    """
+    Whether a response means the service is overloaded or broken
+    """
+    return response.status_code == 429 or response.status_code >= 500
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half-open breaker for one replica.
+    """
+
+    def __init__(
+        self,
+        threshold: int,
+        reset_timeout: float = DEFAULT_BREAKER_RESET,
+    ):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_request(self, url: str) -> None:
+        """
+        Admit a request or fail fast
+
+        :param url: replica URL, for the error message
+        :raises CircuitOpenError: if the circuit is open or a half-open trial is running
+        """
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self._open_until:
+                self.state = HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        metrics.incr("circuit.rejected")
+        raise CircuitOpenError(f"Circuit breaker for {url} is open")
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info("Circuit breaker closed after a successful trial request")
+            self.state = CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        with self._lock:
+            self._failures += 1
+            if self.state == HALF_OPEN or self._failures >= self.threshold:
+                if self.state != OPEN:
+                    metrics.incr("circuit.opened")
+                self.state = OPEN
+                self._trial_in_flight = False
+                self._open_until = time.monotonic() + max(self.reset_timeout, retry_after or 0.0)
+
+    def record(self, response: requests.Response) -> None:
+        """
+        Count a response as a success or, for 429 and 5xx, a failure
+        """
+        if is_failure(response):
+            self.record_failure(parse_retry_after(response.headers.get("Retry-After")))
+        else:
+            self.record_success()
+
+    def release_trial(self) -> None:
+        """
+        Give back a half-open trial slot whose request was abandoned
+        """
+        with self._lock:
+            self._trial_in_flight = False
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(base_url: str, credentials: dict) -> Optional[CircuitBreaker]:
+    """
+    Circuit breaker of one replica, configured by the `circuit_breaker_threshold`
+    and `circuit_breaker_reset` credentials, or None if disabled
+
+    :param base_url: replica URL
+    :param credentials: model credentials
+    :return: breaker shared by all requests to the replica, or None
+    """
+    threshold = int(credentials.get("circuit_breaker_threshold") or DEFAULT_BREAKER_THRESHOLD)
+    if threshold <= 0:
+        return None
+    reset_timeout = float(credentials.get("circuit_breaker_reset") or DEFAULT_BREAKER_RESET)
+    key = normalize_api_url(base_url)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(threshold, reset_timeout)
+        breaker.threshold = threshold
+        breaker.reset_timeout = reset_timeout
+        return breaker
+
+
+class RetryPolicy:
+    """
+    Bounded retries with full-jitter exponential backoff.
+    """
+
+    def __init__(self, max_retries: int = DEFAULT_MAX_RETRIES, deadline: float = 30.0):
+        self.max_retries = max_retries
+        self.deadline = deadline
+
+    def _next_delay(
+        self,
+        attempt: int,
+        started: float,
+        response: Optional[requests.Response],
+        error: Optional[Exception],
+        can_reroute: Callable[[], bool],
+    ) -> Optional[float]:
+        """Seconds to wait before the next attempt, or None to give up"""
+        if attempt >= self.max_retries:
+            return None
+        if isinstance(error, CircuitOpenError):
+            # Failing fast: only worth it if another replica is left to try
+            return 0.0 if can_reroute() else None
+        if error is not None:
+            # A read timeout already took the full timeout; retrying would double it
+            if not isinstance(error, requests.exceptions.ConnectionError):
+                return None
+            retry_after = None
+        elif response.status_code in RETRY_STATUS_CODES:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        else:
+            return None
+
+        delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2**attempt))
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() - started + delay >= self.deadline:
+            return None
+        metrics.incr("retry.attempts")
+        return delay
+
+    def call(
+        self,
+        attempt: Callable[[], requests.Response],
+        can_reroute: Callable[[], bool] = lambda: False,
+    ) -> requests.Response:
+        """
+        Call `attempt` until it succeeds, fails permanently or retries run out
+
+        :param attempt: sends one request and returns its response
+        :param can_reroute: whether an untried replica is left
+        :return: last response; raises the last error if there is none
+        """
+        started = time.monotonic()
+        for number in range(self.max_retries + 1):
+            response, error = None, None
+            try:
+                response = attempt()
+            except requests.exceptions.RequestException as e:
+                error = e
+            delay = self._next_delay(number, started, response, error, can_reroute)
+            if delay is None:
+                break
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+    async def acall(
+        self,
+        attempt: Callable[[], Awaitable[requests.Response]],
+        can_reroute: Callable[[], bool] = lambda: False,
+    ) -> requests.Response:
+        """
+        Coroutine version of `call`
+        """
+        started = time.monotonic()
+        for number in range(self.max_retries + 1):
+            response, error = None, None
+            try:
+                response = await attempt()
+            except requests.exceptions.RequestException as e:
+                error = e
+            delay = self._next_delay(number, started, response, error, can_reroute)
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return response
+
+
+def get_retry_policy(credentials: dict, deadline: float) -> RetryPolicy:
+    """
+    Retry policy configured by the `max_retries` credential
+
+    :param credentials: model credentials
+    :param deadline: seconds after which no new attempt is started
+    :return: retry policy
+    """
+    max_retries = credentials.get("max_retries")
+    max_retries = DEFAULT_MAX_RETRIES if max_retries in (None, "") else int(max_retries)
+    return RetryPolicy(max(0, max_retries), deadline)
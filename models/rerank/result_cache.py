@@ -0,0 +1,235 @@
+"""
+Cache of complete rerank results, with singleflight for identical calls.
+
+A popular question asked through the same Dify app reaches the plugin as
+identical (query, documents) reranks, often at the same moment. With
+`result_cache_mb > 0` the finished `RerankResult` is kept for
+`result_cache_ttl` seconds under a hash of the model, the credentials, the
+query, the ordered documents, top-n and the score threshold, so a repeat is
+answered without scoring anything. Concurrent identical calls that miss
+wait for the first one instead of sending their own requests
+(singleflight).
+
+Every caller gets its own deep copy, so a result served from the cache or
+shared with another caller cannot be told apart from a fresh one, and
+changing it does not affect other callers. Results that left documents
+unscored because of the deadline are shared with concurrent callers but not
+cached.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from dify_plugin.entities.model.rerank import RerankResult
+
+from .metrics import metrics
+
+# Shares the 256 MB plugin memory limit with the score cache and the request
+# payloads, see manifest.yaml
+MAX_RESULT_CACHE_MB = 64
+DEFAULT_RESULT_CACHE_TTL = 300.0
+
+# Approximate footprint of a result and of each of its documents, on top of
+# the document text
+RESULT_BYTES = 400
+DOCUMENT_BYTES = 200
+
+
+def result_key(
+    model: str,
+    credentials: dict,
+    query: str,
+    documents: list[str],
+    top_k: int,
+    score_threshold: Optional[float],
+) -> bytes:
+    """
+    Content hash of everything the result of an invocation depends on
+
+    The whole credentials dict is hashed, so changing any setting, such as
+    the API URL, truncation or the prefilter, starts from an empty cache.
+
+    :return: 16-byte key
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(
+        json.dumps(
+            [model, credentials, query, top_k, score_threshold], sort_keys=True, default=str
+        ).encode("utf-8")
+    )
+    for document in documents:
+        encoded = document.encode("utf-8")
+        # Length prefixes keep ["ab", "c"] and ["a", "bc"] apart
+        digest.update(len(encoded).to_bytes(8, "little"))
+        digest.update(encoded)
+    return digest.digest()
+
+
+def result_bytes(result: RerankResult) -> int:
+    return RESULT_BYTES + sum(DOCUMENT_BYTES + len(doc.text or "") for doc in result.docs)
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[RerankResult] = None
+        self.error: Optional[BaseException] = None
+
+
+class ResultCache:
+    """
+    Thread-safe LRU + TTL cache of rerank results with a byte budget, and
+    the calls in flight for keys it does not hold yet.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = DEFAULT_RESULT_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.evictions = 0
+        # key -> (result, size in bytes, expiry)
+        self._entries: OrderedDict[bytes, tuple[RerankResult, int, float]] = OrderedDict()
+        self._flights: dict[bytes, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def get_or_compute(
+        self, key: bytes, compute: Callable[[], tuple[RerankResult, bool]]
+    ) -> RerankResult:
+        """
+        Cached result of `key`, the result of an identical call in flight, or
+        the result of `compute`
+
+        :param key: output of `result_key`
+        :param compute: runs the invocation, returns (result, whether it may
+                        be cached)
+        :return: a deep copy owned by the caller
+        :raises: whatever `compute` raised, in every caller that waited for it
+        """
+        with self._lock:
+            result = self._get(key)
+            if result is None:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = _Flight()
+                    self.misses += 1
+                else:
+                    self.shared += 1
+            else:
+                self.hits += 1
+        if result is not None:
+            metrics.incr("result_cache.hits")
+            return result.model_copy(deep=True)
+
+        if not leader:
+            metrics.incr("result_cache.shared")
+            # The leader has the same deadline and started earlier, so it is
+            # done before this call would have been
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result.model_copy(deep=True)
+
+        metrics.incr("result_cache.misses")
+        try:
+            result, cacheable = compute()
+            flight.result = result.model_copy(deep=True)
+            if cacheable:
+                self._put(key, flight.result)
+            return result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    def _get(self, key: bytes) -> Optional[RerankResult]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        result, size, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.size_bytes -= size
+            return None
+        self._entries.move_to_end(key)
+        return result
+
+    def _put(self, key: bytes, result: RerankResult) -> None:
+        size = result_bytes(result)
+        if size > self.max_bytes:
+            return
+        evicted = 0
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= previous[1]
+            self._entries[key] = (result, size, time.monotonic() + self.ttl)
+            self.size_bytes += size
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size_bytes -= evicted_size
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.incr("result_cache.evictions", evicted)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Hit/miss counters and current size, for sizing the budget
+        """
+        with self._lock:
+            lookups = self.hits + self.misses + self.shared
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "shared": self.shared,
+                "hit_rate": (self.hits + self.shared) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "in_flight": len(self._flights),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache(credentials: dict) -> Optional[ResultCache]:
+    """
+    Return the process-wide result cache, or None if disabled
+
+    The budget and TTL are read from the `result_cache_mb` and
+    `result_cache_ttl` credentials; a zero budget disables the cache and
+    singleflight, and the budget is capped at `MAX_RESULT_CACHE_MB`.
+
+    :param credentials: model credentials
+    :return: result cache or None
+    """
+    global _cache
+    max_mb = min(float(credentials.get("result_cache_mb") or 0), MAX_RESULT_CACHE_MB)
+    ttl = float(credentials.get("result_cache_ttl") or DEFAULT_RESULT_CACHE_TTL)
+    if max_mb <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(int(max_mb * 1024 * 1024), ttl)
+        _cache.max_bytes = int(max_mb * 1024 * 1024)
+        _cache.ttl = ttl
+        return _cache
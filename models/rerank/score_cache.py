@@ -0,0 +1,240 @@
+"""
+Bounded in-memory cache of (model, query, document) pair scores.
+
+Keys are content hashes, so memory use does not depend on document length.
+Entries are evicted least-recently-used first once the byte budget is
+exceeded, and expire after a TTL.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Union
+
+from .disk_cache import DEFAULT_DISK_CACHE_MB, DiskScoreCache
+from .endpoints import service_key
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# The plugin runs with `resource.memory` of 256 MB (see manifest.yaml); the
+# cache is never allowed more than half of it.
+MAX_SCORE_CACHE_MB = 128
+DEFAULT_SCORE_CACHE_TTL = 3600.0
+
+# Approximate footprint of one entry: 16-byte digest as a bytes object,
+# the (score, expiry) tuple with two floats and the OrderedDict node.
+ENTRY_BYTES = 240
+
+
+def cache_namespace(model: str, credentials: dict) -> str:
+    """
+    Scores are only shared between identical model names on the same service,
+    or on the same model files with `backend: local`
+    """
+    backend = credentials.get("backend") or "http"
+    if backend == "local":
+        source = (credentials.get("local_model_path") or "").strip()
+    else:
+        source = service_key(credentials.get("api_url", ""))
+    return f"{model}\0{backend}\0{source}"
+
+
+def pair_keys(namespace: str, query: str, documents: Iterable[str]) -> list[bytes]:
+    """
+    Content-hash keys for every (query, document) pair
+
+    :param namespace: output of `cache_namespace`
+    :param query: search query
+    :param documents: docs for reranking
+    :return: one 16-byte key per document
+    """
+    prefix = hashlib.blake2b(digest_size=16)
+    prefix.update(namespace.encode("utf-8"))
+    prefix.update(b"\0")
+    prefix.update(query.encode("utf-8"))
+    prefix.update(b"\0")
+    keys = []
+    for document in documents:
+        digest = prefix.copy()
+        digest.update(document.encode("utf-8"))
+        keys.append(digest.digest())
+    return keys
+
+
+class ScoreCache:
+    """
+    Thread-safe LRU + TTL cache with a byte budget.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float = DEFAULT_SCORE_CACHE_TTL):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[bytes, tuple[float, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._entries) * ENTRY_BYTES
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, float]:
+        """
+        Look up scores, refreshing the recency of every hit
+
+        :param keys: output of `pair_keys`
+        :return: scores of the keys that are cached and not expired
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                score, expires_at = entry
+                if expires_at <= now:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = score
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        metrics.incr("score_cache.hits", len(found))
+        metrics.incr("score_cache.misses", len(keys) - len(found))
+        return found
+
+    def put_many(self, items: Iterable[tuple[bytes, float]]) -> None:
+        """
+        Store scores, evicting least recently used entries beyond the budget
+
+        :param items: (key, score) pairs
+        """
+        expires_at = time.monotonic() + self.ttl
+        evicted = 0
+        with self._lock:
+            for key, score in items:
+                self._entries[key] = (score, expires_at)
+                self._entries.move_to_end(key)
+            while self._entries and len(self._entries) * ENTRY_BYTES > self.max_bytes:
+                self._entries.popitem(last=False)
+                evicted += 1
+            self.evictions += evicted
+        if evicted:
+            metrics.incr("score_cache.evictions", evicted)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Hit/miss counters and current size, for sizing the budget
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "size_bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class TieredScoreCache:
+    """
+    In-memory cache in front of the persistent store shared between processes.
+
+    Disk hits are promoted to memory and fresh scores are written to both.
+    Errors of the persistent store are logged and treated as misses, so a
+    locked or broken database never fails a rerank.
+    """
+
+    def __init__(self, memory: Optional[ScoreCache], disk: DiskScoreCache):
+        self.memory = memory
+        self.disk = disk
+
+    def get_many(self, keys: list[bytes]) -> dict[bytes, float]:
+        found = self.memory.get_many(keys) if self.memory is not None else {}
+        missing = [key for key in keys if key not in found]
+        if missing:
+            try:
+                from_disk = self.disk.get_many(missing)
+            except sqlite3.Error as e:
+                logger.warning(f"Persistent score cache read failed: {str(e)}")
+                from_disk = {}
+            if from_disk and self.memory is not None:
+                self.memory.put_many(from_disk.items())
+            found.update(from_disk)
+        return found
+
+    def put_many(self, items: Iterable[tuple[bytes, float]]) -> None:
+        items = list(items)
+        if self.memory is not None:
+            self.memory.put_many(items)
+        try:
+            self.disk.put_many(items)
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent score cache write failed: {str(e)}")
+
+    def stats(self) -> dict[str, float]:
+        stats = self.memory.stats() if self.memory is not None else {}
+        stats["disk_path"] = self.disk.path
+        return stats
+
+
+_cache: Optional[ScoreCache] = None
+_disk_caches: dict[str, DiskScoreCache] = {}
+_cache_lock = threading.Lock()
+
+
+def get_score_cache(
+    credentials: dict,
+) -> Optional[Union[ScoreCache, TieredScoreCache]]:
+    """
+    Return the process-wide score cache, or None if disabled
+
+    The in-memory budget and TTL are read from the `score_cache_mb` and
+    `score_cache_ttl` credentials; a zero budget disables it and the budget is
+    capped at `MAX_SCORE_CACHE_MB`. A non-empty `score_cache_dir` adds the
+    persistent store (capped at `score_cache_disk_mb`) behind it.
+
+    :param credentials: model credentials
+    :return: score cache or None
+    """
+    global _cache
+    max_mb = min(float(credentials.get("score_cache_mb") or 0), MAX_SCORE_CACHE_MB)
+    ttl = float(credentials.get("score_cache_ttl") or DEFAULT_SCORE_CACHE_TTL)
+    directory = (credentials.get("score_cache_dir") or "").strip()
+    disk_mb = float(credentials.get("score_cache_disk_mb") or DEFAULT_DISK_CACHE_MB)
+    with _cache_lock:
+        memory = None
+        if max_mb > 0:
+            if _cache is None:
+                _cache = ScoreCache(int(max_mb * 1024 * 1024), ttl)
+            _cache.max_bytes = int(max_mb * 1024 * 1024)
+            _cache.ttl = ttl
+            memory = _cache
+        if not directory:
+            return memory
+
+        disk = _disk_caches.get(directory)
+        if disk is None:
+            try:
+                disk = _disk_caches[directory] = DiskScoreCache(
+                    directory, int(disk_mb * 1024 * 1024), ttl
+                )
+            except (OSError, sqlite3.Error) as e:
+                logger.warning(f"Persistent score cache disabled: {str(e)}")
+                return memory
+        disk.max_bytes = int(disk_mb * 1024 * 1024)
+        disk.ttl = ttl
+        return TieredScoreCache(memory, disk)
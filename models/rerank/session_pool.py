@@ -0,0 +1,136 @@
+"""
+Process-wide registry of pooled keep-alive HTTP sessions.
+
+Every rerank and health check against the same reranker service reuses one
+`requests.Session`, so TCP connections (and TLS handshakes) are paid once per
+process instead of once per call.
+"""
+
+import logging
+import threading
+import time
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+
+def normalize_api_url(api_url: str) -> str:
+    """
+    Normalize a base URL so equivalent spellings share one pool.
+
+    Scheme and host are lower-cased, default ports and trailing slashes are
+    dropped, e.g. ``HTTP://Host:80/api/`` becomes ``http://host/api``.
+    """
+    parts = urlsplit(api_url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme, parts.port) in (("http", 80), ("https", 443)):
+        netloc = netloc.rsplit(":", 1)[0]
+    return urlunsplit((scheme, netloc, parts.path.rstrip("/"), parts.query, ""))
+
+
+class _PooledSession:
+    def __init__(self, pool_size: int, idle_timeout: float):
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.last_used = time.monotonic()
+
+    def close(self) -> None:
+        try:
+            self.session.close()
+        except Exception as e:
+            logger.debug(f"Failed to close pooled session: {str(e)}")
+
+
+class SessionPool:
+    """
+    Thread-safe registry of keep-alive sessions keyed by normalized API URL
+    and pool size.
+
+    Models that share a service but configure different pool sizes get a
+    session each, so they never replace one another's. Sessions idle for
+    longer than their idle timeout are dropped from the registry, so their
+    kept-alive connections, which the server has most likely timed out
+    already, are not reused. They are not closed: a thread may still be in
+    the middle of a request on them, and their connections are closed once
+    the last reference is gone.
+    """
+
+    def __init__(self, idle_timeout: float = DEFAULT_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self._sessions: dict[tuple[str, int], _PooledSession] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        api_url: str,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        idle_timeout: Optional[float] = None,
+    ) -> requests.Session:
+        """
+        Return the shared session for `api_url` and `pool_size`, creating it
+        if needed
+
+        :param api_url: base URL of the reranker service
+        :param pool_size: maximum number of kept-alive connections
+        :param idle_timeout: seconds after which an unused session is evicted,
+                             defaults to the pool's
+        :return: pooled session
+        """
+        key = (normalize_api_url(api_url), pool_size)
+        now = time.monotonic()
+        with self._lock:
+            for other_key, pooled in list(self._sessions.items()):
+                if now - pooled.last_used > pooled.idle_timeout:
+                    del self._sessions[other_key]
+
+            pooled = self._sessions.get(key)
+            if pooled is None:
+                pooled = self._sessions[key] = _PooledSession(
+                    pool_size, self.idle_timeout if idle_timeout is None else idle_timeout
+                )
+            elif idle_timeout is not None:
+                pooled.idle_timeout = idle_timeout
+            pooled.last_used = now
+            return pooled.session
+
+    def close_all(self) -> None:
+        """
+        Close every pooled session; only safe once no request is running
+        """
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for pooled in sessions:
+            pooled.close()
+
+
+_pool = SessionPool()
+
+
+def get_session(api_url: str, credentials: Optional[dict] = None) -> requests.Session:
+    """
+    Return the process-wide pooled session for `api_url`
+
+    Pool size and idle timeout are read from the optional `pool_size` and
+    `pool_idle_timeout` credentials.
+
+    :param api_url: base URL of the reranker service
+    :param credentials: model or provider credentials
+    :return: pooled session
+    """
+    credentials = credentials or {}
+    pool_size = max(1, int(credentials.get("pool_size") or DEFAULT_POOL_SIZE))
+    idle_timeout = float(credentials.get("pool_idle_timeout") or DEFAULT_IDLE_TIMEOUT)
+    return _pool.get(api_url, pool_size=pool_size, idle_timeout=idle_timeout)
@@ -0,0 +1,293 @@
+"""
+Online shard-size autotuner.
+
+The best shard size depends on the reranker hardware and changes with every
+redeploy. With `shard_autotune: on` each service gets a tuner that picks the
+shard size of every invocation from a ladder of powers of two. Mostly it
+uses the current best size, and sometimes it tries a neighbouring one, or
+for an invocation smaller than a shard, the next size that splits it. For
+every size it keeps an EWMA of throughput (documents per second of the whole
+network stage) and latency. The current size becomes the one with the
+highest throughput whose latency meets `shard_latency_slo_ms`, or the fastest
+one if none does.
+
+A `413` caps the ladder below the size that caused it. A timeout counts as an
+SLO miss for its size, and both move the current size one step down at once.
+The learned sizes, caps and statistics are saved as JSON whenever the current
+size changes and otherwise every `SAVE_INTERVAL` seconds, so a restarted
+plugin starts from them.
+"""
+
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+from typing import Optional
+
+from .endpoints import service_key
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+SHARD_AUTOTUNE_MODES = ("off", "on")
+SHARD_SIZES = (8, 16, 32, 64, 128, 256, 512, 1024)
+DEFAULT_START_SIZE = 64
+DEFAULT_LATENCY_SLO_MS = 1000.0
+STATE_FILENAME = "bge_reranker_shard_tuner.json"
+EWMA_ALPHA = 0.2
+# Share of invocations that try a neighbouring size
+EXPLORE_RATE = 0.1
+# A size is only compared with others once it has this many samples
+MIN_SAMPLES = 3
+# Seconds between two saves of the state file
+SAVE_INTERVAL = 30.0
+
+
+class _SizeStats:
+    def __init__(self, throughput: float = 0.0, latency: float = 0.0, samples: int = 0):
+        self.throughput = throughput
+        self.latency = latency
+        self.samples = samples
+
+    def add(self, throughput: float, latency: float) -> None:
+        if self.samples == 0:
+            self.throughput, self.latency = throughput, latency
+        else:
+            self.throughput += EWMA_ALPHA * (throughput - self.throughput)
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+        self.samples += 1
+
+
+class ShardSizeTuner:
+    """
+    Throughput statistics per shard size and the current choice for one service.
+
+    :param latency_slo: seconds the network stage of an invocation may take
+    :param start_size: size used before anything was measured
+    """
+
+    def __init__(self, latency_slo: float, start_size: int = DEFAULT_START_SIZE):
+        self.latency_slo = latency_slo
+        self._current = self._nearest(start_size)
+        self._ceiling = len(SHARD_SIZES) - 1
+        self._stats = {size: _SizeStats() for size in SHARD_SIZES}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _nearest(size: int) -> int:
+        return min(range(len(SHARD_SIZES)), key=lambda index: abs(SHARD_SIZES[index] - size))
+
+    @property
+    def current(self) -> int:
+        return SHARD_SIZES[self._current]
+
+    def choose(self, documents: int) -> int:
+        """
+        Shard size for an invocation scoring `documents` documents
+
+        An invocation that fits in a smaller shard is sent the same way with
+        every size from the smallest fitting one up, so it explores around
+        that size; the step down is the one that splits it.
+        """
+        with self._lock:
+            index = self._current
+            if random.random() < EXPLORE_RATE:
+                fitting = next(
+                    (i for i, size in enumerate(SHARD_SIZES) if size >= documents),
+                    len(SHARD_SIZES) - 1,
+                )
+                index = min(index, fitting) + random.choice((-1, 1))
+                index = max(0, min(index, self._ceiling))
+        return SHARD_SIZES[index]
+
+    def record(self, size: int, documents: int, elapsed: float) -> bool:
+        """
+        Add the measured network stage of an invocation
+
+        Invocations that fit in a single shard count too, so a service whose
+        calls are mostly small still learns whether splitting them pays off.
+
+        :param size: shard size it used
+        :param documents: documents it scored
+        :param elapsed: seconds the network stage took
+        :return: whether the current size changed
+        """
+        if documents <= 0 or elapsed <= 0 or size not in self._stats:
+            return False
+        with self._lock:
+            previous = self._current
+            self._stats[size].add(documents / elapsed, elapsed)
+            self._select()
+            return self._current != previous
+
+    def shrink(self, size: int, too_large: bool) -> None:
+        """
+        React to a request of shard size `size` that failed
+
+        :param size: shard size of the failed invocation
+        :param too_large: the server answered 413, so `size` is never used again
+        """
+        if size not in self._stats:
+            return
+        index = SHARD_SIZES.index(size)
+        metrics.incr("autotune.shrinks")
+        with self._lock:
+            if too_large:
+                self._ceiling = max(0, min(self._ceiling, index - 1))
+            else:
+                # A timeout is an SLO miss at least twice over
+                self._stats[size].add(0.0, 2 * self.latency_slo)
+            self._current = max(0, min(self._current, index - 1, self._ceiling))
+
+    def _select(self) -> None:
+        measured = [
+            index
+            for index in range(self._ceiling + 1)
+            if self._stats[SHARD_SIZES[index]].samples >= MIN_SAMPLES
+        ]
+        if not measured:
+            return
+        within_slo = [
+            index
+            for index in measured
+            if self._stats[SHARD_SIZES[index]].latency <= self.latency_slo
+        ]
+        if within_slo:
+            best = max(within_slo, key=lambda index: self._stats[SHARD_SIZES[index]].throughput)
+        else:
+            best = min(measured, key=lambda index: self._stats[SHARD_SIZES[index]].latency)
+        if best != self._current:
+            logger.info(f"Shard size {SHARD_SIZES[self._current]} -> {SHARD_SIZES[best]}")
+        self._current = best
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "current": SHARD_SIZES[self._current],
+                "ceiling": SHARD_SIZES[self._ceiling],
+                "sizes": {
+                    str(size): [stats.throughput, stats.latency, stats.samples]
+                    for size, stats in self._stats.items()
+                    if stats.samples
+                },
+            }
+
+    def load(self, state: dict) -> None:
+        """
+        Restore what `to_dict` saved; sizes no longer on the ladder are ignored
+        """
+        with self._lock:
+            if state.get("ceiling") in SHARD_SIZES:
+                self._ceiling = SHARD_SIZES.index(state["ceiling"])
+            for size, (throughput, latency, samples) in state.get("sizes", {}).items():
+                if int(size) in self._stats:
+                    self._stats[int(size)] = _SizeStats(throughput, latency, samples)
+            if state.get("current") in SHARD_SIZES:
+                self._current = min(SHARD_SIZES.index(state["current"]), self._ceiling)
+
+
+class _TunerRegistry:
+    """
+    Tuners of all services in this process and the file they are saved to.
+    """
+
+    def __init__(self):
+        self._tuners: dict[str, ShardSizeTuner] = {}
+        self._paths: dict[str, str] = {}
+        self._saved_at: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str, path: str, latency_slo: float, start_size: int) -> ShardSizeTuner:
+        with self._lock:
+            tuner = self._tuners.get(key)
+            if tuner is None:
+                tuner = self._tuners[key] = ShardSizeTuner(latency_slo, start_size)
+                state = self._read(path).get(key)
+                if state:
+                    try:
+                        tuner.load(state)
+                    except (TypeError, ValueError) as e:
+                        logger.warning(f"Ignoring saved shard tuner state of {key}: {str(e)}")
+            self._paths[key] = path
+            tuner.latency_slo = latency_slo
+            return tuner
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        try:
+            with open(path, encoding="utf-8") as state_file:
+                state = json.load(state_file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot read shard tuner state {path}: {str(e)}")
+            return {}
+        return state if isinstance(state, dict) else {}
+
+    def save(self, key: str, force: bool = False) -> None:
+        """
+        Write the tuner of `key` to its file, at most every `SAVE_INTERVAL`
+        seconds unless `force`; entries of other services are kept
+        """
+        now = time.monotonic()
+        with self._lock:
+            tuner = self._tuners.get(key)
+            if tuner is None or (not force and now - self._saved_at.get(key, 0) < SAVE_INTERVAL):
+                return
+            self._saved_at[key] = now
+            path = self._paths[key]
+            state = self._read(path)
+            state[key] = tuner.to_dict()
+            try:
+                directory = os.path.dirname(path) or "."
+                os.makedirs(directory, exist_ok=True)
+                # Written aside and renamed, so readers never see half a file
+                with tempfile.NamedTemporaryFile(
+                    "w", dir=directory, delete=False, suffix=".tmp", encoding="utf-8"
+                ) as state_file:
+                    json.dump(state, state_file)
+                os.replace(state_file.name, path)
+            except OSError as e:
+                logger.warning(f"Cannot save shard tuner state {path}: {str(e)}")
+
+
+_registry = _TunerRegistry()
+
+
+def get_shard_tuner(credentials: dict) -> Optional[tuple[str, ShardSizeTuner]]:
+    """
+    Shard-size tuner of the service in `credentials`, configured by the
+    `shard_autotune`, `shard_latency_slo_ms` and `shard_tuner_file`
+    credentials, or None if autotuning is off
+
+    A non-zero `shard_size` is the size the tuner starts from.
+
+    :param credentials: model credentials
+    :return: (service key for `save_shard_tuner`, tuner) or None
+    """
+    mode = credentials.get("shard_autotune") or "off"
+    if mode not in SHARD_AUTOTUNE_MODES:
+        raise ValueError(
+            f"shard_autotune must be one of {', '.join(SHARD_AUTOTUNE_MODES)}, got {mode!r}"
+        )
+    if mode == "off":
+        return None
+    slo_ms = float(credentials.get("shard_latency_slo_ms") or DEFAULT_LATENCY_SLO_MS)
+    if slo_ms <= 0:
+        raise ValueError(f"shard_latency_slo_ms must be positive, got {slo_ms}")
+    path = (credentials.get("shard_tuner_file") or "").strip() or os.path.join(
+        tempfile.gettempdir(), STATE_FILENAME
+    )
+    start_size = int(credentials.get("shard_size") or DEFAULT_START_SIZE)
+    key = service_key(credentials.get("api_url", ""))
+    return key, _registry.get(key, path, slo_ms / 1000, start_size)
+
+
+def save_shard_tuner(key: str, force: bool = False) -> None:
+    """
+    Persist the tuner of service `key`; see `_TunerRegistry.save`
+    """
+    _registry.save(key, force)
@@ -0,0 +1,169 @@
+"""
+Client-side document sharding for large rerank requests.
+
+Documents are split into sub-batches that are scored concurrently, and the
+per-shard results are merged into one global top-k. With a token budget the
+sub-batches are formed by estimated length instead of position, so the server
+does not pad short documents to the length of long ones in the same batch.
+"""
+
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Iterable, NamedTuple, Optional
+
+import numpy as np
+
+DEFAULT_SHARD_CONCURRENCY = 4
+
+
+class ScoredDocument(NamedTuple):
+    """
+    A document score keyed by its index in the original `documents` list.
+    """
+
+    index: int
+    score: float
+    text: str
+
+
+def split_shards(documents: list[str], shard_size: int) -> list[tuple[int, list[str]]]:
+    """
+    Split documents into consecutive shards
+
+    :param documents: docs for reranking
+    :param shard_size: maximum number of documents per shard, 0 disables sharding
+    :return: list of (offset of the shard in `documents`, shard documents)
+    """
+    if shard_size <= 0 or len(documents) <= shard_size:
+        return [(0, documents)]
+    return [
+        (offset, documents[offset : offset + shard_size])
+        for offset in range(0, len(documents), shard_size)
+    ]
+
+
+def pack_by_tokens(
+    token_counts: list[int], budget: int, max_documents: int = 0
+) -> list[list[int]]:
+    """
+    Group documents into batches of similar estimated length
+
+    Documents are sorted by token count and the order is cut into runs, each
+    as long as its padded size (documents times the longest one) stays within
+    `budget`. A document over the budget on its own gets a batch to itself.
+
+    :param token_counts: estimated tokens of every (query, document) pair
+    :param budget: padded tokens per batch
+    :param max_documents: maximum documents per batch, 0 for no limit
+    :return: batches of positions into `token_counts`, shortest first
+    """
+    batches: list[list[int]] = []
+    current: list[int] = []
+    for position in np.argsort(np.asarray(token_counts), kind="stable").tolist():
+        # Sorted ascending, so this document would be the longest of the batch
+        full = max_documents > 0 and len(current) >= max_documents
+        if current and (full or (len(current) + 1) * token_counts[position] > budget):
+            batches.append(current)
+            current = []
+        current.append(position)
+    if current:
+        batches.append(current)
+    return batches
+
+
+def padding_efficiency(batches: Iterable[list[int]]) -> float:
+    """
+    Real tokens over padded tokens when every batch is padded to its longest pair
+
+    :param batches: token counts of the pairs of each batch
+    :return: efficiency in (0, 1], 1.0 for no batches
+    """
+    real = padded = 0
+    for tokens in batches:
+        if tokens:
+            real += sum(tokens)
+            padded += len(tokens) * max(tokens)
+    return real / padded if padded else 1.0
+
+
+def fan_out(
+    shards: list[tuple[int, list[str]]],
+    send: Callable[[int, list[str]], Optional[list[ScoredDocument]]],
+    max_workers: int = DEFAULT_SHARD_CONCURRENCY,
+    timeout: Optional[float] = None,
+) -> list[Optional[list[ScoredDocument]]]:
+    """
+    Score shards concurrently on a bounded thread pool
+
+    :param shards: output of `split_shards`
+    :param send: callable scoring one shard, returns documents with global indices
+    :param max_workers: maximum number of shards in flight
+    :param timeout: seconds to wait; shards not done by then are returned as
+                    None and their requests are abandoned
+    :return: per-shard results in shard order
+    """
+    if len(shards) == 1 and timeout is None:
+        offset, shard = shards[0]
+        return [send(offset, shard)]
+
+    executor = ThreadPoolExecutor(
+        max_workers=max(1, min(max_workers, len(shards))),
+        thread_name_prefix="bge-rerank-shard",
+    )
+    try:
+        futures = [executor.submit(send, offset, shard) for offset, shard in shards]
+        if timeout is None:
+            return [future.result() for future in futures]
+        done, _ = wait(futures, timeout)
+        return [future.result() if future in done else None for future in futures]
+    finally:
+        # A failed shard fails the whole call, so queued shards are not sent.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def select_top_k(
+    scores: np.ndarray, top_k: int, score_threshold: Optional[float] = None
+) -> np.ndarray:
+    """
+    Positions of the `top_k` best scores at or above `score_threshold`
+
+    Uses `argpartition`, so only the survivors are fully sorted. Equal scores
+    keep their input order, also at the top-k boundary.
+
+    :param scores: float array
+    :param top_k: number of positions to keep
+    :param score_threshold: score threshold
+    :return: positions ordered by descending score
+    """
+    candidates = np.arange(len(scores))
+    if score_threshold is not None:
+        candidates = np.flatnonzero(scores >= score_threshold)
+    if top_k <= 0 or len(candidates) == 0:
+        return candidates[:0]
+    if top_k < len(candidates):
+        values = scores[candidates]
+        kth = values[np.argpartition(-values, top_k - 1)[top_k - 1]]
+        above = candidates[values > kth]
+        ties = candidates[values == kth][: top_k - len(above)]
+        candidates = np.sort(np.concatenate([above, ties]))
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def merge_top_k(
+    shard_results: Iterable[list[ScoredDocument]],
+    top_k: int,
+    score_threshold: Optional[float] = None,
+) -> list[ScoredDocument]:
+    """
+    Merge per-shard results into a global top-k
+
+    `score_threshold` is applied before the merge, so documents below it never
+    displace anything. Ties keep the order in which shards reported them.
+
+    :param shard_results: per-shard scored documents
+    :param top_k: number of documents to keep
+    :param score_threshold: score threshold
+    :return: top-k documents ordered by descending score
+    """
+    candidates = [doc for result in shard_results for doc in result]
+    scores = np.fromiter((doc.score for doc in candidates), dtype=np.float64, count=len(candidates))
+    return [candidates[position] for position in select_top_k(scores, top_k, score_threshold)]
@@ -0,0 +1,580 @@
+"""
+HTTP transport for the reranker service `/rerank` and `/health` endpoints.
+"""
+
+import logging
+import time
+from itertools import islice
+from typing import Iterable, Optional
+from urllib.parse import urljoin
+
+import numpy as np
+import requests
+
+from . import wire_codecs
+from .deadline import Deadline
+from .document_upload import (
+    MISSING_STATUS_CODE,
+    document_hash,
+    get_document_uploader,
+    missing_hashes,
+)
+from .endpoints import get_endpoint_pool
+from .health import health_registry
+from .hedging import get_hedge_policy
+from .latency_model import get_latency_model
+from .limiter import classify, get_limiter
+from .metrics import metrics
+from .resilience import CircuitOpenError, get_breaker, get_retry_policy
+from .session_pool import get_session
+from .sharding import DEFAULT_SHARD_CONCURRENCY, ScoredDocument, fan_out, select_top_k
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_STREAM_THRESHOLD_KB = 0
+TRANSPORTS = ("sync", "async")
+RESPONSE_FORMATS = ("results", "scores")
+
+
+class BatchNotSupportedError(Exception):
+    """
+    Raised when the service does not expose the multi-query `/rerank/batch` endpoint.
+    """
+
+
+def get_input_field(credentials: dict) -> str:
+    """
+    Name of the request field carrying the documents
+    """
+    if credentials.get("input_format", "auto") == "documents":
+        return "documents"
+    return "passages"
+
+
+def parse_results(results: list[dict], documents: list[str]) -> list[ScoredDocument]:
+    """
+    Convert `/rerank` result items to scored documents
+
+    :param results: `results` list of a `/rerank` response
+    :param documents: docs sent in the request
+    :return: scored documents with indices into `documents`
+    """
+    scored = []
+    for item in results:
+        index = item.get("index", -1)
+        # Compatible with different response formats
+        if "document" in item:
+            text = item["document"]
+        else:
+            text = documents[index] if index >= 0 and index < len(documents) else ""
+
+        score = item.get("score", item.get("relevance_score", 0.0))
+        scored.append(ScoredDocument(index=index, score=score, text=text))
+    return scored
+
+
+def parse_scores(
+    scores: Iterable[float], documents: list[str], top_k: int
+) -> list[ScoredDocument]:
+    """
+    Convert a compact `/rerank` response to the `top_k` best scored documents
+
+    :param scores: `scores` list of a compact response, one per document in input order
+    :param documents: docs sent in the request, the source of the returned texts
+    :param top_k: number of documents to keep
+    :return: scored documents ordered by descending score
+    """
+    values = np.fromiter(scores, dtype=np.float64)
+    if len(values) != len(documents):
+        raise ValueError(
+            f"Compact response has {len(values)} scores for {len(documents)} documents"
+        )
+    return [
+        ScoredDocument(index=int(index), score=float(values[index]), text=documents[index])
+        for index in select_top_k(values, top_k)
+    ]
+
+
+def parse_response(body: dict, documents: list[str], top_k: int) -> list[ScoredDocument]:
+    """
+    Scored documents of one `/rerank` response in either format
+
+    Servers that do not know the compact format ignore the request for it and
+    answer with `results`, so both shapes are accepted regardless of the
+    configured `response_format`.
+
+    :param body: decoded response body
+    :param documents: docs sent in the request
+    :param top_k: number of documents to keep
+    :return: at most `top_k` scored documents
+    """
+    if "scores" in body:
+        return parse_scores(body["scores"], documents, top_k)
+    return parse_results(body.get("results", [])[:top_k], documents)
+
+
+def parse_members(
+    members: Iterable[tuple[str, object]], documents: list[str], top_k: int
+) -> list[ScoredDocument]:
+    """
+    Scored documents of one `/rerank` response read with `wire_codecs.iter_members`
+
+    Only the first `top_k` result items are kept; the rest are skipped as
+    they arrive.
+
+    :param members: top-level members of the response, with `results` and
+                    `scores` streamed
+    :param documents: docs sent in the request
+    :param top_k: number of documents to keep
+    :return: at most `top_k` scored documents
+    """
+    scored: list[ScoredDocument] = []
+    for key, value in members:
+        if key == "scores":
+            scored = parse_scores(value, documents, top_k)
+        elif key == "results" and not scored:
+            scored = parse_results(list(islice(value, top_k)), documents)
+    return scored
+
+
+def get_response_format(credentials: dict) -> str:
+    """
+    Response format requested by the `response_format` credential
+    """
+    response_format = credentials.get("response_format") or "results"
+    if response_format not in RESPONSE_FORMATS:
+        raise ValueError(
+            f"response_format must be one of {', '.join(RESPONSE_FORMATS)}, got {response_format!r}"
+        )
+    return response_format
+
+
+def get_stream_threshold(credentials: dict) -> Optional[int]:
+    """
+    Total document text size, in characters, from which requests are streamed,
+    set in KB by the `stream_threshold_kb` credential, or None if never
+
+    :param credentials: model credentials
+    :return: threshold or None
+    """
+    threshold_kb = float(credentials.get("stream_threshold_kb") or DEFAULT_STREAM_THRESHOLD_KB)
+    if threshold_kb < 0:
+        raise ValueError(f"stream_threshold_kb must not be negative, got {threshold_kb}")
+    return int(threshold_kb * 1024) if threshold_kb > 0 else None
+
+
+class RerankTransport:
+    """
+    Blocking client for one reranker service, configured from model credentials.
+    """
+
+    def __init__(self, credentials: dict, deadline: Optional[Deadline] = None):
+        self.credentials = credentials
+        self.deadline = deadline
+        # May list several replicas, see `endpoints.parse_api_urls`
+        self.api_url = credentials.get("api_url", "").strip().rstrip("/")
+        self.endpoints = get_endpoint_pool(self.api_url)
+        for base_url in self.endpoints.urls:
+            health_registry.register(base_url, credentials)
+            # Rejects bad adaptive timeout settings before the first request
+            get_latency_model(base_url, credentials)
+        self.timeout = float(credentials.get("timeout", DEFAULT_TIMEOUT))
+        self.input_field = get_input_field(credentials)
+        self.response_format = get_response_format(credentials)
+        self.stream_threshold = get_stream_threshold(credentials)
+        self.codec = wire_codecs.get_codec(credentials)
+        self.hedging = get_hedge_policy(credentials)
+        self.retry = get_retry_policy(
+            credentials, self.timeout if deadline is None else min(self.timeout, deadline.budget)
+        )
+        self.limiter = get_limiter(credentials)
+        self.uploader = get_document_uploader(credentials)
+
+    def _request_timeout(self) -> float:
+        """Configured timeout, cut to what is left of the deadline"""
+        if self.deadline is None:
+            return self.timeout
+        return self.deadline.timeout(self.timeout)
+
+    def _session(self, base_url: str) -> requests.Session:
+        return get_session(base_url, self.credentials)
+
+    @staticmethod
+    def _url(base_url: str, path: str) -> str:
+        return urljoin(base_url + "/", path)
+
+    def _post(
+        self,
+        path: str,
+        payload: dict,
+        avoid: Optional[set[str]] = None,
+        upload: bool = False,
+    ) -> requests.Response:
+        # Retries go to replicas that were not tried yet, while any are left
+        tried = set() if avoid is None else avoid
+        return self.retry.call(
+            lambda: self._post_limited(path, payload, tried, upload),
+            lambda: len(tried) < len(self.endpoints.replicas),
+        )
+
+    def _document_count(self, payload: dict) -> int:
+        return sum(
+            len(request.get(self.input_field) or request.get("document_hashes", ()))
+            for request in payload.get("requests", [payload])
+        )
+
+    def _payload_size(self, payload: dict) -> tuple[int, float]:
+        """(documents, kilobytes of text) of a payload, the latency model inputs"""
+        chars = 0
+        for request in payload.get("requests", [payload]):
+            chars += len(request.get("query", ""))
+            chars += sum(
+                len(text)
+                for text in request.get(self.input_field) or request.get("document_hashes", ())
+            )
+        return self._document_count(payload), chars / 1024
+
+    def _streams(self, document_lists: Iterable[list[str]]) -> bool:
+        """
+        Whether a request carrying these document lists is large enough to
+        stream its body and parse its response incrementally
+        """
+        if self.stream_threshold is None:
+            return False
+        size = 0
+        for documents in document_lists:
+            size += sum(len(document) for document in documents)
+            if size >= self.stream_threshold:
+                return True
+        return False
+
+    def _payload_documents(self, payload: dict) -> Iterable[list[str]]:
+        return (
+            request.get(self.input_field, ()) for request in payload.get("requests", [payload])
+        )
+
+    def _post_limited(
+        self, path: str, payload: dict, avoid: set[str], upload: bool = False
+    ) -> requests.Response:
+        if self.limiter is None:
+            return self._post_once(path, payload, avoid, upload)
+        started = self.limiter.acquire(self._request_timeout())
+        response, error = None, None
+        try:
+            response = self._post_once(path, payload, avoid, upload)
+            return response
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            self.limiter.release(started, self._document_count(payload), classify(response, error))
+
+    def _post_once(
+        self, path: str, payload: dict, avoid: set[str], upload: bool = False
+    ) -> requests.Response:
+        """
+        POST to one replica picked by the balancer, guarded by its breaker
+
+        :param upload: first make sure the replica stores the documents of
+                       `payload` and send their hashes instead of the texts
+        """
+        limit = self._request_timeout()
+        with self.endpoints.track(avoid) as call:
+            base_url = call.replica.url
+            latency = get_latency_model(base_url, self.credentials)
+            size = self._payload_size(payload)
+            timeout = limit if latency is None else latency.timeouts(*size, limit)
+            breaker = get_breaker(base_url, self.credentials)
+            if breaker is not None:
+                try:
+                    breaker.before_request(base_url)
+                except CircuitOpenError:
+                    call.ok = None
+                    raise
+            try:
+                sent = self._upload_to(base_url, payload) if upload else payload
+                started = time.monotonic()
+                response = wire_codecs.post(
+                    self._session(base_url),
+                    self._url(base_url, path),
+                    self.api_url,
+                    self.codec,
+                    sent,
+                    timeout,
+                    stream=self._streams(self._payload_documents(sent)),
+                )
+            except requests.exceptions.Timeout:
+                if latency is not None:
+                    latency.timed_out(timeout, limit)
+                if self.deadline is not None and limit < self.timeout:
+                    # Cut short by the deadline, says nothing about the replica
+                    call.ok = None
+                    if breaker is not None:
+                        breaker.release_trial()
+                elif breaker is not None:
+                    breaker.record_failure()
+                raise
+            except requests.exceptions.RequestException:
+                if breaker is not None:
+                    breaker.record_failure()
+                raise
+            except Exception:
+                if breaker is not None:
+                    breaker.release_trial()
+                raise
+            call.ok = response.status_code < 500
+            if latency is not None and call.ok:
+                latency.observe(*size, time.monotonic() - started)
+            if breaker is not None:
+                breaker.record(response)
+            return response
+
+    def _post_to(self, base_url: str, path: str, payload: dict) -> requests.Response:
+        """POST to one replica, bypassing balancing, retries and breakers"""
+        return wire_codecs.post(
+            self._session(base_url),
+            self._url(base_url, path),
+            self.api_url,
+            self.codec,
+            payload,
+            self._request_timeout(),
+        )
+
+    def _upload_hashes(self, payload: dict) -> Optional[list[str]]:
+        """Hashes of every document of `payload`, or None if not uploading"""
+        uploader = self.uploader
+        if uploader is None or not uploader.supported:
+            return None
+        hashes = [
+            document_hash(document)
+            for documents in self._payload_documents(payload)
+            for document in documents
+        ]
+        return hashes or None
+
+    def _hashed_payload(self, payload: dict, hashes: list[str]) -> dict:
+        """`payload` with the document texts of each request replaced by hashes"""
+        hashed_requests = []
+        offset = 0
+        for request in payload.get("requests", [payload]):
+            count = len(request.get(self.input_field, ()))
+            hashed = {key: value for key, value in request.items() if key != self.input_field}
+            hashed["document_hashes"] = hashes[offset : offset + count]
+            offset += count
+            hashed_requests.append(hashed)
+        if "requests" in payload:
+            return {**payload, "requests": hashed_requests}
+        return hashed_requests[0]
+
+    def _upload_to(self, base_url: str, payload: dict) -> dict:
+        """
+        Make sure the replica a request was routed to stores the documents of
+        `payload`, uploading the missing ones
+
+        Runs inside the request's limiter slot, breaker and deadline, so a
+        hung replica only holds up the requests routed to it. Connection
+        errors and timeouts fail the request; an HTTP error of the upload
+        endpoints only makes it carry the texts.
+
+        :param base_url: replica the request was routed to
+        :param payload: request payload with document texts
+        :return: payload to send: hashes instead of texts, or `payload` itself
+        """
+        uploader = self.uploader
+        hashes = self._upload_hashes(payload)
+        if hashes is None:
+            return payload
+        pending = uploader.pending(base_url, hashes)
+        if pending:
+            try:
+                response = self._post_to(base_url, "documents/missing", {"hashes": pending})
+                if uploader.is_unsupported(response):
+                    uploader.mark_unsupported(self.api_url)
+                    return payload
+                response.raise_for_status()
+                missing = missing_hashes(response, self.codec)
+                documents = [
+                    document for texts in self._payload_documents(payload) for document in texts
+                ]
+                for texts in uploader.upload_batches(missing, hashes, documents):
+                    self._post_to(base_url, "documents", {"documents": texts}).raise_for_status()
+            except requests.exceptions.HTTPError as e:
+                logger.debug(f"Document upload to {base_url} failed: {str(e)}")
+                return payload
+            uploader.acknowledge(base_url, pending)
+        return self._hashed_payload(payload, hashes)
+
+    def _fall_back_to_texts(self, response: requests.Response) -> None:
+        """Forget the hashes a 409 response reports as missing"""
+        self.uploader.forget(missing_hashes(response, self.codec))
+        response.close()
+        metrics.incr("upload.fallbacks")
+
+    def _rerank_payload(self, query: str, documents: list[str], top_k: int) -> dict:
+        payload = {"query": query, self.input_field: documents, "top_k": top_k}
+        if self.response_format == "scores":
+            payload["response_format"] = "scores"
+        return payload
+
+    def _post_rerank(
+        self, query: str, documents: list[str], top_k: int, avoid: Optional[set[str]] = None
+    ) -> requests.Response:
+        payload = self._rerank_payload(query, documents, top_k)
+        response = self._post("rerank", payload, avoid, upload=True)
+        if self.uploader is None or response.status_code != MISSING_STATUS_CODE:
+            return response
+        self._fall_back_to_texts(response)
+        return self._post("rerank", payload, avoid)
+
+    def _parse_rerank(
+        self, response: requests.Response, documents: list[str], top_k: int
+    ) -> list[ScoredDocument]:
+        response.raise_for_status()
+        if self._streams([documents]):
+            members = wire_codecs.iter_members(response, ("results", "scores"))
+            return parse_members(members, documents, top_k)
+        return parse_response(self.codec.decode(response), documents, top_k)
+
+    def rerank(self, query: str, documents: list[str], top_k: int) -> list[ScoredDocument]:
+        """
+        Score documents against a query with one `/rerank` request
+
+        :param query: search query
+        :param documents: docs for reranking
+        :param top_k: number of results requested from the server
+        :return: at most `top_k` scored documents, indices relative to `documents`
+        """
+        if self.hedging is None:
+            return self._parse_rerank(self._post_rerank(query, documents, top_k), documents, top_k)
+        # The hedge goes to a different replica than the first attempt
+        avoid: set[str] = set()
+
+        def attempt() -> requests.Response:
+            response = self._post_rerank(query, documents, top_k, avoid)
+            if not response.ok:
+                response.close()
+                response.raise_for_status()
+            return response
+
+        response = self.hedging.run(attempt, discard=lambda loser: loser.close())
+        try:
+            return self._parse_rerank(response, documents, top_k)
+        finally:
+            response.close()
+
+    def rerank_many(
+        self,
+        batch: list[tuple[str, list[str], int]],
+        max_concurrency: int = DEFAULT_SHARD_CONCURRENCY,
+    ) -> list[Optional[list[ScoredDocument]]]:
+        """
+        Score several independent (query, documents, top_k) requests concurrently
+
+        Each request is a separate `/rerank` call, run on a bounded thread pool.
+        With a deadline, requests that time out or are still running when it
+        passes are returned as None instead of failing the call.
+
+        :param batch: list of (query, documents, top_k)
+        :param max_concurrency: maximum number of requests in flight
+        :return: per-request scored documents in request order
+        """
+        deadline = self.deadline
+        if deadline is None:
+            return fan_out(
+                list(enumerate(batch)),
+                lambda _, request: self.rerank(*request),
+                max_concurrency,
+            )
+
+        def send(_: int, request: tuple[str, list[str], int]) -> Optional[list[ScoredDocument]]:
+            try:
+                return self.rerank(*request)
+            except requests.exceptions.Timeout:
+                return None
+
+        return fan_out(
+            list(enumerate(batch)), send, max_concurrency, max(0.0, deadline.remaining())
+        )
+
+    def rerank_batch(
+        self, batch: list[tuple[str, list[str], int]]
+    ) -> list[list[ScoredDocument]]:
+        """
+        Score several (query, documents, top_k) requests with one `/rerank/batch` call
+
+        The batch payload is ``{"requests": [<rerank payload>, ...]}`` and the
+        response is ``{"responses": [<rerank response>, ...]}`` in request order.
+
+        :param batch: list of (query, documents, top_k)
+        :return: per-request scored documents
+        :raises BatchNotSupportedError: if the service has no batch endpoint
+        """
+        payload = self._batch_payload(batch)
+        response = self._post("rerank/batch", payload, upload=True)
+        if self.uploader is not None and response.status_code == MISSING_STATUS_CODE:
+            self._fall_back_to_texts(response)
+            response = self._post("rerank/batch", payload)
+        if response.status_code in (404, 405, 422):
+            raise BatchNotSupportedError(
+                f"{response.url} returned status {response.status_code}"
+            )
+        response.raise_for_status()
+        if self._streams(documents for _, documents, _ in batch):
+            # One extra item is enough to notice a mismatched response
+            responses = []
+            for key, value in wire_codecs.iter_members(response, ("responses",)):
+                if key == "responses":
+                    responses = list(islice(value, len(batch) + 1))
+        else:
+            responses = self.codec.decode(response).get("responses", [])
+        if len(responses) != len(batch):
+            raise BatchNotSupportedError("Batch response does not match the request")
+        return [
+            parse_response(item, documents, top_k)
+            for item, (_, documents, top_k) in zip(responses, batch)
+        ]
+
+    def _batch_payload(self, batch: list[tuple[str, list[str], int]]) -> dict:
+        return {
+            "requests": [
+                self._rerank_payload(query, documents, top_k) for query, documents, top_k in batch
+            ]
+        }
+
+    def health(
+        self, timeout: Optional[float] = None, base_url: Optional[str] = None
+    ) -> requests.Response:
+        """
+        Call the `/health` endpoint
+
+        :param timeout: request timeout, defaults to the configured timeout
+        :param base_url: replica to check, defaults to one picked by the balancer
+        :return: raw response
+        """
+        timeout = timeout or self.timeout
+        if base_url is not None:
+            return self._session(base_url).get(self._url(base_url, "health"), timeout=timeout)
+        with self.endpoints.track() as call:
+            base_url = call.replica.url
+            response = self._session(base_url).get(self._url(base_url, "health"), timeout=timeout)
+            call.ok = response.status_code < 500
+            return response
+
+
+def get_transport(credentials: dict, deadline: Optional[Deadline] = None) -> RerankTransport:
+    """
+    Build the transport selected by the `transport` credential
+
+    :param credentials: model credentials
+    :param deadline: deadline every request must finish by, if any
+    :return: blocking transport, or the asyncio one for ``async``
+    """
+    kind = credentials.get("transport") or "sync"
+    if kind not in TRANSPORTS:
+        raise ValueError(f"transport must be one of {', '.join(TRANSPORTS)}, got {kind!r}")
+    if kind == "async":
+        from .async_transport import AsyncRerankTransport
+
+        return AsyncRerankTransport(credentials, deadline)
+    return RerankTransport(credentials, deadline)
@@ -0,0 +1,145 @@
+"""
+Context-size-aware truncation of the query and documents before sending.
+
+The reranker truncates every (query, document) pair to its context size
+anyway, so longer texts only cost bytes on the wire and tokenization time on
+the server. Token counts are estimated with a fast heuristic tuned for the
+XLM-RoBERTa SentencePiece vocabulary used by BGE reranker v2 m3: CJK
+characters count as one token each, other words as one token per eight
+characters and punctuation as one token per character. The estimate errs on
+the low side, so the server still makes the final cut and no text the model
+would have seen is dropped.
+"""
+
+import re
+from typing import Optional
+
+DEFAULT_CONTEXT_SIZE = 512
+TRUNCATION_STRATEGIES = ("none", "head", "tail", "head_tail")
+
+# <s> query </s></s> document </s>
+SPECIAL_TOKENS = 4
+# The query never takes more than this share of the context.
+QUERY_SHARE = 0.5
+HEAD_TAIL_SEPARATOR = " ... "
+
+CJK_RANGES = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff"
+_TOKEN_RE = re.compile(rf"[{CJK_RANGES}]|[^\W{CJK_RANGES}]+|[^\w\s]")
+_CHARS_PER_TOKEN = 8
+
+
+def _token_spans(text: str) -> list[tuple[int, int, int]]:
+    """(start, end, estimated tokens) of every token-like run in `text`"""
+    spans = []
+    for match in _TOKEN_RE.finditer(text):
+        start, end = match.span()
+        if end - start == 1 or not text[start].isalnum():
+            cost = 1
+        else:
+            cost = -(-(end - start) // _CHARS_PER_TOKEN)
+        spans.append((start, end, cost))
+    return spans
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of model tokens in `text`
+    """
+    return sum(cost for _, _, cost in _token_spans(text))
+
+
+_SEPARATOR_TOKENS = estimate_tokens(HEAD_TAIL_SEPARATOR)
+
+
+def _head(text: str, spans: list[tuple[int, int, int]], budget: int) -> str:
+    used = 0
+    for start, end, cost in spans:
+        if used + cost > budget:
+            # Cut inside a long word rather than dropping it entirely
+            return text[: min(end, start + (budget - used) * _CHARS_PER_TOKEN)].rstrip()
+        used += cost
+    return text
+
+
+def _tail(text: str, spans: list[tuple[int, int, int]], budget: int) -> str:
+    used = 0
+    for start, end, cost in reversed(spans):
+        if used + cost > budget:
+            return text[max(start, end - (budget - used) * _CHARS_PER_TOKEN) :].lstrip()
+        used += cost
+    return text
+
+
+def truncate_text(text: str, budget: int, strategy: str = "head") -> str:
+    """
+    Trim `text` to at most `budget` estimated tokens
+
+    :param text: text to trim
+    :param budget: token budget
+    :param strategy: keep the `head`, the `tail`, or half of each (`head_tail`)
+    :return: trimmed text, or `text` itself if it fits
+    """
+    spans = _token_spans(text)
+    if sum(cost for _, _, cost in spans) <= budget:
+        return text
+    if strategy == "tail":
+        return _tail(text, spans, budget)
+    if strategy == "head_tail" and budget > _SEPARATOR_TOKENS + 1:
+        # The separator is paid for out of the budget as well
+        head_budget = (budget - _SEPARATOR_TOKENS) // 2
+        return (
+            _head(text, spans, head_budget)
+            + HEAD_TAIL_SEPARATOR
+            + _tail(text, spans, budget - _SEPARATOR_TOKENS - head_budget)
+        )
+    return _head(text, spans, budget)
+
+
+class Truncator:
+    """
+    Trims the query and documents so every pair fits the model context.
+    """
+
+    def __init__(self, context_size: int = DEFAULT_CONTEXT_SIZE, strategy: str = "head"):
+        self.context_size = context_size
+        self.strategy = strategy
+
+    def truncate(self, query: str, documents: list[str]) -> tuple[str, list[str], int]:
+        """
+        Trim the query and every document to the token budget
+
+        :param query: search query
+        :param documents: docs for reranking
+        :return: (query, documents, number of documents that were shortened)
+        """
+        usable = max(1, self.context_size - SPECIAL_TOKENS)
+        query = truncate_text(query, max(1, int(usable * QUERY_SHARE)), self.strategy)
+        document_budget = max(1, usable - estimate_tokens(query))
+
+        truncated = 0
+        result = []
+        for document in documents:
+            trimmed = truncate_text(document, document_budget, self.strategy)
+            if trimmed is not document:
+                truncated += 1
+            result.append(trimmed)
+        return query, result, truncated
+
+
+def get_truncator(credentials: dict) -> Optional[Truncator]:
+    """
+    Build the truncator configured by the `truncation` and `context_size`
+    credentials, or None if truncation is disabled
+
+    :param credentials: model credentials
+    :return: truncator or None
+    """
+    strategy = credentials.get("truncation") or "none"
+    if strategy not in TRUNCATION_STRATEGIES:
+        raise ValueError(
+            f"truncation must be one of {', '.join(TRUNCATION_STRATEGIES)}, got {strategy!r}"
+        )
+    if strategy == "none":
+        return None
+    context_size = int(credentials.get("context_size") or DEFAULT_CONTEXT_SIZE)
+    return Truncator(context_size, strategy)
@@ -0,0 +1,480 @@
+"""
+Wire codecs for the `/rerank` exchange.
+
+A codec turns a request payload into body bytes plus headers and decodes the
+response according to its `Content-Type`. Three body formats are available:
+
+- JSON, compact and UTF-8 encoded (`orjson` when installed). Unlike the
+  default of `requests`, non-ASCII text is not escaped, which makes
+  Cyrillic and CJK documents two to three times smaller on the wire.
+- MessagePack (needs the `msgpack` package).
+- Either of the above compressed with gzip or zstd (zstd needs the
+  `zstandard` package).
+
+Large payloads can also be streamed: `WireCodec.iter_encode` produces the
+same body chunk by chunk, sent with chunked transfer encoding, and
+`iter_members` parses a JSON response object as its bytes arrive, so neither
+side of the exchange needs the whole serialized body in memory at once.
+
+Servers that reject a codec (415, or a 400/422 saying the body could not be
+read) are remembered per endpoint and served plain JSON for
+`REJECTION_TTL` seconds, after which the codec is tried again. Other 400/422
+responses, such as validation errors, do not change the codec.
+"""
+
+import codecs
+import gzip
+import json
+import logging
+import re
+import threading
+import time
+import zlib
+from typing import Any, Iterable, Iterator
+
+import requests
+
+from .endpoints import service_key
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional codec
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional codec
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+WIRE_FORMATS = ("json", "msgpack")
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+# Bodies smaller than this are not worth compressing.
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 5
+ZSTD_LEVEL = 3
+
+# Size of the chunks streamed bodies are written and read in.
+STREAM_CHUNK_BYTES = 64 * 1024
+
+# Status code meaning "I cannot read this body" whatever it says
+UNSUPPORTED_MEDIA_STATUS_CODE = 415
+# Status codes that mean the same only if the error says so
+UNREADABLE_STATUS_CODES = (400, 422)
+UNREADABLE_BODY = re.compile(
+    r"decod|decompress|pars(e|ing)|malformed|json_invalid|invalid (json|messagepack|body)"
+    r"|expecting value|content[- ](type|encoding)|unsupported|not supported",
+    re.IGNORECASE,
+)
+# Seconds a rejected codec is replaced by plain JSON before it is tried again
+REJECTION_TTL = 600.0
+
+
+def dumps_json(payload: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads_json(body: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def _json_pieces(value: Any) -> Iterator[bytes]:
+    if isinstance(value, dict):
+        yield b"{"
+        for position, (key, item) in enumerate(value.items()):
+            yield (b"," if position else b"") + dumps_json(str(key)) + b":"
+            yield from _json_pieces(item)
+        yield b"}"
+    elif isinstance(value, (list, tuple)):
+        yield b"["
+        for position, item in enumerate(value):
+            if position:
+                yield b","
+            yield from _json_pieces(item)
+        yield b"]"
+    else:
+        yield dumps_json(value)
+
+
+def _msgpack_pieces(value: Any, packer: Any) -> Iterator[bytes]:
+    if isinstance(value, dict):
+        yield packer.pack_map_header(len(value))
+        for key, item in value.items():
+            yield packer.pack(key)
+            yield from _msgpack_pieces(item, packer)
+    elif isinstance(value, (list, tuple)):
+        yield packer.pack_array_header(len(value))
+        for item in value:
+            yield from _msgpack_pieces(item, packer)
+    else:
+        yield packer.pack(value)
+
+
+def _rechunk(pieces: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= chunk_size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+class WireCodec:
+    """
+    Encodes request bodies and decodes responses for one format/compression pair.
+    """
+
+    def __init__(self, wire_format: str = "json", compression: str = "none"):
+        if wire_format not in WIRE_FORMATS:
+            raise ValueError(f"wire_codec must be one of {', '.join(WIRE_FORMATS)}, got {wire_format!r}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"compression must be one of {', '.join(COMPRESSIONS)}, got {compression!r}")
+        if wire_format == "msgpack" and msgpack is None:
+            raise ValueError("wire_codec 'msgpack' requires the msgpack package")
+        if compression == "zstd" and zstandard is None:
+            raise ValueError("compression 'zstd' requires the zstandard package")
+        self.wire_format = wire_format
+        self.compression = compression
+
+    @property
+    def name(self) -> str:
+        return f"{self.wire_format}+{self.compression}"
+
+    @property
+    def is_plain(self) -> bool:
+        return self.wire_format == "json" and self.compression == "none"
+
+    def encode(self, payload: Any) -> tuple[bytes, dict[str, str]]:
+        """
+        Serialize a payload
+
+        :param payload: JSON-compatible request payload
+        :return: (body, request headers describing it)
+        """
+        headers = self._headers()
+        if self.wire_format == "msgpack":
+            body = msgpack.packb(payload, use_bin_type=True)
+        else:
+            body = dumps_json(payload)
+
+        if self.compression != "none" and len(body) >= MIN_COMPRESS_BYTES:
+            if self.compression == "gzip":
+                body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+            else:
+                body = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+            headers["Content-Encoding"] = self.compression
+        return body, headers
+
+    def iter_encode(
+        self, payload: Any, chunk_size: int = STREAM_CHUNK_BYTES
+    ) -> tuple[Iterator[bytes], dict[str, str]]:
+        """
+        Serialize a payload lazily, in chunks of about `chunk_size` bytes
+
+        Dicts and lists are walked item by item, so only one document is
+        encoded at a time. The concatenated chunks equal the body `encode`
+        would produce, except that compression is applied regardless of size.
+
+        :param payload: JSON-compatible request payload
+        :param chunk_size: target chunk size before compression
+        :return: (body chunks, request headers describing them)
+        """
+        headers = self._headers()
+        if self.wire_format == "msgpack":
+            pieces = _msgpack_pieces(payload, msgpack.Packer(use_bin_type=True))
+        else:
+            pieces = _json_pieces(payload)
+        chunks = _rechunk(pieces, chunk_size)
+        if self.compression != "none":
+            chunks = self._compress_stream(chunks)
+            headers["Content-Encoding"] = self.compression
+        return chunks, headers
+
+    def _headers(self) -> dict[str, str]:
+        if self.wire_format == "msgpack":
+            return {
+                "Content-Type": MSGPACK_CONTENT_TYPE,
+                "Accept": f"{MSGPACK_CONTENT_TYPE}, {JSON_CONTENT_TYPE};q=0.9",
+            }
+        return {"Content-Type": JSON_CONTENT_TYPE}
+
+    def _compress_stream(self, chunks: Iterable[bytes]) -> Iterator[bytes]:
+        if self.compression == "gzip":
+            # wbits 31 writes a gzip header and trailer
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        else:
+            compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    @staticmethod
+    def decode(response: requests.Response) -> Any:
+        """
+        Deserialize a response body according to its `Content-Type`
+
+        Content-Encoding (gzip, and zstd when `zstandard` is installed) is
+        already undone by `requests`.
+        """
+        content_type = response.headers.get("Content-Type", "")
+        if MSGPACK_CONTENT_TYPE in content_type and msgpack is not None:
+            return msgpack.unpackb(response.content, raw=False)
+        return loads_json(response.content)
+
+
+PLAIN_CODEC = WireCodec()
+
+
+_DELIMITERS = frozenset(" \t\r\n,:]}")
+
+
+class _JsonReader:
+    """
+    Pull parser over the chunks of a JSON body.
+
+    Values are decoded with the standard scanner as soon as they are
+    complete; only the value being read and one chunk are kept in memory.
+    """
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        """Append the next chunk to the buffer; False once the body is exhausted"""
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._utf8.decode(b"", final=True)
+        else:
+            text = self._utf8.decode(chunk)
+        self._buffer = self._buffer[self._position :] + text
+        self._position = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character, or an empty string at the end"""
+        while True:
+            buffer = self._buffer
+            while self._position < len(buffer) and buffer[self._position] in " \t\r\n":
+                self._position += 1
+            if self._position < len(buffer):
+                return buffer[self._position]
+            if not self._fill():
+                return ""
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} in response body, got {found!r}")
+        self._position += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._position)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number cut by the end of the chunk, like "1" of "1.5", looks
+            # complete; only a delimiter after it proves it is
+            complete = end < len(self._buffer) and self._buffer[end] in _DELIMITERS
+            if complete or not self._fill():
+                self._position = end
+                return value
+
+    def items(self) -> Iterator[Any]:
+        self.expect("[")
+        if self.peek() == "]":
+            self._position += 1
+            return
+        while True:
+            yield self.value()
+            if self.peek() == "]":
+                self._position += 1
+                return
+            self.expect(",")
+
+
+def iter_json_members(
+    chunks: Iterable[bytes], arrays: tuple[str, ...] = ()
+) -> Iterator[tuple[str, Any]]:
+    """
+    Parse a JSON object incrementally
+
+    Members named in `arrays` whose value is an array are yielded as lazy
+    iterators over the items; whatever the caller leaves unread is skipped
+    before the next member. Other values are parsed whole.
+
+    :param chunks: body chunks
+    :param arrays: names of members to stream item by item
+    :return: iterator of (name, value)
+    """
+    reader = _JsonReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key in arrays and reader.peek() == "[":
+            items = reader.items()
+            yield key, items
+            for _ in items:
+                pass
+        else:
+            yield key, reader.value()
+        if reader.peek() == "}":
+            return
+        reader.expect(",")
+
+
+def iter_members(
+    response: requests.Response, arrays: tuple[str, ...] = ()
+) -> Iterator[tuple[str, Any]]:
+    """
+    Top-level members of a response object, parsed while the body is read
+
+    JSON bodies are parsed incrementally with `iter_json_members`;
+    MessagePack bodies are decoded whole.
+
+    :param response: response, preferably requested with ``stream=True``
+    :param arrays: see `iter_json_members`
+    :return: iterator of (name, value)
+    """
+    content_type = response.headers.get("Content-Type", "")
+    if MSGPACK_CONTENT_TYPE in content_type and msgpack is not None:
+        return iter(WireCodec.decode(response).items())
+    return iter_json_members(response.iter_content(STREAM_CHUNK_BYTES), arrays)
+
+
+# service key -> {codec name: monotonic time the rejection expires}
+_rejected: dict[str, dict[str, float]] = {}
+_rejected_lock = threading.Lock()
+
+
+def get_codec(credentials: dict) -> WireCodec:
+    """
+    Codec configured by the `wire_codec` and `compression` credentials
+
+    Falls back to plain JSON if the service rejected that codec less than
+    `REJECTION_TTL` seconds ago.
+
+    :param credentials: model credentials
+    :return: codec
+    """
+    codec = WireCodec(
+        credentials.get("wire_codec") or "json",
+        credentials.get("compression") or "none",
+    )
+    if codec.is_plain:
+        return codec
+    with _rejected_lock:
+        rejected = _rejected.get(service_key(credentials.get("api_url", "")), {})
+        expires_at = rejected.get(codec.name)
+        if expires_at is not None:
+            if expires_at > time.monotonic():
+                return PLAIN_CODEC
+            del rejected[codec.name]
+    return codec
+
+
+def mark_rejected(api_url: str, codec: WireCodec) -> None:
+    """
+    Remember for `REJECTION_TTL` seconds that the service at `api_url`
+    cannot read `codec`
+    """
+    logger.info(f"{api_url} rejected the {codec.name} codec, falling back to plain JSON")
+    with _rejected_lock:
+        _rejected.setdefault(service_key(api_url), {})[codec.name] = (
+            time.monotonic() + REJECTION_TTL
+        )
+
+
+def is_rejection(
+    codec: WireCodec, headers: dict[str, str], response: requests.Response
+) -> bool:
+    """
+    Whether a response means the service could not read a negotiated body
+
+    A 415 always does; a 400 or 422 only if its error text is about reading
+    the body, so validation errors such as an empty query keep the codec.
+
+    :param codec: codec the body was encoded with
+    :param headers: request headers returned by `WireCodec.encode`
+    :param response: response to the request
+    """
+    negotiated = codec.wire_format != "json" or "Content-Encoding" in headers
+    if not negotiated:
+        return False
+    if response.status_code == UNSUPPORTED_MEDIA_STATUS_CODE:
+        return True
+    if response.status_code not in UNREADABLE_STATUS_CODES:
+        return False
+    try:
+        detail = response.text
+    except requests.exceptions.RequestException:
+        return False
+    return UNREADABLE_BODY.search(detail) is not None
+
+
+def post(
+    session: requests.Session,
+    url: str,
+    api_url: str,
+    codec: WireCodec,
+    payload: Any,
+    timeout: Any,
+    stream: bool = False,
+) -> requests.Response:
+    """
+    POST a payload with `codec`, retrying once with plain JSON if rejected
+
+    :param session: HTTP session
+    :param url: endpoint URL
+    :param api_url: base URL the codec support is remembered for
+    :param codec: codec to try first
+    :param payload: request payload
+    :param timeout: request timeout
+    :param stream: send the body with chunked transfer encoding and leave the
+                   response body unread, for `iter_members`
+    :return: response, not yet checked for errors
+    """
+    encode = codec.iter_encode if stream else codec.encode
+    body, headers = encode(payload)
+    response = session.post(url, data=body, headers=headers, timeout=timeout, stream=stream)
+    if not is_rejection(codec, headers, response):
+        return response
+
+    response.close()
+    mark_rejected(api_url, codec)
+    encode = PLAIN_CODEC.iter_encode if stream else PLAIN_CODEC.encode
+    body, headers = encode(payload)
+    return session.post(url, data=body, headers=headers, timeout=timeout, stream=stream)
@@ -71,6 +71,29 @@ def pack_plugin():
         "provider/bge_reranker.py": "provider/bge_reranker.py",
         "models/rerank/rerank.py": "models/rerank/rerank.py",
         "models/rerank/__init__.py": "models/rerank/__init__.py",
+        "models/rerank/async_transport.py": "models/rerank/async_transport.py",
+        "models/rerank/batching.py": "models/rerank/batching.py",
+        "models/rerank/deadline.py": "models/rerank/deadline.py",
+        "models/rerank/dedup.py": "models/rerank/dedup.py",
+        "models/rerank/disk_cache.py": "models/rerank/disk_cache.py",
+        "models/rerank/document_upload.py": "models/rerank/document_upload.py",
+        "models/rerank/endpoints.py": "models/rerank/endpoints.py",
+        "models/rerank/health.py": "models/rerank/health.py",
+        "models/rerank/hedging.py": "models/rerank/hedging.py",
+        "models/rerank/latency_model.py": "models/rerank/latency_model.py",
+        "models/rerank/limiter.py": "models/rerank/limiter.py",
+        "models/rerank/local_backend.py": "models/rerank/local_backend.py",
+        "models/rerank/metrics.py": "models/rerank/metrics.py",
+        "models/rerank/prefilter.py": "models/rerank/prefilter.py",
+        "models/rerank/resilience.py": "models/rerank/resilience.py",
+        "models/rerank/result_cache.py": "models/rerank/result_cache.py",
+        "models/rerank/score_cache.py": "models/rerank/score_cache.py",
+        "models/rerank/session_pool.py": "models/rerank/session_pool.py",
+        "models/rerank/shard_tuner.py": "models/rerank/shard_tuner.py",
+        "models/rerank/sharding.py": "models/rerank/sharding.py",
+        "models/rerank/transport.py": "models/rerank/transport.py",
+        "models/rerank/truncation.py": "models/rerank/truncation.py",
+        "models/rerank/wire_codecs.py": "models/rerank/wire_codecs.py",
         "models/__init__.py": "models/__init__.py",
         "requirements.txt": "requirements.txt",
         "README.md": "README.md",
@@ -1,6 +1,9 @@
 import logging
+
 from dify_plugin import ModelProvider
 
+from models.rerank.rerank import validate_options
+
 logger = logging.getLogger(__name__)
 
 
@@ -10,20 +13,12 @@ class BGERerankerProvider(ModelProvider):
         Validate provider credentials
         if validate failed, raise exception
 
+        Runs the same checks as model validation: every option is checked,
+        and at least one replica must be healthy; the others are logged.
+
         :param credentials: provider credentials, credentials form defined in `provider_credential_schema`.
         """
-        api_url = credentials.get("api_url", "")
-        if not api_url or not isinstance(api_url, str):
-            raise ValueError("api_url must be a non-empty string")
-        
-        # Try to check health endpoint
         try:
-            import requests
-            from urllib.parse import urljoin
-            health_url = urljoin(api_url.rstrip('/') + '/', 'health')
-            response = requests.get(health_url, timeout=5)
-            if response.status_code != 200:
-                raise ValueError(f"Health check failed: status {response.status_code}")
+            validate_options(credentials)
         except Exception as e:
-            raise ValueError(f"Failed to validate API URL: {str(e)}")
-
+            raise ValueError(f"Failed to validate credentials: {str(e)}")
@@ -0,0 +1,20 @@
+"""
+Reference implementation of the reranker service the plugin talks to.
+
+Standard library only; see `python -m server --help`.
+"""
+
+from .batcher import DynamicBatcher
+from .scoring import Scorer, ToyScorer, load_scorer
+from .store import DocumentStore
+from .workers import ServerOptions, serve
+
+__all__ = [
+    "DocumentStore",
+    "DynamicBatcher",
+    "Scorer",
+    "ServerOptions",
+    "ToyScorer",
+    "load_scorer",
+    "serve",
+]
@@ -0,0 +1,71 @@
+"""
+Run the reference reranker server:
+
+    python -m server --port 8009 --workers 4
+"""
+
+import argparse
+import logging
+
+from .workers import ServerOptions, serve
+
+DEFAULTS = ServerOptions()
+
+
+def parse_args() -> ServerOptions:
+    parser = argparse.ArgumentParser(
+        prog="python -m server", description="Reference reranker server"
+    )
+    parser.add_argument("--host", default=DEFAULTS.host)
+    parser.add_argument("--port", type=int, default=DEFAULTS.port)
+    parser.add_argument("--workers", type=int, default=DEFAULTS.workers, help="worker processes")
+    parser.add_argument(
+        "--scorer",
+        default=DEFAULTS.scorer,
+        help="'toy' or module:attribute of a scorer class or factory",
+    )
+    parser.add_argument(
+        "--toy-cost-us",
+        type=float,
+        default=DEFAULTS.toy_cost_us,
+        help="simulated compute of the toy scorer, microseconds per padded token",
+    )
+    parser.add_argument("--max-batch-pairs", type=int, default=DEFAULTS.max_batch_pairs)
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=DEFAULTS.max_wait * 1000,
+        help="longest time a pair waits for its batch to fill",
+    )
+    parser.add_argument(
+        "--max-queue-pairs",
+        type=int,
+        default=DEFAULTS.max_queue_pairs,
+        help="queued pairs per worker before requests get 429",
+    )
+    parser.add_argument("--request-timeout", type=float, default=DEFAULTS.request_timeout)
+    parser.add_argument("--store", default=DEFAULTS.store_path, help="document store database")
+    parser.add_argument("--store-max-documents", type=int, default=DEFAULTS.store_max_documents)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=args.log_level.upper(), format="%(asctime)s %(process)d %(levelname)s %(message)s"
+    )
+    return ServerOptions(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        scorer=args.scorer,
+        toy_cost_us=args.toy_cost_us,
+        max_batch_pairs=args.max_batch_pairs,
+        max_wait=args.max_wait_ms / 1000,
+        max_queue_pairs=args.max_queue_pairs,
+        request_timeout=args.request_timeout,
+        store_path=args.store,
+        store_max_documents=args.store_max_documents,
+    )
+
+
+if __name__ == "__main__":
+    serve(parse_args())
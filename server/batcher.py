@@ -0,0 +1,245 @@
+"""
+Dynamic batching of (query, document) pairs for the reference server.
+
+Requests do not call the scorer themselves. Their pairs go into a queue
+split into length buckets, and one scoring thread per process drains it:
+
+* a bucket is scored as soon as it holds `max_batch_pairs` pairs, or once
+  its oldest pair has waited `max_wait` seconds;
+* pairs of similar length share a batch, so a model that pads every batch
+  to its longest pair wastes little compute on padding;
+* pairs from concurrent requests, even with different queries, share
+  batches.
+
+The queue is bounded. A request whose pairs do not fit is rejected with
+`Overloaded`, carrying an estimate of how long the backlog takes to drain,
+which the HTTP layer returns as 429 with `Retry-After`.
+"""
+
+import bisect
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import NamedTuple, Optional
+
+from .scoring import Scorer, estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BATCH_PAIRS = 64
+DEFAULT_MAX_WAIT = 0.005
+DEFAULT_MAX_QUEUE_PAIRS = 4096
+# Upper token bounds of the length buckets; longer pairs share the last one
+DEFAULT_BUCKETS = (64, 128, 256)
+THROUGHPUT_ALPHA = 0.2
+MIN_RETRY_AFTER = 1
+
+
+class Overloaded(Exception):
+    """
+    Raised when the queue cannot take the pairs of a request.
+    """
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Scoring queue is full, retry after {retry_after}s")
+        self.retry_after = retry_after
+
+
+class RequestTooLarge(Exception):
+    """
+    Raised for a request with more pairs than the whole queue holds.
+    """
+
+
+class Job:
+    """
+    Pairs of one request; `wait` returns their scores in input order.
+    """
+
+    def __init__(self, size: int):
+        self.scores: list[Optional[float]] = [None] * size
+        self.remaining = size
+        self.error: Optional[BaseException] = None
+        self.cancelled = False
+        self._done = threading.Event()
+        if size == 0:
+            self._done.set()
+
+    def wait(self, timeout: Optional[float] = None) -> list[float]:
+        """
+        Block until every pair is scored
+
+        :param timeout: seconds to wait
+        :return: scores in input order
+        :raises TimeoutError: if the pairs are not scored in time
+        """
+        if not self._done.wait(timeout):
+            self.cancelled = True
+            raise TimeoutError("Pairs were not scored in time")
+        if self.error is not None:
+            raise self.error
+        return self.scores
+
+    def _resolve(self, position: int, score: float) -> None:
+        self.scores[position] = score
+        self.remaining -= 1
+        if self.remaining == 0:
+            self._done.set()
+
+    def _fail(self, error: BaseException) -> None:
+        self.error = error
+        self._done.set()
+
+
+class _Pair(NamedTuple):
+    job: Job
+    position: int
+    query: str
+    document: str
+    enqueued_at: float
+
+
+class DynamicBatcher:
+    """
+    Length-bucketed pair queue with one scoring thread.
+    """
+
+    def __init__(
+        self,
+        scorer: Scorer,
+        max_batch_pairs: int = DEFAULT_MAX_BATCH_PAIRS,
+        max_wait: float = DEFAULT_MAX_WAIT,
+        max_queue_pairs: int = DEFAULT_MAX_QUEUE_PAIRS,
+        buckets: tuple[int, ...] = DEFAULT_BUCKETS,
+    ):
+        self.scorer = scorer
+        self.max_batch_pairs = max_batch_pairs
+        self.max_wait = max_wait
+        self.max_queue_pairs = max_queue_pairs
+        self.bucket_bounds = tuple(sorted(buckets))
+        self._buckets: list[deque[_Pair]] = [deque() for _ in range(len(self.bucket_bounds) + 1)]
+        self._queued = 0
+        self._throughput: Optional[float] = None
+        self.batches = 0
+        self.scored_pairs = 0
+        self.rejected_requests = 0
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="rerank-scorer", daemon=True)
+        self._thread.start()
+
+    @property
+    def queued(self) -> int:
+        return self._queued
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "queued_pairs": self._queued,
+                "bucket_depths": [len(bucket) for bucket in self._buckets],
+                "batches": self.batches,
+                "scored_pairs": self.scored_pairs,
+                "rejected_requests": self.rejected_requests,
+                "pairs_per_second": self._throughput,
+            }
+
+    def _bucket(self, query_tokens: int, document: str) -> int:
+        return bisect.bisect_left(self.bucket_bounds, query_tokens + estimate_tokens(document))
+
+    def retry_after(self) -> int:
+        """Seconds the current backlog is expected to take, at least one"""
+        if not self._throughput:
+            return MIN_RETRY_AFTER
+        return max(MIN_RETRY_AFTER, math.ceil(self._queued / self._throughput))
+
+    def submit(self, query: str, documents: list[str]) -> Job:
+        """
+        Queue the (query, document) pairs of one request
+
+        :param query: search query
+        :param documents: docs to score
+        :return: job to wait on
+        :raises RequestTooLarge: if the request can never fit in the queue
+        :raises Overloaded: if it does not fit now
+        """
+        return self.submit_many([(query, documents)])[0]
+
+    def submit_many(self, requests: list[tuple[str, list[str]]]) -> list[Job]:
+        """
+        Queue several requests at once, all or none of them
+
+        :param requests: list of (query, documents)
+        :return: one job per request
+        """
+        size = sum(len(documents) for _, documents in requests)
+        if size > self.max_queue_pairs:
+            raise RequestTooLarge(
+                f"Request has {size} pairs, the queue holds at most {self.max_queue_pairs}"
+            )
+        now = time.monotonic()
+        jobs = []
+        with self._condition:
+            if self._queued + size > self.max_queue_pairs:
+                self.rejected_requests += 1
+                raise Overloaded(self.retry_after())
+            for query, documents in requests:
+                job = Job(len(documents))
+                query_tokens = estimate_tokens(query)
+                for position, document in enumerate(documents):
+                    bucket = self._buckets[self._bucket(query_tokens, document)]
+                    bucket.append(_Pair(job, position, query, document, now))
+                jobs.append(job)
+            self._queued += size
+            self._condition.notify()
+        return jobs
+
+    def _next_batch(self) -> list[_Pair]:
+        """Wait for a bucket that is full or whose oldest pair waited long enough"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                oldest: Optional[deque[_Pair]] = None
+                for bucket in self._buckets:
+                    if len(bucket) >= self.max_batch_pairs:
+                        oldest = bucket
+                        break
+                    if bucket and (oldest is None or bucket[0].enqueued_at < oldest[0].enqueued_at):
+                        oldest = bucket
+                if oldest is None:
+                    self._condition.wait()
+                    continue
+                wait = oldest[0].enqueued_at + self.max_wait - now
+                if len(oldest) < self.max_batch_pairs and wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                batch = [oldest.popleft() for _ in range(min(self.max_batch_pairs, len(oldest)))]
+                self._queued -= len(batch)
+                return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = [pair for pair in self._next_batch() if not pair.job.cancelled]
+            if not batch:
+                continue
+            started = time.monotonic()
+            try:
+                scores = self.scorer.score([(pair.query, pair.document) for pair in batch])
+                if len(scores) != len(batch):
+                    raise ValueError(f"Scorer returned {len(scores)} scores for {len(batch)} pairs")
+            except Exception as e:
+                logger.exception("Scoring a batch failed")
+                for pair in batch:
+                    pair.job._fail(e)
+                continue
+            elapsed = max(time.monotonic() - started, 1e-6)
+            for pair, score in zip(batch, scores):
+                pair.job._resolve(pair.position, float(score))
+            with self._condition:
+                self.batches += 1
+                self.scored_pairs += len(batch)
+                rate = len(batch) / elapsed
+                if self._throughput is None:
+                    self._throughput = rate
+                else:
+                    self._throughput += THROUGHPUT_ALPHA * (rate - self._throughput)
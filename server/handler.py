@@ -0,0 +1,281 @@
+"""
+HTTP handler of the reference server.
+
+Implements the contract the plugin expects (see FORMAT_CONFIGURATION.md):
+
+* ``GET /health``
+* ``POST /rerank`` with ``query``, ``passages`` or ``documents`` (or
+  ``document_hashes``), ``top_k`` and optionally ``"response_format": "scores"``
+* ``POST /rerank/batch`` with ``{"requests": [...]}``
+* ``POST /documents/missing`` and ``POST /documents`` for content-addressed
+  uploads
+
+Request bodies may be JSON or MessagePack, gzip or zstd compressed, with a
+`Content-Length` or chunked. Responses are MessagePack when the client
+accepts it and the package is installed, JSON otherwise.
+"""
+
+import gzip
+import json
+import logging
+import time
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Optional
+
+from .batcher import DynamicBatcher, Overloaded, RequestTooLarge
+from .store import DocumentStore
+
+try:
+    import msgpack
+except ImportError:  # optional codec
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional codec
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+DEFAULT_REQUEST_TIMEOUT = 60.0
+# Bodies are read in pieces of this size
+READ_CHUNK_BYTES = 64 * 1024
+
+
+class HttpError(Exception):
+    """
+    Answer a request with `status` and a JSON-compatible `body`.
+    """
+
+    def __init__(self, status: int, body: Any, headers: Optional[dict[str, str]] = None):
+        super().__init__(str(body))
+        self.status = status
+        self.body = body
+        self.headers = headers or {}
+
+
+def _invalid(detail: str) -> HttpError:
+    return HttpError(422, {"detail": detail})
+
+
+class RerankHandler(BaseHTTPRequestHandler):
+    """
+    Request handler; `make_handler` binds it to a batcher and a store.
+    """
+
+    protocol_version = "HTTP/1.1"
+    server_version = "RerankServer/1.0"
+
+    batcher: DynamicBatcher
+    store: DocumentStore
+    request_timeout: float = DEFAULT_REQUEST_TIMEOUT
+
+    def log_message(self, format: str, *args: Any) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def do_GET(self) -> None:
+        if self.path.split("?")[0] != "/health":
+            return self._send(404, {"detail": "Not found"})
+        self._send(200, {"status": "ok", **self.batcher.stats()})
+
+    def do_POST(self) -> None:
+        routes = {
+            "/rerank": self._rerank,
+            "/rerank/batch": self._rerank_batch,
+            "/documents/missing": self._documents_missing,
+            "/documents": self._documents_upload,
+        }
+        route = routes.get(self.path.split("?")[0])
+        try:
+            payload = self._read_payload()
+            if route is None:
+                raise HttpError(404, {"detail": "Not found"})
+            self._send(200, route(payload))
+        except HttpError as e:
+            self._send(e.status, e.body, e.headers)
+        except Overloaded as e:
+            self._send(429, {"detail": str(e)}, {"Retry-After": str(e.retry_after)})
+        except RequestTooLarge as e:
+            self._send(413, {"detail": str(e)})
+        except TimeoutError as e:
+            self._send(503, {"detail": str(e)})
+        except Exception as e:
+            logger.exception(f"Failed to handle {self.path}")
+            self._send(500, {"detail": str(e)})
+
+    def _read_body(self) -> bytes:
+        if "chunked" in self.headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                line = self.rfile.readline()
+                try:
+                    size = int(line.split(b";")[0].strip(), 16)
+                except ValueError:
+                    self.close_connection = True
+                    raise HttpError(400, {"detail": "Malformed chunked body"})
+                if size == 0:
+                    # Skip trailers up to the blank line
+                    while self.rfile.readline() not in (b"\r\n", b"\n", b""):
+                        pass
+                    return b"".join(chunks)
+                chunks.append(self.rfile.read(size))
+                self.rfile.readline()
+        remaining = int(self.headers.get("Content-Length") or 0)
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, READ_CHUNK_BYTES))
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        return b"".join(chunks)
+
+    @staticmethod
+    def _decompress(body: bytes, encoding: str) -> bytes:
+        if encoding == "identity":
+            return body
+        if encoding == "gzip":
+            return gzip.decompress(body)
+        if encoding == "zstd" and zstandard is not None:
+            return zstandard.ZstdDecompressor().decompressobj().decompress(body)
+        raise HttpError(415, {"detail": f"Unsupported Content-Encoding {encoding}"})
+
+    def _read_payload(self) -> Any:
+        body = self._read_body()
+        try:
+            body = self._decompress(body, self.headers.get("Content-Encoding", "identity").lower())
+        except HttpError:
+            raise
+        except Exception as e:
+            raise HttpError(400, {"detail": f"Cannot decompress body: {e}"})
+
+        content_type = self.headers.get("Content-Type", JSON_CONTENT_TYPE)
+        if MSGPACK_CONTENT_TYPE in content_type:
+            if msgpack is None:
+                raise HttpError(415, {"detail": "MessagePack is not supported"})
+            try:
+                return msgpack.unpackb(body, raw=False)
+            except Exception as e:
+                raise HttpError(400, {"detail": f"Invalid MessagePack body: {e}"})
+        if not body:
+            return {}
+        try:
+            return json.loads(body)
+        except ValueError as e:
+            raise HttpError(400, {"detail": f"Invalid JSON body: {e}"})
+
+    def _send(self, status: int, body: Any, headers: Optional[dict[str, str]] = None) -> None:
+        if msgpack is not None and MSGPACK_CONTENT_TYPE in self.headers.get("Accept", ""):
+            data = msgpack.packb(body, use_bin_type=True)
+            content_type = MSGPACK_CONTENT_TYPE
+        else:
+            data = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            content_type = JSON_CONTENT_TYPE
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _query(self, request: Any) -> str:
+        if not isinstance(request, dict):
+            raise _invalid("Request must be an object")
+        query = request.get("query")
+        if not isinstance(query, str):
+            raise _invalid("'query' must be a string")
+        return query
+
+    def _documents(self, request: dict) -> list[str]:
+        """Texts of a request, looked up in the store if sent by hash"""
+        if "document_hashes" in request:
+            hashes = request["document_hashes"]
+            if not isinstance(hashes, list) or not all(isinstance(h, str) for h in hashes):
+                raise _invalid("'document_hashes' must be a list of strings")
+            texts = self.store.get_many(hashes)
+            missing = [digest for digest in dict.fromkeys(hashes) if digest not in texts]
+            if missing:
+                raise HttpError(409, {"missing": missing})
+            return [texts[digest] for digest in hashes]
+        documents = request.get("passages", request.get("documents"))
+        if not isinstance(documents, list) or not all(isinstance(d, str) for d in documents):
+            raise _invalid("'passages' or 'documents' must be a list of strings")
+        return documents
+
+    @staticmethod
+    def _response(request: dict, documents: list[str], scores: list[float]) -> dict:
+        if request.get("response_format") == "scores":
+            return {"scores": scores}
+        top_k = request.get("top_k")
+        top_k = len(documents) if top_k is None else max(0, int(top_k))
+        # Stable sort: equal scores keep the input order
+        order = sorted(range(len(scores)), key=lambda index: -scores[index])[:top_k]
+        return {
+            "results": [
+                {"index": index, "document": documents[index], "score": scores[index]}
+                for index in order
+            ]
+        }
+
+    def _rerank(self, request: Any) -> dict:
+        query = self._query(request)
+        documents = self._documents(request)
+        job = self.batcher.submit(query, documents)
+        return self._response(request, documents, job.wait(self.request_timeout))
+
+    def _rerank_batch(self, payload: Any) -> dict:
+        requests = payload.get("requests") if isinstance(payload, dict) else None
+        if not isinstance(requests, list):
+            raise _invalid("'requests' must be a list")
+        queries = [self._query(request) for request in requests]
+        documents, missing = [], []
+        for request in requests:
+            try:
+                documents.append(self._documents(request))
+            except HttpError as e:
+                if e.status != 409:
+                    raise
+                missing.extend(e.body["missing"])
+        if missing:
+            raise HttpError(409, {"missing": list(dict.fromkeys(missing))})
+
+        deadline = time.monotonic() + self.request_timeout
+        jobs = self.batcher.submit_many(list(zip(queries, documents)))
+        responses = []
+        for request, request_documents, job in zip(requests, documents, jobs):
+            scores = job.wait(max(0.0, deadline - time.monotonic()))
+            responses.append(self._response(request, request_documents, scores))
+        return {"responses": responses}
+
+    def _documents_missing(self, payload: Any) -> dict:
+        hashes = payload.get("hashes") if isinstance(payload, dict) else None
+        if not isinstance(hashes, list) or not all(isinstance(h, str) for h in hashes):
+            raise _invalid("'hashes' must be a list of strings")
+        return {"missing": self.store.missing(hashes)}
+
+    def _documents_upload(self, payload: Any) -> dict:
+        documents = payload.get("documents") if isinstance(payload, dict) else None
+        if not isinstance(documents, dict):
+            raise _invalid("'documents' must be an object mapping hashes to texts")
+        try:
+            return {"stored": self.store.put_many(documents)}
+        except ValueError as e:
+            raise _invalid(str(e))
+
+
+def make_handler(
+    batcher: DynamicBatcher,
+    store: DocumentStore,
+    request_timeout: float = DEFAULT_REQUEST_TIMEOUT,
+) -> type:
+    """
+    Handler class bound to one worker's batcher and store
+    """
+    return type(
+        "BoundRerankHandler",
+        (RerankHandler,),
+        {"batcher": batcher, "store": store, "request_timeout": request_timeout},
+    )
@@ -0,0 +1,90 @@
+"""
+Scorers for the reference reranker server.
+
+A scorer turns a batch of (query, document) pairs into relevance scores, one
+per pair and in the same order. Real deployments plug in a cross-encoder with
+``--scorer module:factory``; the built-in `ToyScorer` needs nothing but the
+standard library, so the server can be run and load-tested offline.
+"""
+
+import importlib
+import math
+import re
+import time
+from typing import Protocol
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class Scorer(Protocol):
+    def score(self, pairs: list[tuple[str, str]]) -> list[float]:
+        """
+        Score a batch of (query, document) pairs
+
+        :param pairs: pairs of one length bucket
+        :return: one score per pair, higher means more relevant
+        """
+        ...
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count used to bucket pairs by length: about four characters
+    per token, which is close enough for padding decisions
+    """
+    return len(text) // 4 + 1
+
+
+class ToyScorer:
+    """
+    Lexical-overlap scorer with logit-like output.
+
+    The score grows with the share of query terms found in the document and,
+    slowly, with how often they occur, and is spread over roughly -10..10
+    like the logits of a cross-encoder. `cost_per_token_us` simulates model
+    compute: a batch sleeps in proportion to its size times its longest
+    pair, as a padded forward pass would.
+    """
+
+    def __init__(self, cost_per_token_us: float = 0.0):
+        self.cost_per_token_us = cost_per_token_us
+
+    def score(self, pairs: list[tuple[str, str]]) -> list[float]:
+        if self.cost_per_token_us > 0 and pairs:
+            longest = max(estimate_tokens(query) + estimate_tokens(doc) for query, doc in pairs)
+            time.sleep(self.cost_per_token_us * longest * len(pairs) / 1_000_000)
+        return [self._score_pair(query, document) for query, document in pairs]
+
+    @staticmethod
+    def _score_pair(query: str, document: str) -> float:
+        terms = set(_WORD_RE.findall(query.lower()))
+        if not terms:
+            return -10.0
+        counts: dict[str, int] = {}
+        for word in _WORD_RE.findall(document.lower()):
+            if word in terms:
+                counts[word] = counts.get(word, 0) + 1
+        coverage = len(counts) / len(terms)
+        frequency = sum(math.log1p(count) for count in counts.values()) / len(terms)
+        return round(20.0 * coverage + 2.0 * frequency - 10.0, 6)
+
+
+def load_scorer(spec: str, cost_per_token_us: float = 0.0) -> Scorer:
+    """
+    Create the scorer named on the command line
+
+    :param spec: ``toy``, or ``module:attribute`` naming a scorer class or a
+                 factory called without arguments
+    :param cost_per_token_us: simulated compute cost of the toy scorer
+    :return: scorer
+    """
+    if spec == "toy":
+        return ToyScorer(cost_per_token_us)
+    module_name, _, attribute = spec.partition(":")
+    if not attribute:
+        raise ValueError(f"Scorer must be 'toy' or 'module:attribute', got {spec!r}")
+    factory = getattr(importlib.import_module(module_name), attribute)
+    scorer = factory()
+    if not callable(getattr(scorer, "score", None)):
+        raise ValueError(f"{spec} did not produce an object with a score(pairs) method")
+    return scorer
@@ -0,0 +1,130 @@
+"""
+Content-addressed document store of the reference server.
+
+Documents uploaded with ``POST /documents`` are kept under the hex SHA-256
+of their UTF-8 text in a SQLite database in WAL mode, so every worker
+process sees what any of them stored. The oldest-used documents are evicted
+once the store holds more than `max_documents`; clients notice through a 409
+from `/rerank` and resend texts.
+"""
+
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+DEFAULT_MAX_DOCUMENTS = 100_000
+# SQLite limits the number of bound parameters per statement.
+_LOOKUP_CHUNK = 500
+# How many writes happen between two size checks.
+_EVICT_EVERY = 1000
+
+
+def default_store_path() -> str:
+    return os.path.join(tempfile.gettempdir(), f"rerank-documents-{os.getpid()}.sqlite3")
+
+
+class DocumentStore:
+    """
+    SQLite-backed hash -> text store shared by worker processes.
+    """
+
+    def __init__(self, path: str, max_documents: int = DEFAULT_MAX_DOCUMENTS):
+        self.path = path
+        self.max_documents = max_documents
+        self._local = threading.local()
+        self._writes = 0
+        self._lock = threading.Lock()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS documents "
+                "(hash TEXT PRIMARY KEY, text TEXT NOT NULL, used_at REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS documents_used_at ON documents (used_at)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread; the handler threads of a process share nothing
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30.0)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _select(self, columns: str, hashes: list[str]) -> list[tuple]:
+        rows = []
+        connection = self._connection()
+        for start in range(0, len(hashes), _LOOKUP_CHUNK):
+            chunk = hashes[start : start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows.extend(
+                connection.execute(
+                    f"SELECT {columns} FROM documents WHERE hash IN ({placeholders})", chunk
+                )
+            )
+        return rows
+
+    def missing(self, hashes: list[str]) -> list[str]:
+        """
+        Hashes of documents the store does not hold, in input order
+        """
+        unique = list(dict.fromkeys(hashes))
+        present = {row[0] for row in self._select("hash", unique)}
+        return [digest for digest in unique if digest not in present]
+
+    def get_many(self, hashes: list[str]) -> dict[str, str]:
+        """
+        Texts of the stored documents among `hashes`, marked as recently used
+        """
+        unique = list(dict.fromkeys(hashes))
+        found = dict(self._select("hash, text", unique))
+        if found:
+            with self._connection() as connection:
+                now = time.time()
+                connection.executemany(
+                    "UPDATE documents SET used_at = ? WHERE hash = ?",
+                    ((now, digest) for digest in found),
+                )
+        return found
+
+    def put_many(self, documents: dict[str, str]) -> int:
+        """
+        Store documents keyed by their hash
+
+        :param documents: {hash: text}
+        :return: number of documents stored
+        :raises ValueError: if a hash does not match its text
+        """
+        for digest, text in documents.items():
+            actual = isinstance(text, str) and hashlib.sha256(text.encode("utf-8")).hexdigest()
+            if actual != digest:
+                raise ValueError(f"Hash {digest!r} does not match its document")
+        now = time.time()
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO documents (hash, text, used_at) VALUES (?, ?, ?)",
+                ((digest, text, now) for digest, text in documents.items()),
+            )
+        with self._lock:
+            self._writes += len(documents)
+            evict = self._writes >= _EVICT_EVERY
+            if evict:
+                self._writes = 0
+        if evict:
+            self._evict()
+        return len(documents)
+
+    def _evict(self) -> None:
+        with self._connection() as connection:
+            (count,) = connection.execute("SELECT COUNT(*) FROM documents").fetchone()
+            if count > self.max_documents:
+                connection.execute(
+                    "DELETE FROM documents WHERE hash IN "
+                    "(SELECT hash FROM documents ORDER BY used_at LIMIT ?)",
+                    (count - self.max_documents,),
+                )
@@ -0,0 +1,129 @@
+"""
+Process model of the reference server.
+
+The parent process binds the listening socket and forks `workers` children
+that all accept on it, so the kernel spreads connections across them. Each
+worker has its own scorer, batcher and scoring thread, and serves HTTP with
+one thread per connection. Uploaded documents live in a SQLite store shared
+by all workers. Platforms without `fork` run a single worker in-process.
+"""
+
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from http.server import ThreadingHTTPServer
+from typing import NamedTuple
+
+from .batcher import (
+    DEFAULT_MAX_BATCH_PAIRS,
+    DEFAULT_MAX_QUEUE_PAIRS,
+    DEFAULT_MAX_WAIT,
+    DynamicBatcher,
+)
+from .handler import DEFAULT_REQUEST_TIMEOUT, make_handler
+from .scoring import load_scorer
+from .store import DEFAULT_MAX_DOCUMENTS, DocumentStore, default_store_path
+
+logger = logging.getLogger(__name__)
+
+LISTEN_BACKLOG = 1024
+
+
+class ServerOptions(NamedTuple):
+    host: str = "0.0.0.0"
+    port: int = 8009
+    workers: int = 1
+    scorer: str = "toy"
+    toy_cost_us: float = 0.0
+    max_batch_pairs: int = DEFAULT_MAX_BATCH_PAIRS
+    max_wait: float = DEFAULT_MAX_WAIT
+    max_queue_pairs: int = DEFAULT_MAX_QUEUE_PAIRS
+    request_timeout: float = DEFAULT_REQUEST_TIMEOUT
+    store_path: str = ""
+    store_max_documents: int = DEFAULT_MAX_DOCUMENTS
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, listener: socket.socket, handler: type):
+        super().__init__(listener.getsockname()[:2], handler, bind_and_activate=False)
+        self.socket.close()
+        self.socket = listener
+
+
+def bind(options: ServerOptions) -> socket.socket:
+    """
+    Create the listening socket shared by all workers
+    """
+    listener = socket.create_server((options.host, options.port), backlog=LISTEN_BACKLOG)
+    listener.set_inheritable(True)
+    return listener
+
+
+def run_worker(listener: socket.socket, options: ServerOptions) -> None:
+    """
+    Serve requests accepted on `listener` until the process is stopped
+    """
+    scorer = load_scorer(options.scorer, options.toy_cost_us)
+    batcher = DynamicBatcher(
+        scorer,
+        max_batch_pairs=options.max_batch_pairs,
+        max_wait=options.max_wait,
+        max_queue_pairs=options.max_queue_pairs,
+    )
+    store = DocumentStore(options.store_path or default_store_path(), options.store_max_documents)
+    server = _Server(listener, make_handler(batcher, store, options.request_timeout))
+    logger.info(f"Worker {os.getpid()} serving on {listener.getsockname()[:2]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve(options: ServerOptions) -> None:
+    """
+    Bind, start the workers and wait for them
+
+    :param options: server options
+    """
+    if not options.store_path:
+        # Every worker must open the same store, so fix its path before forking
+        options = options._replace(store_path=default_store_path())
+    listener = bind(options)
+    workers = max(1, options.workers)
+    if workers > 1 and "fork" not in multiprocessing.get_all_start_methods():
+        logger.warning("fork is not available, running a single worker")
+        workers = 1
+    if workers == 1:
+        run_worker(listener, options)
+        return
+
+    context = multiprocessing.get_context("fork")
+    processes = [
+        context.Process(
+            target=run_worker, args=(listener, options), name=f"rerank-worker-{number}"
+        )
+        for number in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    listener.close()
+
+    def stop(signum: int, frame: object) -> None:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        stop(signal.SIGINT, None)
+        for process in processes:
+            process.join()
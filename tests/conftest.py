@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The plugin is run from its root directory, where `models` is importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
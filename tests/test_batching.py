@@ -0,0 +1,231 @@
+import threading
+from typing import Optional
+
+import pytest
+
+from models.rerank import batching
+from models.rerank.batching import MAX_BATCHERS, MicroBatcher, _Pending, get_batcher
+from models.rerank.rerank import BGERerankModel
+from models.rerank.sharding import ScoredDocument
+from models.rerank.transport import BatchNotSupportedError, RerankTransport
+
+
+class FakeTransport:
+    """
+    Scores a document by its length and records every request it was sent
+    """
+
+    def __init__(self, batch_supported: bool = True, credentials: Optional[dict] = None):
+        self.credentials = credentials or {"api_url": "http://fake:8000"}
+        self.batch_supported = batch_supported
+        self.requests: list[tuple[str, list[str]]] = []
+        self.batches: list[list[tuple[str, list[str], int]]] = []
+        self._lock = threading.Lock()
+
+    def rerank(self, query: str, documents: list[str], top_k: int) -> list[ScoredDocument]:
+        with self._lock:
+            self.requests.append((query, list(documents)))
+        return score(documents)
+
+    def rerank_batch(self, batch):
+        if not self.batch_supported:
+            raise BatchNotSupportedError("no /rerank/batch")
+        with self._lock:
+            self.batches.append(batch)
+        return [score(documents) for _, documents, _ in batch]
+
+
+def score(documents: list[str]) -> list[ScoredDocument]:
+    return [
+        ScoredDocument(index=index, score=float(len(text)), text=text)
+        for index, text in enumerate(documents)
+    ]
+
+
+def submit_concurrently(batcher: MicroBatcher, transport, calls):
+    """
+    Submit (query, documents) calls from concurrent threads; `transport` is
+    shared by all calls or a list with one per call
+    """
+    results: list = [None] * len(calls)
+    transports = transport if isinstance(transport, list) else [transport] * len(calls)
+
+    def call(position: int, query: str, documents: list[str]) -> None:
+        results[position] = batcher.submit(transports[position], query, documents)[0]
+
+    threads = [
+        threading.Thread(target=call, args=(position, query, documents))
+        for position, (query, documents) in enumerate(calls)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_get_batcher_is_off_without_a_window():
+    assert get_batcher({"api_url": "http://a"}, "texts") is None
+    assert get_batcher({"api_url": "http://a", "batch_window_ms": 0}, "texts") is None
+
+
+def test_get_batcher_is_shared_per_service_and_batch_settings():
+    credentials = {"api_url": "http://batch-a", "batch_window_ms": 20, "timeout": 30}
+    batcher = get_batcher(credentials, "texts")
+    assert batcher is get_batcher({**credentials, "timeout": 5, "api_key": "k"}, "texts")
+    assert batcher is not get_batcher(credentials, "documents")
+    assert batcher is not get_batcher({**credentials, "api_url": "http://batch-b"}, "texts")
+    assert batcher is not get_batcher({**credentials, "batch_window_ms": 50}, "texts")
+    assert batcher is not get_batcher({**credentials, "batch_max_pairs": 8}, "texts")
+
+
+def test_get_batcher_does_not_change_shared_settings():
+    credentials = {"api_url": "http://batch-c", "batch_window_ms": 20, "batch_max_pairs": 64}
+    batcher = get_batcher(credentials, "texts")
+    other = get_batcher({**credentials, "batch_window_ms": 500, "batch_max_pairs": 8}, "texts")
+    assert (batcher.window, batcher.max_pairs) == (0.02, 64)
+    assert (other.window, other.max_pairs) == (0.5, 8)
+
+
+def test_batcher_registry_is_bounded(monkeypatch):
+    monkeypatch.setattr(batching, "_batchers", batching.OrderedDict())
+    first = get_batcher({"api_url": "http://bounded-0", "batch_window_ms": 5}, "texts")
+    for number in range(1, MAX_BATCHERS + 5):
+        get_batcher({"api_url": f"http://bounded-{number}", "batch_window_ms": 5}, "texts")
+    assert len(batching._batchers) == MAX_BATCHERS
+    again = get_batcher({"api_url": "http://bounded-0", "batch_window_ms": 5}, "texts")
+    assert again is not first
+
+
+def test_resolve_splits_merged_scores_back_to_each_caller():
+    transport = FakeTransport()
+    first = _Pending(transport, "q", ["a", "bbb"])
+    second = _Pending(transport, "q", ["cc", "dddd", "e"])
+    MicroBatcher(window=0.01)._resolve(
+        [first, second], score(first.documents + second.documents)
+    )
+    assert [(doc.index, doc.text) for doc in first.result] == [(1, "bbb"), (0, "a")]
+    assert [(doc.index, doc.text) for doc in second.result] == [
+        (1, "dddd"),
+        (0, "cc"),
+        (2, "e"),
+    ]
+    assert first.done.is_set() and second.done.is_set()
+
+
+def test_same_query_callers_share_one_request():
+    transport = FakeTransport()
+    batcher = MicroBatcher(window=0.2)
+    calls = [("q", ["a", "bb"]), ("q", ["ccc"]), ("q", ["dddd", "e"])]
+    results = submit_concurrently(batcher, transport, calls)
+
+    assert len(transport.requests) == 1
+    for (_, documents), result in zip(calls, results):
+        assert sorted((doc.index, doc.text) for doc in result) == list(enumerate(documents))
+
+
+def test_different_queries_go_through_the_batch_endpoint():
+    transport = FakeTransport()
+    batcher = MicroBatcher(window=0.2)
+    calls = [("q1", ["a", "bb"]), ("q2", ["ccc"]), ("q1", ["dddd"])]
+    results = submit_concurrently(batcher, transport, calls)
+
+    assert transport.requests == []
+    assert len(transport.batches) == 1
+    assert sorted(query for query, _, _ in transport.batches[0]) == ["q1", "q2"]
+    for (_, documents), result in zip(calls, results):
+        assert sorted((doc.index, doc.text) for doc in result) == list(enumerate(documents))
+
+
+def test_falls_back_to_one_request_per_query():
+    transport = FakeTransport(batch_supported=False)
+    batcher = MicroBatcher(window=0.2)
+    calls = [("q1", ["a"]), ("q2", ["bb", "c"])]
+    results = submit_concurrently(batcher, transport, calls)
+
+    assert not batcher.batch_supported
+    assert sorted(query for query, _ in transport.requests) == ["q1", "q2"]
+    assert [doc.text for doc in results[1]] == ["bb", "c"]
+
+
+def test_pair_cap_starts_a_new_batch():
+    transport = FakeTransport()
+    batcher = MicroBatcher(window=0.2, max_pairs=3)
+    calls = [("q", ["a", "b"]), ("q", ["c", "d"])]
+    results = submit_concurrently(batcher, transport, calls)
+
+    assert sorted(documents for _, documents in transport.requests) == [["a", "b"], ["c", "d"]]
+    assert [len(result) for result in results] == [2, 2]
+
+
+def test_large_call_bypasses_the_batch():
+    transport = FakeTransport()
+    batcher = MicroBatcher(window=10.0, max_pairs=2)
+    result, queue_wait = batcher.submit(transport, "q", ["a", "bbb"])
+    assert queue_wait == 0.0
+    assert [doc.text for doc in result] == ["bbb", "a"]
+
+
+def test_failure_reaches_every_caller():
+    class FailingTransport(FakeTransport):
+        def rerank(self, query, documents, top_k):
+            raise RuntimeError("boom")
+
+    batcher = MicroBatcher(window=0.05)
+    with pytest.raises(RuntimeError, match="boom"):
+        batcher.submit(FailingTransport(), "q", ["a"])
+
+
+def test_calls_with_other_settings_are_sent_with_their_own_transport():
+    first = FakeTransport(credentials={"api_url": "http://fake:8000", "timeout": 30})
+    second = FakeTransport(credentials={"api_url": "http://fake:8000", "timeout": 5})
+    batcher = MicroBatcher(window=0.2)
+    results = submit_concurrently(
+        batcher, [first, first, second], [("q", ["a"]), ("q", ["bb"]), ("q", ["ccc"])]
+    )
+
+    assert [(query, sorted(documents)) for query, documents in first.requests] == [
+        ("q", ["a", "bb"])
+    ]
+    assert second.requests == [("q", ["ccc"])]
+    assert [[doc.text for doc in result] for result in results] == [["a"], ["bb"], ["ccc"]]
+
+
+class UnindexedTransport(FakeTransport):
+    """
+    Answers like a service with `output_format: simple`, without indices
+    """
+
+    def rerank(self, query, documents, top_k):
+        with self._lock:
+            self.requests.append((query, list(documents)))
+        return [ScoredDocument(index=-1, score=float(len(text)), text=text) for text in documents]
+
+
+def test_results_without_index_are_not_dropped():
+    transport = UnindexedTransport()
+    batcher = MicroBatcher(window=0.2)
+    calls = [("q", ["a", "bb"]), ("q", ["ccc"])]
+    results = submit_concurrently(batcher, transport, calls)
+
+    assert not batcher.indexed
+    for (_, documents), result in zip(calls, results):
+        assert sorted(doc.text for doc in result) == documents
+    # The merged request, then each call on its own
+    assert len(transport.requests) == 3
+
+    result, queue_wait = batcher.submit(transport, "q", ["dddd"])
+    assert [doc.text for doc in result] == ["dddd"] and queue_wait == 0.0
+
+
+def test_invocation_with_batching_against_simple_output_format(monkeypatch):
+    def rerank(self, query, documents, top_k):
+        return [
+            ScoredDocument(index=-1, score=float(len(text)), text=text) for text in documents
+        ]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": "http://simple-format:8000", "batch_window_ms": 5}
+    result = model._invoke("bge", credentials, "q", ["a", "ccc", "bb"], top_n=3)
+    assert [doc.text for doc in result.docs] == ["ccc", "bb", "a"]
@@ -0,0 +1,118 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from models.rerank.deadline import Deadline, DeadlineExceeded, get_deadline
+from models.rerank.prefilter import DEFAULT_FLOOR_SCORE
+from models.rerank.rerank import BGERerankModel
+from models.rerank.sharding import ScoredDocument
+from models.rerank.transport import RerankTransport
+
+API_URL = "http://deadline:8000"
+
+
+@pytest.fixture
+def fake_rerank(monkeypatch):
+    """
+    Replace `/rerank` calls: documents score by length, and a request
+    containing "slow" blocks until the test is over
+    """
+    released = threading.Event()
+    calls: list[list[str]] = []
+
+    def rerank(self, query: str, documents: list[str], top_k: int) -> list[ScoredDocument]:
+        calls.append(list(documents))
+        if any("slow" in document for document in documents):
+            released.wait(5)
+        if any("timeout" in document for document in documents):
+            raise requests.exceptions.ReadTimeout("read timed out")
+        scored = [
+            ScoredDocument(index=index, score=float(len(text)), text=text)
+            for index, text in enumerate(documents)
+        ]
+        return sorted(scored, key=lambda doc: doc.score, reverse=True)[:top_k]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    yield calls
+    released.set()
+
+
+def test_get_deadline():
+    assert get_deadline({}) is None
+    assert get_deadline({"deadline_ms": "0"}) is None
+    assert get_deadline({"deadline_ms": "250"}).budget == 0.25
+    with pytest.raises(ValueError):
+        get_deadline({"deadline_ms": "-1"})
+
+
+def test_request_timeout_is_cut_to_the_time_left():
+    deadline = Deadline(0.5)
+    assert deadline.timeout(0.1) == 0.1
+    assert 0.4 < deadline.timeout(30) <= 0.5
+    assert not deadline.expired
+
+
+def test_expired_deadline_refuses_new_requests():
+    deadline = Deadline(0.0)
+    assert deadline.expired
+    with pytest.raises(DeadlineExceeded):
+        deadline.timeout(30)
+
+
+def test_reserve_leaves_a_share_of_the_budget():
+    deadline = Deadline(1.0)
+    stage = deadline.reserve(0.25)
+    assert stage.budget == pytest.approx(0.75)
+    assert deadline.expires_at - stage.expires_at == pytest.approx(0.25)
+
+
+def test_rerank_many_drops_slow_and_timed_out_requests(fake_rerank):
+    transport = RerankTransport({"api_url": API_URL}, Deadline(0.3))
+    started = time.monotonic()
+    results = transport.rerank_many(
+        [("q", ["a", "bb"], 2), ("q", ["slow"], 1), ("q", ["timeout"], 1), ("q", ["ccc"], 1)]
+    )
+    assert time.monotonic() - started < 1.0
+    assert results[1] is None and results[2] is None
+    assert [doc.text for doc in results[0]] == ["bb", "a"]
+    assert [doc.text for doc in results[3]] == ["ccc"]
+
+
+def test_rerank_many_without_deadline_raises(fake_rerank):
+    transport = RerankTransport({"api_url": API_URL})
+    with pytest.raises(requests.exceptions.Timeout):
+        transport.rerank_many([("q", ["a"], 1), ("q", ["timeout"], 1)])
+
+
+def test_invocation_returns_partial_result_at_the_deadline(fake_rerank):
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": API_URL, "deadline_ms": 300, "shard_size": 2}
+    # Shards of two: ["bb", "a"], ["slow-1", "slow-2"], ["dddd", "ccc"]
+    documents = ["bb", "a", "slow-1", "slow-2", "dddd", "ccc"]
+
+    started = time.monotonic()
+    result, complete = model._rerank("bge", credentials, "q", documents, 6, None)
+    assert time.monotonic() - started < 1.0
+
+    assert not complete
+    # Finished shards first by score, then the unscored documents in input order
+    assert [(doc.index, doc.text) for doc in result.docs] == [
+        (4, "dddd"),
+        (5, "ccc"),
+        (0, "bb"),
+        (1, "a"),
+        (2, "slow-1"),
+        (3, "slow-2"),
+    ]
+    assert [doc.score for doc in result.docs[4:]] == [DEFAULT_FLOOR_SCORE] * 2
+    assert len(fake_rerank) == 3
+
+
+def test_invocation_is_complete_when_every_shard_finishes(fake_rerank):
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": API_URL, "deadline_ms": 1000, "shard_size": 2}
+    result, complete = model._rerank("bge", credentials, "q", ["a", "bb", "ccc"], 2, None)
+    assert complete
+    assert [doc.text for doc in result.docs] == ["ccc", "bb"]
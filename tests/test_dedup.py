@@ -0,0 +1,41 @@
+from models.rerank.dedup import collapse_duplicates, expand_duplicates
+from models.rerank.sharding import ScoredDocument, merge_top_k
+
+
+def doc(index: int, score: float, text: str = "") -> ScoredDocument:
+    return ScoredDocument(index=index, score=score, text=text or f"d{index}")
+
+
+def test_collapse_duplicates_keeps_first_occurrence():
+    unique, positions = collapse_duplicates(["a", "b", "a", "c", "b", "a"])
+    assert unique == ["a", "b", "c"]
+    assert positions == [[0, 2, 5], [1, 4], [3]]
+
+
+def test_expand_duplicates_gives_every_copy_the_score():
+    documents = ["a", "b", "a", "c", "b"]
+    unique, positions = collapse_duplicates(documents)
+    scored = [doc(1, 0.9, "b"), doc(0, 0.2, "a"), doc(2, 0.5, "c")]
+    expanded = expand_duplicates(scored, positions, documents)
+    assert [(d.index, d.score, d.text) for d in expanded] == [
+        (0, 0.2, "a"),
+        (1, 0.9, "b"),
+        (2, 0.2, "a"),
+        (3, 0.5, "c"),
+        (4, 0.9, "b"),
+    ]
+
+
+def test_expanded_duplicates_tie_in_favour_of_the_earlier_document():
+    documents = ["x", "y", "x"]
+    unique, positions = collapse_duplicates(documents)
+    expanded = expand_duplicates([doc(0, 0.7, "x"), doc(1, 0.1, "y")], positions, documents)
+    assert [d.index for d in merge_top_k([expanded], 2)] == [0, 2]
+
+
+def test_expand_duplicates_passes_through_unknown_indices():
+    documents = ["a", "a"]
+    unique, positions = collapse_duplicates(documents)
+    stray = doc(-1, 0.0, "?")
+    expanded = expand_duplicates([doc(0, 0.4, "a"), stray], positions, documents)
+    assert expanded == [stray, doc(0, 0.4, "a"), doc(1, 0.4, "a")]
@@ -0,0 +1,133 @@
+import sqlite3
+
+import pytest
+
+from models.rerank import disk_cache, score_cache
+from models.rerank.disk_cache import DiskScoreCache
+from models.rerank.score_cache import (
+    ENTRY_BYTES,
+    ScoreCache,
+    TieredScoreCache,
+    get_score_cache,
+    pair_keys,
+)
+
+MB = 1024 * 1024
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_700_000_000.0]
+    monkeypatch.setattr(disk_cache.time, "time", lambda: now[0])
+    return now
+
+
+def keys(count: int) -> list[bytes]:
+    return pair_keys("bge\0http\0svc", "q", [f"document {number}" for number in range(count)])
+
+
+def test_database_is_in_wal_mode(tmp_path):
+    cache = DiskScoreCache(str(tmp_path), MB, ttl=60)
+    with cache._connection() as connection:
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+
+def test_scores_survive_reopening(tmp_path):
+    a, b, c = keys(3)
+    DiskScoreCache(str(tmp_path), MB, ttl=60).put_many([(a, 0.25), (b, -1.5)])
+    reopened = DiskScoreCache(str(tmp_path), MB, ttl=60)
+    assert reopened.get_many([a, b, c]) == {a: 0.25, b: -1.5}
+
+
+def test_writes_are_seen_by_another_process(tmp_path):
+    # Two instances on one directory stand in for two worker processes
+    writer = DiskScoreCache(str(tmp_path), MB, ttl=60)
+    reader = DiskScoreCache(str(tmp_path), MB, ttl=60)
+    (a,) = keys(1)
+    assert reader.get_many([a]) == {}
+    writer.put_many([(a, 0.75)])
+    assert reader.get_many([a]) == {a: 0.75}
+
+
+def test_expired_scores_are_not_returned(tmp_path, clock):
+    cache = DiskScoreCache(str(tmp_path), MB, ttl=60)
+    (a,) = keys(1)
+    cache.put_many([(a, 0.5)])
+    clock[0] += 59
+    assert cache.get_many([a]) == {a: 0.5}
+    clock[0] += 1
+    assert cache.get_many([a]) == {}
+
+
+def test_lookups_larger_than_the_parameter_limit(tmp_path):
+    cache = DiskScoreCache(str(tmp_path), 64 * MB, ttl=60)
+    many = keys(1200)
+    cache.put_many((key, float(number)) for number, key in enumerate(many))
+    found = cache.get_many(many)
+    assert len(found) == 1200 and found[many[1199]] == 1199.0
+
+
+def test_compaction_keeps_the_database_under_the_cap(tmp_path, clock):
+    cache = DiskScoreCache(str(tmp_path), 64 * MB, ttl=60)
+    many = keys(4000)
+    for start in range(0, len(many), 500):
+        clock[0] += 1
+        cache.put_many((key, 1.0) for key in many[start : start + 500])
+    full = cache.size_bytes()
+
+    cache.max_bytes = full // 2
+    for _ in range(10):
+        cache.compact()
+    assert cache.size_bytes() <= cache.max_bytes
+    found = cache.get_many(many)
+    # The oldest entries go first
+    assert many[0] not in found and many[-1] in found
+
+
+def test_compaction_drops_expired_entries(tmp_path, clock):
+    cache = DiskScoreCache(str(tmp_path), 64 * MB, ttl=60)
+    old, new = keys(2)
+    cache.put_many([(old, 1.0)])
+    clock[0] += 30
+    cache.put_many([(new, 2.0)])
+    clock[0] += 45
+    cache.compact()
+    with cache._connection() as connection:
+        assert connection.execute("SELECT COUNT(*) FROM scores").fetchone()[0] == 1
+
+
+def test_disk_hits_are_promoted_to_memory(tmp_path):
+    a, b = keys(2)
+    DiskScoreCache(str(tmp_path), MB, ttl=60).put_many([(a, 0.5)])
+    memory = ScoreCache(100 * ENTRY_BYTES)
+    tiered = TieredScoreCache(memory, DiskScoreCache(str(tmp_path), MB, ttl=60))
+    assert tiered.get_many([a, b]) == {a: 0.5}
+    assert memory.get_many([a]) == {a: 0.5}
+
+    tiered.put_many([(b, 1.5)])
+    assert DiskScoreCache(str(tmp_path), MB, ttl=60).get_many([b]) == {b: 1.5}
+
+
+def test_database_errors_are_misses(tmp_path, monkeypatch):
+    disk = DiskScoreCache(str(tmp_path), MB, ttl=60)
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(disk, "get_many", locked)
+    monkeypatch.setattr(disk, "put_many", locked)
+    tiered = TieredScoreCache(None, disk)
+    (a,) = keys(1)
+    tiered.put_many([(a, 0.5)])
+    assert tiered.get_many([a]) == {}
+
+
+def test_get_score_cache_adds_the_persistent_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(score_cache, "_cache", None)
+    monkeypatch.setattr(score_cache, "_disk_caches", {})
+    directory = str(tmp_path / "scores")
+    cache = get_score_cache({"score_cache_dir": directory, "score_cache_disk_mb": 8})
+    assert isinstance(cache, TieredScoreCache) and cache.memory is None
+    assert cache.disk.max_bytes == 8 * MB
+    cache = get_score_cache({"score_cache_dir": directory, "score_cache_mb": 1})
+    assert cache.memory is not None and cache.disk is score_cache._disk_caches[directory]
@@ -0,0 +1,141 @@
+import json
+
+import pytest
+import requests
+
+from models.rerank import transport as transport_module
+from models.rerank.document_upload import (
+    DocumentUploader,
+    document_hash,
+    get_document_uploader,
+)
+from models.rerank.transport import RerankTransport
+
+DOCUMENTS = ["first chunk", "second chunk", "first chunk"]
+
+
+class UploadServer:
+    """
+    Stub session answering like a replica with the upload endpoints
+    """
+
+    def __init__(self, supported: bool = True):
+        self.supported = supported
+        self.stored: dict[str, str] = {}
+        self.requests: list[tuple[str, dict]] = []
+
+    def post(self, url, data=None, headers=None, timeout=None, stream=False):
+        path = url.split("/", 3)[3]
+        payload = json.loads(data)
+        self.requests.append((path, payload))
+        if path.startswith("documents") and not self.supported:
+            return respond(404, {"detail": "Not Found"})
+        if path == "documents/missing":
+            return respond(200, {"missing": [h for h in payload["hashes"] if h not in self.stored]})
+        if path == "documents":
+            self.stored.update(payload["documents"])
+            return respond(200, {})
+        if "document_hashes" in payload:
+            missing = [h for h in payload["document_hashes"] if h not in self.stored]
+            if missing:
+                return respond(409, {"missing": missing})
+            texts = [self.stored[h] for h in payload["document_hashes"]]
+        else:
+            texts = payload["passages"]
+        return respond(
+            200, {"results": [{"index": i, "score": float(len(t))} for i, t in enumerate(texts)]}
+        )
+
+    def paths(self) -> list[str]:
+        return [path for path, _ in self.requests]
+
+
+def respond(status_code: int, body: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body).encode()
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+@pytest.fixture
+def server(monkeypatch):
+    stub = UploadServer()
+    monkeypatch.setattr(transport_module, "get_session", lambda base_url, credentials=None: stub)
+    return stub
+
+
+def make_transport(api_url: str) -> RerankTransport:
+    return RerankTransport({"api_url": api_url, "document_upload": "on"})
+
+
+def test_documents_are_uploaded_once_and_then_referenced_by_hash(server):
+    transport = make_transport("http://upload-once:8000")
+    result = transport.rerank("q", DOCUMENTS, 3)
+    assert [(doc.index, doc.text, doc.score) for doc in result] == [
+        (0, "first chunk", 11.0),
+        (1, "second chunk", 12.0),
+        (2, "first chunk", 11.0),
+    ]
+    assert server.paths() == ["documents/missing", "documents", "rerank"]
+    # Duplicates are uploaded once
+    assert server.requests[1][1]["documents"] == {
+        document_hash("first chunk"): "first chunk",
+        document_hash("second chunk"): "second chunk",
+    }
+    assert "passages" not in server.requests[2][1]
+
+    server.requests.clear()
+    transport.rerank("q", DOCUMENTS, 3)
+    assert server.paths() == ["rerank"]
+
+
+def test_evicted_documents_are_resent_as_texts(server):
+    transport = make_transport("http://upload-evicted:8000")
+    transport.rerank("q", DOCUMENTS, 3)
+    server.stored.clear()
+    server.requests.clear()
+
+    result = transport.rerank("q", DOCUMENTS, 3)
+    assert len(result) == 3
+    assert server.paths() == ["rerank", "rerank"]
+    assert server.requests[1][1]["passages"] == DOCUMENTS
+
+    # The forgotten hashes are uploaded again next time
+    server.requests.clear()
+    transport.rerank("q", DOCUMENTS, 3)
+    assert server.paths() == ["documents/missing", "documents", "rerank"]
+
+
+def test_service_without_upload_endpoints_gets_texts(server):
+    server.supported = False
+    transport = make_transport("http://upload-unsupported:8000")
+    transport.rerank("q", DOCUMENTS, 3)
+    assert server.paths() == ["documents/missing", "rerank"]
+    assert server.requests[1][1]["passages"] == DOCUMENTS
+
+    server.requests.clear()
+    make_transport("http://upload-unsupported:8000").rerank("q", DOCUMENTS, 3)
+    assert server.paths() == ["rerank"]
+
+
+def test_acknowledged_hashes_are_kept_per_replica():
+    uploader = DocumentUploader(ack_cache_size=2)
+    uploader.acknowledge("http://a", ["h1", "h2"])
+    assert uploader.pending("http://a", ["h1", "h2", "h3"]) == ["h3"]
+    assert uploader.pending("http://b", ["h1"]) == ["h1"]
+    # h2 was used last, so h1 makes room for h3
+    uploader.pending("http://a", ["h2"])
+    uploader.acknowledge("http://a", ["h3"])
+    assert uploader.pending("http://a", ["h1", "h2", "h3"]) == ["h1"]
+
+    uploader.forget(["h2"])
+    assert uploader.pending("http://a", ["h2"]) == ["h2"]
+
+
+def test_get_document_uploader():
+    assert get_document_uploader({}) is None
+    uploader = get_document_uploader({"api_url": "http://shared", "document_upload": "on"})
+    assert uploader is get_document_uploader({"api_url": "http://shared/", "document_upload": "on"})
+    with pytest.raises(ValueError):
+        get_document_uploader({"document_upload": "always"})
@@ -0,0 +1,198 @@
+import threading
+
+import pytest
+
+from models.rerank import endpoints
+from models.rerank.endpoints import (
+    EJECT_AFTER_FAILURES,
+    EJECT_SECONDS,
+    EndpointPool,
+    get_endpoint_pool,
+    parse_api_urls,
+    service_key,
+)
+from models.rerank.health import HealthStatus, health_registry
+
+A, B, C = "http://a:8000", "http://b:8000", "http://c:8000"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(endpoints.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def probe(monkeypatch):
+    """
+    Replace `/health` probes; set `probe["healthy"]` to choose their answer
+    """
+    state = {"healthy": True, "checked": []}
+
+    def check(base_url, timeout=None):
+        state["checked"].append(base_url)
+        return HealthStatus(state["healthy"], 200 if state["healthy"] else 503, "", 0.0)
+
+    monkeypatch.setattr(health_registry, "check", check)
+    monkeypatch.setattr(health_registry, "is_down", lambda base_url: False)
+    return state
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    waited = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        waited.wait(0.01)
+    raise AssertionError("condition not reached")
+
+
+def fail(pool: EndpointPool, url: str, times: int = EJECT_AFTER_FAILURES) -> None:
+    replica = next(replica for replica in pool.replicas if replica.url == url)
+    for _ in range(times):
+        replica.in_flight += 1
+        pool.release(replica, 0.1, ok=False)
+
+
+def test_parse_api_urls():
+    assert parse_api_urls("http://a:8000/, http://b:8000\nhttp://A:8000") == [A, B]
+    assert parse_api_urls("") == []
+    assert service_key(f"{A},{B}") == service_key(f"{B} {A}/")
+
+
+def test_pool_is_shared_per_replica_set():
+    assert get_endpoint_pool(f"{A},{B}") is get_endpoint_pool(f"{B},{A}")
+    assert get_endpoint_pool(f"{A},{B}") is not get_endpoint_pool(A)
+    with pytest.raises(ValueError):
+        EndpointPool([])
+
+
+def test_slowest_of_three_replicas_is_never_picked(clock, probe):
+    pool = EndpointPool([A, B, C])
+    for replica, latency in zip(pool.replicas, (0.01, 0.02, 0.5)):
+        replica.ewma_latency = latency
+    picked = set()
+    for _ in range(200):
+        replica = pool.acquire()
+        picked.add(replica.url)
+        pool.release(replica, replica.ewma_latency, ok=True)
+    assert picked == {A, B}
+
+
+def test_busy_replica_loses_to_an_idle_one(clock, probe):
+    pool = EndpointPool([A, B])
+    for replica in pool.replicas:
+        replica.ewma_latency = 0.1
+    pool.replicas[0].in_flight = 3
+    assert all(pool.acquire().url == B for _ in range(3))
+    # B now has 3 in flight as well, and the tie keeps both in use
+    assert {pool.acquire().url for _ in range(20)} == {A, B}
+
+
+def test_unmeasured_replica_is_tried(clock, probe):
+    pool = EndpointPool([A, B])
+    pool.replicas[0].ewma_latency = 0.1
+    pool.replicas[0].in_flight = 1
+    assert pool.acquire().url == B
+
+
+def test_latency_is_averaged(clock, probe):
+    pool = EndpointPool([A])
+    with pool.track() as call:
+        clock[0] += 1.0
+        call.ok = True
+    with pool.track() as call:
+        clock[0] += 2.0
+        call.ok = True
+    assert pool.replicas[0].ewma_latency == pytest.approx(1.3)
+    assert pool.replicas[0].in_flight == 0
+
+
+def test_avoid_prefers_another_replica(clock, probe):
+    pool = EndpointPool([A, B])
+    avoid = {A}
+    assert pool.acquire(avoid).url == B
+    assert avoid == {A, B}
+    # Nothing else is left, so an avoided replica is still used
+    assert pool.acquire(avoid).url in (A, B)
+
+
+def test_replica_is_ejected_after_consecutive_failures(clock, probe):
+    pool = EndpointPool([A, B])
+    fail(pool, A, EJECT_AFTER_FAILURES - 1)
+    replica = pool.replicas[0]
+    replica.in_flight += 1
+    pool.release(replica, 0.1, ok=True)
+    fail(pool, A, EJECT_AFTER_FAILURES - 1)
+    assert replica.healthy
+
+    fail(pool, A, 1)
+    assert not replica.healthy and replica.ejections == 1
+    assert all(pool.acquire().url == B for _ in range(10))
+
+
+def test_abandoned_calls_are_not_failures(clock, probe):
+    pool = EndpointPool([A, B])
+    for _ in range(EJECT_AFTER_FAILURES):
+        with pool.track({B}) as call:
+            call.ok = None
+    assert pool.replicas[0].healthy and pool.replicas[0].failures == 0
+
+
+def test_single_replica_is_never_ejected(clock, probe):
+    pool = EndpointPool([A])
+    fail(pool, A, 10)
+    assert pool.replicas[0].healthy
+
+
+def test_replica_due_back_first_is_used_when_all_are_ejected(clock, probe):
+    pool = EndpointPool([A, B])
+    fail(pool, B)
+    clock[0] += 1
+    fail(pool, A)
+    assert pool.acquire().url == B
+
+
+def test_recovered_replica_is_readmitted_after_a_probe(clock, probe):
+    pool = EndpointPool([A, B])
+    fail(pool, A)
+    replica = pool.replicas[0]
+    replica.ewma_latency = 5.0
+
+    clock[0] += EJECT_SECONDS - 0.1
+    pool.acquire()
+    assert probe["checked"] == []
+
+    clock[0] += 0.1
+    pool.acquire()
+    wait_until(lambda: not replica.probing)
+    assert probe["checked"] == [A]
+    assert replica.healthy and replica.ewma_latency is None
+
+
+def test_failed_probe_doubles_the_ejection(clock, probe):
+    probe["healthy"] = False
+    pool = EndpointPool([A, B])
+    fail(pool, A)
+    replica = pool.replicas[0]
+
+    clock[0] += EJECT_SECONDS
+    pool.acquire()
+    wait_until(lambda: not replica.probing)
+    assert not replica.healthy
+    assert replica.ejected_until == clock[0] + 2 * EJECT_SECONDS
+
+    probe["healthy"] = True
+    clock[0] += 2 * EJECT_SECONDS
+    pool.acquire()
+    wait_until(lambda: not replica.probing)
+    assert replica.healthy and replica.eject_seconds == EJECT_SECONDS
+
+
+def test_replicas_down_in_the_health_registry_are_skipped(clock, probe, monkeypatch):
+    monkeypatch.setattr(health_registry, "is_down", lambda base_url: base_url == A)
+    pool = EndpointPool([A, B])
+    assert all(pool.acquire().url == B for _ in range(10))
+    monkeypatch.setattr(health_registry, "is_down", lambda base_url: True)
+    assert {pool.acquire().url for _ in range(40)} == {A, B}
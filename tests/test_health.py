@@ -0,0 +1,126 @@
+import threading
+
+import pytest
+import requests
+
+from models.rerank import health
+from models.rerank.health import FRESHNESS_INTERVALS, UNPROBED_TTL, HealthRegistry
+
+A, B = "http://a:8000", "http://b:8000"
+
+
+class StubSession:
+    """
+    Answers `/health` with the status code set per URL, or fails to connect
+    """
+
+    def __init__(self):
+        self.codes: dict[str, int] = {}
+        self.calls: list[str] = []
+
+    def get(self, url, timeout=None):
+        self.calls.append(url)
+        code = self.codes.get(url.rsplit("/", 1)[0])
+        if code is None:
+            raise requests.exceptions.ConnectionError("connection refused")
+        response = requests.Response()
+        response.status_code = code
+        response._content = b"" if code < 400 else b"loading model"
+        return response
+
+
+@pytest.fixture
+def session(monkeypatch):
+    stub = StubSession()
+    monkeypatch.setattr(health, "get_session", lambda base_url, credentials=None: stub)
+    return stub
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(health.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_result_is_cached_for_the_unprobed_ttl(session, clock):
+    registry = HealthRegistry()
+    session.codes[A] = 200
+    assert registry.cached(A) is None
+    assert registry.status(A).healthy
+    clock[0] += UNPROBED_TTL - 1
+    assert registry.status(A).healthy
+    assert len(session.calls) == 1
+
+    clock[0] += 1.5
+    assert registry.cached(A) is None
+    registry.status(A)
+    assert len(session.calls) == 2
+
+
+def test_probed_replica_is_trusted_for_two_intervals(session, clock):
+    registry = HealthRegistry()
+    # Only the TTL is under test here, not the prober
+    registry._probe_forever = lambda: None
+    session.codes[A] = 200
+    registry.status(A, {"health_check_interval": 100})
+    clock[0] += FRESHNESS_INTERVALS * 100
+    assert registry.cached(A) is not None
+    clock[0] += 1
+    assert registry.cached(A) is None
+
+
+def test_cached_failure_is_checked_again(session, clock):
+    registry = HealthRegistry()
+    session.codes[A] = 503
+    status = registry.status(A)
+    assert not status.healthy and status.status_code == 503
+    assert registry.is_down(A)
+
+    session.codes[A] = 200
+    assert registry.status(A).healthy
+    assert not registry.is_down(A)
+    assert len(session.calls) == 2
+
+
+def test_connection_error_is_unhealthy(session, clock):
+    status = HealthRegistry().check(A)
+    assert not status.healthy and status.status_code is None
+    assert "connection refused" in status.detail
+
+
+def test_unknown_replica_is_not_down(session, clock):
+    assert not HealthRegistry().is_down(A)
+
+
+def test_require_healthy_returns_the_healthy_replicas(session, clock):
+    registry = HealthRegistry()
+    session.codes[A] = 200
+    session.codes[B] = 503
+    assert registry.require_healthy([A, B]) == [A]
+
+
+def test_require_healthy_fails_when_no_replica_is_healthy(session, clock):
+    session.codes[B] = 503
+    with pytest.raises(ValueError) as error:
+        HealthRegistry().require_healthy([A, B])
+    assert f"{A}: connection refused" in str(error.value)
+    assert f"{B}: status code 503: loading model" in str(error.value)
+
+
+def test_prober_checks_in_the_background_and_stops_without_intervals(session):
+    registry = HealthRegistry()
+    session.codes[A] = 200
+    registry.register(A, {"health_check_interval": 0.02})
+    prober = registry._prober
+    waited = threading.Event()
+    for _ in range(500):
+        if len(session.calls) >= 2:
+            break
+        waited.wait(0.01)
+    assert len(session.calls) >= 2
+    assert registry.cached(A).healthy
+
+    registry.register(A, {"health_check_interval": 0})
+    prober.join(5)
+    assert not prober.is_alive() and registry._prober is None
@@ -0,0 +1,166 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from models.rerank import hedging
+from models.rerank.hedging import MIN_HEDGE_DELAY, MIN_SAMPLES, HedgePolicy, get_hedge_policy
+
+
+def trained(latency: float = 0.02, budget: float = 1.0) -> HedgePolicy:
+    """
+    Policy that knows enough latencies to hedge and has tokens to spend
+    """
+    policy = HedgePolicy(budget=budget)
+    for _ in range(MIN_SAMPLES):
+        policy.record(latency)
+    policy._tokens = 5.0
+    return policy
+
+
+class Attempts:
+    """
+    Attempts taking the given seconds in turn, returning their number
+    """
+
+    def __init__(self, *durations: float):
+        self.durations = list(durations)
+        self.calls = 0
+        self.threads = []
+        self._lock = threading.Lock()
+
+    def __call__(self) -> int:
+        with self._lock:
+            number = self.calls
+            self.calls += 1
+            self.threads.append(threading.current_thread())
+        time.sleep(self.durations[number])
+        return number
+
+
+def test_hedging_is_off_by_default():
+    assert get_hedge_policy({"api_url": "http://hedged"}) is None
+    with pytest.raises(ValueError):
+        get_hedge_policy({"api_url": "http://hedged", "hedging": "always"})
+
+
+def test_delay_is_unknown_until_enough_samples():
+    policy = HedgePolicy()
+    for _ in range(MIN_SAMPLES - 1):
+        policy.record(0.5)
+    assert policy.delay() is None
+    policy.record(0.5)
+    assert policy.delay() == 0.5
+
+
+def test_delay_is_the_latency_quantile():
+    policy = HedgePolicy(quantile=0.95)
+    for latency in range(1, 101):
+        policy.record(latency / 1000)
+    assert policy.delay() == pytest.approx(0.095)
+    fast = HedgePolicy()
+    for _ in range(MIN_SAMPLES):
+        fast.record(0.0)
+    assert fast.delay() == MIN_HEDGE_DELAY
+
+
+def test_without_a_delay_the_attempt_runs_on_the_caller_thread():
+    attempts = Attempts(0.0)
+    assert HedgePolicy().run(attempts) == 0
+    assert attempts.threads == [threading.current_thread()]
+
+
+def test_slow_attempt_is_hedged_and_the_loser_is_discarded():
+    discarded = []
+    attempts = Attempts(0.3, 0.0)
+    assert trained().run(attempts, discard=discarded.append) == 1
+    assert attempts.calls == 2
+    time.sleep(0.4)
+    assert discarded == [0]
+
+
+def test_fast_attempt_is_not_hedged():
+    attempts = Attempts(0.0, 0.0)
+    assert trained(latency=0.2).run(attempts) == 0
+    assert attempts.calls == 1
+
+
+def test_failed_attempt_waits_for_the_other_one():
+    policy = trained()
+    calls = []
+
+    def attempt():
+        calls.append(None)
+        if len(calls) == 1:
+            time.sleep(0.05)
+            raise RuntimeError("first failed")
+        time.sleep(0.1)
+        return "second"
+
+    assert policy.run(attempt) == "second"
+
+
+def test_spent_budget_sends_no_hedge():
+    policy = trained(budget=0.0)
+    policy._tokens = 0.0
+    attempts = Attempts(0.1, 0.0)
+    assert policy.run(attempts) == 0
+    assert attempts.calls == 1
+
+
+def test_budget_limits_the_share_of_hedged_requests():
+    policy = trained(latency=0.001, budget=0.25)
+    # Enough history that the slow attempts below do not move the quantile
+    for _ in range(500):
+        policy.record(0.001)
+    policy._tokens = 0.0
+    calls = 0
+    for _ in range(20):
+        attempts = Attempts(0.02, 0.0)
+        policy.run(attempts)
+        calls += attempts.calls
+    assert 20 + 3 <= calls <= 20 + 5
+
+
+def test_hedge_delay_starts_when_the_attempt_runs(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(hedging, "_executor", executor)
+    try:
+        # The only worker is busy for longer than the hedge delay
+        executor.submit(time.sleep, 0.2)
+        policy = trained(latency=0.05)
+        attempts = Attempts(0.0, 0.0)
+        assert policy.run(attempts) == 0
+        assert attempts.calls == 1
+        # No hedge was sent, not even one cancelled before it could run
+        assert policy._tokens == 5.0 + policy.budget
+    finally:
+        executor.shutdown()
+
+
+def test_async_loser_is_cancelled():
+    cancelled = []
+
+    async def main():
+        policy = trained()
+        calls = []
+
+        async def attempt():
+            calls.append(None)
+            if len(calls) == 1:
+                try:
+                    await asyncio.sleep(1)
+                except asyncio.CancelledError:
+                    cancelled.append(True)
+                    raise
+                return "first"
+            return "hedge"
+
+        result = await policy.arun(attempt)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(main()) == "hedge"
+    assert cancelled == [True]
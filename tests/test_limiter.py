@@ -0,0 +1,129 @@
+import random
+import threading
+import time
+
+import pytest
+import requests
+
+from models.rerank.limiter import (
+    IGNORED,
+    INITIAL_LIMIT,
+    OK,
+    OVERLOADED,
+    AdaptiveLimiter,
+    ConcurrencyLimitError,
+    classify,
+    get_limiter,
+)
+
+
+def make_response(status_code: int) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    return response
+
+
+def run_callers(limiter: AdaptiveLimiter, callers: int, seconds: float, overload_at=None):
+    """
+    Callers sending back to back at a steady ~2 ms latency; the call numbered
+    `overload_at` of the first caller is answered with an overload signal.
+    Returns the highest number of requests seen in flight.
+    """
+    stop = time.monotonic() + seconds
+    peak = [0]
+
+    def caller(number: int) -> None:
+        sent = 0
+        while time.monotonic() < stop:
+            started = limiter.acquire()
+            peak[0] = max(peak[0], limiter.in_flight)
+            time.sleep(0.002 * random.uniform(0.8, 1.3))
+            overloaded = number == 0 and sent == overload_at
+            limiter.release(started, 1, OVERLOADED if overloaded else OK)
+            sent += 1
+
+    threads = [threading.Thread(target=caller, args=(number,)) for number in range(callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(seconds + 5)
+    return peak[0]
+
+
+def test_classify():
+    assert classify(make_response(200)) == OK
+    assert classify(make_response(429)) == OVERLOADED
+    assert classify(make_response(503)) == OVERLOADED
+    assert classify(make_response(400)) == IGNORED
+    assert classify(error=requests.exceptions.ReadTimeout()) == OVERLOADED
+    assert classify(error=ValueError()) == IGNORED
+
+
+def test_limiter_is_off_by_default():
+    assert get_limiter({"api_url": "http://limited"}) is None
+    with pytest.raises(ValueError):
+        get_limiter({"api_url": "http://limited", "concurrency_limit": "bogus"})
+
+
+def test_overload_halves_the_limit_once_per_round_trip():
+    limiter = AdaptiveLimiter()
+    slots = [limiter.acquire() for _ in range(INITIAL_LIMIT)]
+    limiter.release(slots[0], 1, OVERLOADED)
+    assert limiter.limit == INITIAL_LIMIT // 2
+    # Started before the decrease, so it says nothing new
+    limiter.release(slots[1], 1, OVERLOADED)
+    assert limiter.limit == INITIAL_LIMIT // 2
+
+
+def test_full_queue_and_queue_timeout_are_rejected():
+    limiter = AdaptiveLimiter(max_limit=1, queue_size=1, queue_timeout=0.05)
+    limiter.acquire()
+    with pytest.raises(ConcurrencyLimitError):
+        limiter.acquire()
+    assert limiter.queue_depth == 0
+
+
+def test_raised_limit_admits_queued_callers_at_once():
+    limiter = AdaptiveLimiter(max_limit=4)
+    limiter._limit = 1.0
+    started = limiter.acquire()
+    admitted = []
+    threads = [
+        threading.Thread(target=lambda: admitted.append(limiter.acquire())) for _ in range(3)
+    ]
+    for thread in threads:
+        thread.start()
+    while limiter.queue_depth < 3:
+        time.sleep(0.001)
+
+    limiter.release(started, 1, OK)
+    for thread in threads:
+        thread.join(0.2)
+    # The release grew the limit to 2 because calls were queued, and both
+    # free slots were handed out
+    assert limiter.limit == 2
+    assert len(admitted) == 2 and limiter.in_flight == 2 and limiter.queue_depth == 1
+    for started in admitted:
+        limiter.release(started, 1, IGNORED)
+    for thread in threads:
+        thread.join(1)
+    assert len(admitted) == 3
+
+
+def test_limit_grows_while_callers_are_queued():
+    limiter = AdaptiveLimiter(max_limit=64)
+    peak = run_callers(limiter, callers=40, seconds=1.0)
+    assert limiter.limit >= 30
+    assert peak >= 30
+    assert limiter.in_flight == 0 and limiter.queue_depth == 0
+
+
+def test_limit_recovers_after_backoff():
+    limiter = AdaptiveLimiter(max_limit=64)
+    run_callers(limiter, callers=40, seconds=0.5)
+    grown = limiter.limit
+    assert grown > INITIAL_LIMIT
+
+    run_callers(limiter, callers=40, seconds=1.0, overload_at=0)
+    assert limiter.limit >= grown // 2
+    assert limiter.limit >= 30
@@ -0,0 +1,163 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+tokenizers = pytest.importorskip("tokenizers")
+
+from models.rerank import local_backend  # noqa: E402
+from models.rerank.local_backend import (  # noqa: E402
+    LocalCrossEncoder,
+    check_memory,
+    get_local_backend,
+    memory_limit,
+)
+
+WORDS = ["<pad>", "<s>", "</s>", "<unk>"] + "cats dogs birds fish the a about and of on in is".split()
+
+
+def make_tokenizer():
+    tokenizer = tokenizers.Tokenizer(
+        tokenizers.models.WordLevel({word: i for i, word in enumerate(WORDS)}, unk_token="<unk>")
+    )
+    tokenizer.pre_tokenizer = tokenizers.pre_tokenizers.Whitespace()
+    tokenizer.post_processor = tokenizers.processors.TemplateProcessing(
+        single="<s> $A </s>",
+        pair="<s> $A </s> </s> $B:1 </s>:1",
+        special_tokens=[("<s>", 1), ("</s>", 2)],
+    )
+    return tokenizer
+
+
+class StubSession:
+    """
+    Stands in for an onnxruntime session: the logit is a projection of the
+    mean token embedding under the attention mask, like a pooled encoder
+    """
+
+    def __init__(self):
+        rng = np.random.default_rng(0)
+        self.embeddings = rng.normal(size=(len(WORDS), 8)).astype(np.float32)
+        self.weights = rng.normal(size=(8, 1)).astype(np.float32)
+        self.shapes: list[tuple[int, int]] = []
+
+    def get_inputs(self):
+        return [SimpleNamespace(name="input_ids"), SimpleNamespace(name="attention_mask")]
+
+    def run(self, output_names, feeds):
+        input_ids, mask = feeds["input_ids"], feeds["attention_mask"]
+        self.shapes.append(input_ids.shape)
+        summed = (self.embeddings[input_ids] * mask[..., None]).sum(axis=1)
+        return [(summed / mask.sum(axis=1, keepdims=True)) @ self.weights]
+
+
+DOCUMENTS = [
+    "cats",
+    "the dogs and the birds on the fish in the cats",
+    "fish",
+    "a bird is about a fish",
+    "dogs of the cats",
+    "the",
+    "birds and fish and cats and dogs",
+]
+
+
+def test_bucketed_batches_score_like_single_pairs():
+    session = StubSession()
+    bucketed = LocalCrossEncoder(session, make_tokenizer(), batch_size=3).score("cats", DOCUMENTS)
+    # Three batches, each padded only to its own longest pair
+    assert [rows for rows, _ in session.shapes] == [3, 3, 1]
+    assert [width for _, width in session.shapes] == sorted(width for _, width in session.shapes)
+
+    alone = LocalCrossEncoder(StubSession(), make_tokenizer(), batch_size=1).score("cats", DOCUMENTS)
+    np.testing.assert_allclose(bucketed, alone, rtol=1e-6)
+
+
+def test_rerank_keeps_document_order_and_indices():
+    encoder = LocalCrossEncoder(StubSession(), make_tokenizer(), batch_size=4)
+    result = encoder.rerank("cats", DOCUMENTS)
+    assert [(doc.index, doc.text) for doc in result] == list(enumerate(DOCUMENTS))
+    assert encoder.rerank("cats", []) == []
+
+
+def test_long_pairs_are_truncated():
+    session = StubSession()
+    encoder = LocalCrossEncoder(session, make_tokenizer(), max_length=6)
+    encoder.score("cats", ["the dogs and the birds on the fish"])
+    assert session.shapes == [(1, 6)]
+
+
+def test_memory_limit_comes_from_the_manifest():
+    assert memory_limit() == 268435456
+
+
+def test_memory_guard_rejects_a_model_that_does_not_fit(monkeypatch):
+    monkeypatch.setattr(local_backend, "memory_limit", lambda: 100 * 2**20)
+    monkeypatch.setattr(local_backend, "resident_memory", lambda: 90 * 2**20)
+    check_memory(5 * 2**20, "Model")
+    with pytest.raises(ValueError, match="resource.memory"):
+        check_memory(20 * 2**20, "Model")
+
+
+def test_model_too_large_for_the_plugin_is_not_loaded(monkeypatch, tmp_path):
+    (tmp_path / "model.onnx").write_bytes(b"\0" * 2**20)
+    make_tokenizer().save(str(tmp_path / "tokenizer.json"))
+    monkeypatch.setattr(local_backend, "memory_limit", lambda: 2**20)
+    monkeypatch.setattr(local_backend, "resident_memory", lambda: 0)
+    # The guard runs before onnxruntime is touched
+    monkeypatch.setattr(local_backend, "onnxruntime", object())
+    with pytest.raises(ValueError, match="resource.memory"):
+        LocalCrossEncoder.load(str(tmp_path))
+
+
+def test_get_local_backend_settings():
+    assert get_local_backend({}) is None
+    assert get_local_backend({"backend": "http"}) is None
+    with pytest.raises(ValueError):
+        get_local_backend({"backend": "gpu"})
+    with pytest.raises(ValueError, match="local_model_path"):
+        get_local_backend({"backend": "local"})
+
+
+def test_onnx_export_loads_and_scores_like_the_stub(monkeypatch, tmp_path):
+    pytest.importorskip("onnxruntime")
+    onnx = pytest.importorskip("onnx")
+    from onnx import TensorProto, helper, numpy_helper
+
+    stub = StubSession()
+    nodes = [
+        helper.make_node("Gather", ["embeddings", "input_ids"], ["embedded"]),
+        helper.make_node("Cast", ["attention_mask"], ["mask"], to=TensorProto.FLOAT),
+        helper.make_node("Unsqueeze", ["mask", "last_axis"], ["mask3"]),
+        helper.make_node("Mul", ["embedded", "mask3"], ["masked"]),
+        helper.make_node("ReduceSum", ["masked", "token_axis"], ["summed"], keepdims=0),
+        helper.make_node("ReduceSum", ["mask", "token_axis"], ["count"], keepdims=1),
+        helper.make_node("Div", ["summed", "count"], ["pooled"]),
+        helper.make_node("MatMul", ["pooled", "weights"], ["logits"]),
+    ]
+    initializers = [
+        numpy_helper.from_array(stub.embeddings, "embeddings"),
+        numpy_helper.from_array(stub.weights, "weights"),
+        numpy_helper.from_array(np.array([2], np.int64), "last_axis"),
+        numpy_helper.from_array(np.array([1], np.int64), "token_axis"),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "tiny",
+        [
+            helper.make_tensor_value_info("input_ids", TensorProto.INT64, ["batch", "tokens"]),
+            helper.make_tensor_value_info("attention_mask", TensorProto.INT64, ["batch", "tokens"]),
+        ],
+        [helper.make_tensor_value_info("logits", TensorProto.FLOAT, ["batch", 1])],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8
+    onnx.save(model, str(tmp_path / "model.onnx"))
+    make_tokenizer().save(str(tmp_path / "tokenizer.json"))
+
+    # The test process itself may be larger than the plugin limit
+    monkeypatch.setattr(local_backend, "resident_memory", lambda: 0)
+    encoder = LocalCrossEncoder.load(str(tmp_path), threads=1, batch_size=3)
+    expected = LocalCrossEncoder(stub, make_tokenizer(), batch_size=1).score("cats", DOCUMENTS)
+    np.testing.assert_allclose(encoder.score("cats", DOCUMENTS), expected, rtol=1e-5)
@@ -0,0 +1,62 @@
+from models.rerank.rerank import BGERerankModel
+from models.rerank.sharding import ScoredDocument, pack_by_tokens, padding_efficiency
+from models.rerank.transport import RerankTransport
+
+
+def test_batches_stay_within_the_padded_budget():
+    tokens = [50, 10, 12, 48, 11, 52]
+    batches = pack_by_tokens(tokens, budget=100)
+    assert batches == [[1, 4, 2], [3, 0], [5]]
+    for batch in batches:
+        assert len(batch) * max(tokens[position] for position in batch) <= 100
+
+
+def test_document_over_the_budget_gets_a_batch_of_its_own():
+    assert pack_by_tokens([10, 500, 10], budget=100) == [[0, 2], [1]]
+
+
+def test_document_cap_starts_a_new_batch():
+    assert pack_by_tokens([5, 5, 5, 5, 5], budget=1000, max_documents=2) == [[0, 1], [2, 3], [4]]
+
+
+def test_padding_efficiency():
+    assert padding_efficiency([]) == 1.0
+    assert padding_efficiency([[10, 10]]) == 1.0
+    assert padding_efficiency([[10, 30]]) == 40 / 60
+    # Packing by length wastes less than the same documents in input order
+    tokens = [50, 10, 12, 48, 11, 52]
+    packed = padding_efficiency([tokens[p] for p in batch] for batch in pack_by_tokens(tokens, 100))
+    positional = padding_efficiency([tokens[0:3], tokens[3:6]])
+    assert packed > positional
+
+
+def test_invocation_sends_length_packed_shards_and_keeps_indices(monkeypatch):
+    sent = []
+
+    def rerank(self, query, documents, top_k):
+        sent.append(list(documents))
+        scored = [
+            ScoredDocument(index=index, score=float(len(text)), text=text)
+            for index, text in enumerate(documents)
+        ]
+        return sorted(scored, key=lambda doc: doc.score, reverse=True)[:top_k]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    long = " ".join(["word"] * 60)
+    documents = ["a", long + " one", "b", long + " two", "c"]
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": "http://packing:8000", "batch_token_budget": 130}
+    result = model._invoke("bge", credentials, "q", documents, top_n=5)
+
+    assert sorted(map(sorted, sent)) == [
+        ["a", "b", "c"],
+        [long + " one"],
+        [long + " two"],
+    ]
+    assert [(doc.index, doc.text) for doc in result.docs[:2]] == [
+        (1, long + " one"),
+        (3, long + " two"),
+    ]
+    assert sorted(doc.index for doc in result.docs) == list(range(5))
+    for doc in result.docs:
+        assert documents[doc.index] == doc.text
@@ -0,0 +1,89 @@
+import pytest
+
+from models.rerank.prefilter import (
+    DEFAULT_FLOOR_SCORE,
+    BM25Prefilter,
+    bm25_scores,
+    get_prefilter,
+    tokenize,
+)
+from models.rerank.rerank import BGERerankModel
+from models.rerank.sharding import ScoredDocument
+from models.rerank.transport import RerankTransport
+
+DOCUMENTS = [
+    "the weather in Paris",
+    "cats sleep most of the day",
+    "a cat and a dog",
+    "why cats purr: cats purr when content",
+    "stock market news",
+]
+
+
+def test_tokenize():
+    assert tokenize("Cats, DOGS!") == ["cats", "dogs"]
+    assert tokenize("東京 tower") == ["東", "京", "tower"]
+
+
+def test_bm25_ranks_matching_documents_first():
+    scores = bm25_scores("cats purr", DOCUMENTS)
+    assert scores.argmax() == 3
+    assert scores[1] > 0
+    assert scores[0] == scores[2] == scores[4] == 0
+
+
+def test_select_keeps_the_best_in_input_order():
+    prefilter = BM25Prefilter(keep=2)
+    assert prefilter.select("cats purr", DOCUMENTS, top_k=1) == [1, 3]
+
+
+def test_select_never_keeps_fewer_than_top_k():
+    # No stemming: "cat" does not match, so the tie keeps the first document
+    assert BM25Prefilter(keep=1).select("cats", DOCUMENTS, top_k=3) == [0, 1, 3]
+    assert BM25Prefilter(ratio=0.2).select("cats", DOCUMENTS, top_k=2) == [1, 3]
+
+
+def test_the_stricter_limit_wins():
+    prefilter = BM25Prefilter(keep=4, ratio=0.4)
+    assert len(prefilter.select("cats", DOCUMENTS, top_k=1)) == 2
+
+
+def test_ties_keep_the_earlier_document():
+    assert BM25Prefilter(keep=2).select("nothing matches", DOCUMENTS, top_k=1) == [0, 1]
+
+
+def test_get_prefilter():
+    assert get_prefilter({}) is None
+    assert get_prefilter({"prefilter": "off"}) is None
+    prefilter = get_prefilter({"prefilter": "bm25", "prefilter_top_k": "10"})
+    assert (prefilter.keep, prefilter.ratio, prefilter.floor_score) == (10, 0.0, DEFAULT_FLOOR_SCORE)
+    assert get_prefilter({"prefilter": "bm25", "prefilter_floor_score": "0"}).floor_score == 0.0
+    with pytest.raises(ValueError):
+        get_prefilter({"prefilter": "splade"})
+
+
+def test_pruned_documents_are_not_sent(monkeypatch):
+    sent = []
+
+    def rerank(self, query, documents, top_k):
+        sent.append(list(documents))
+        return [
+            ScoredDocument(index=index, score=float(len(text)), text=text)
+            for index, text in enumerate(documents)
+        ]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    model = BGERerankModel(model_schemas=[])
+    credentials = {
+        "api_url": "http://prefilter:8000",
+        "prefilter": "bm25",
+        "prefilter_top_k": 2,
+    }
+    result = model._invoke("bge", credentials, "cats purr", DOCUMENTS, top_n=2)
+
+    assert sent == [[DOCUMENTS[1], DOCUMENTS[3]]]
+    assert [doc.index for doc in result.docs] == [3, 1]
+
+    # Asking for more than the prefilter keeps sends more
+    model._invoke("bge", credentials, "cats purr", DOCUMENTS, top_n=3)
+    assert len(sent[1]) == 3
@@ -0,0 +1,126 @@
+import pytest
+import requests
+
+from models.rerank import resilience
+from models.rerank.resilience import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+    get_breaker,
+    parse_retry_after,
+)
+
+URL = "http://breaker:8000"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_response(status_code: int, retry_after: str = "") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    if retry_after:
+        response.headers["Retry-After"] = retry_after
+    return response
+
+
+def test_breaker_is_off_by_default():
+    assert get_breaker(URL, {}) is None
+    assert get_breaker(URL, {"circuit_breaker_threshold": "0"}) is None
+    assert get_breaker(URL, {"circuit_breaker_threshold": "3"}).threshold == 3
+
+
+def test_opens_after_threshold_consecutive_failures(clock):
+    breaker = CircuitBreaker(threshold=3, reset_timeout=10)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+    breaker.before_request(URL)
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(URL)
+
+
+def test_half_open_admits_a_single_trial(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 9.9
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(URL)
+
+    clock[0] += 0.1
+    breaker.before_request(URL)
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(URL)
+
+
+def test_successful_trial_closes_the_circuit(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.before_request(URL)
+    breaker.record(make_response(200))
+    assert breaker.state == CLOSED
+    breaker.before_request(URL)
+    breaker.before_request(URL)
+
+
+def test_failed_trial_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker(threshold=5, reset_timeout=10)
+    for _ in range(5):
+        breaker.record_failure()
+    clock[0] += 10
+    breaker.before_request(URL)
+    breaker.record(make_response(503))
+    assert breaker.state == OPEN
+    clock[0] += 9
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(URL)
+
+
+def test_released_trial_lets_another_request_through(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.before_request(URL)
+    breaker.release_trial()
+    breaker.before_request(URL)
+    assert breaker.state == HALF_OPEN
+
+
+def test_retry_after_extends_the_open_period(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record(make_response(429, retry_after="30"))
+    clock[0] += 20
+    with pytest.raises(CircuitOpenError):
+        breaker.before_request(URL)
+    clock[0] += 10
+    breaker.before_request(URL)
+
+
+def test_client_errors_are_not_failures(clock):
+    breaker = CircuitBreaker(threshold=1, reset_timeout=10)
+    breaker.record(make_response(400))
+    breaker.record(make_response(404))
+    assert breaker.state == CLOSED
+
+
+def test_parse_retry_after():
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("") is None
+    assert parse_retry_after("garbage") is None
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
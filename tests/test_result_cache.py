@@ -0,0 +1,211 @@
+import threading
+
+import pytest
+from dify_plugin.entities.model.rerank import RerankDocument, RerankResult
+
+from models.rerank import result_cache
+from models.rerank.rerank import BGERerankModel
+from models.rerank.result_cache import (
+    MAX_RESULT_CACHE_MB,
+    ResultCache,
+    get_result_cache,
+    result_bytes,
+    result_key,
+)
+from models.rerank.sharding import ScoredDocument
+from models.rerank.transport import RerankTransport
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def make_result(*texts: str) -> RerankResult:
+    return RerankResult(
+        model="bge",
+        docs=[RerankDocument(index=index, text=text, score=1.0) for index, text in enumerate(texts)],
+    )
+
+
+def computed(result: RerankResult, calls: list, cacheable: bool = True):
+    def compute():
+        calls.append(1)
+        return result, cacheable
+
+    return compute
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    waited = threading.Event()
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        waited.wait(0.01)
+    raise AssertionError("condition not reached")
+
+
+def key(*documents: str, **credentials) -> bytes:
+    return result_key("bge", {"api_url": "http://svc", **credentials}, "q", list(documents), 2, None)
+
+
+def test_key_covers_everything_the_result_depends_on():
+    base = key("a", "b")
+    assert base == key("a", "b")
+    assert base != key("b", "a")
+    assert base != key("ab", "")
+    assert base != key("a", "b", truncation="on")
+    assert base != result_key("bge", {"api_url": "http://svc"}, "q", ["a", "b"], 1, None)
+    assert base != result_key("bge", {"api_url": "http://svc"}, "q", ["a", "b"], 2, 0.5)
+    assert base != result_key("bge", {"api_url": "http://svc"}, "q2", ["a", "b"], 2, None)
+
+
+def test_repeat_is_served_from_the_cache(clock):
+    cache = ResultCache(max_bytes=2**20)
+    calls = []
+    first = cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    second = cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    assert len(calls) == 1
+    assert second == first and second is not first
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_callers_get_their_own_copies(clock):
+    cache = ResultCache(max_bytes=2**20)
+    mine = cache.get_or_compute(key("a"), computed(make_result("a"), []))
+    mine.docs[0].text = "changed"
+    assert cache.get_or_compute(key("a"), computed(make_result("x"), [])).docs[0].text == "a"
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ResultCache(max_bytes=2**20, ttl=10)
+    calls = []
+    cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    clock[0] += 10
+    cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    assert len(calls) == 2
+
+
+def test_partial_results_are_not_cached(clock):
+    cache = ResultCache(max_bytes=2**20)
+    calls = []
+    cache.get_or_compute(key("a"), computed(make_result("a"), calls, cacheable=False))
+    cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    assert len(calls) == 2
+
+
+def test_least_recently_used_result_is_evicted_at_the_byte_cap(clock):
+    size = result_bytes(make_result("a"))
+    cache = ResultCache(max_bytes=2 * size)
+    calls = []
+    for text in ("a", "b"):
+        cache.get_or_compute(key(text), computed(make_result(text), calls))
+    cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    cache.get_or_compute(key("c"), computed(make_result("c"), calls))
+    assert cache.evictions == 1 and cache.size_bytes <= cache.max_bytes
+
+    calls.clear()
+    cache.get_or_compute(key("a"), computed(make_result("a"), calls))
+    assert calls == []
+    cache.get_or_compute(key("b"), computed(make_result("b"), calls))
+    assert calls == [1]
+
+
+def test_result_larger_than_the_budget_is_not_kept(clock):
+    cache = ResultCache(max_bytes=10)
+    cache.get_or_compute(key("a"), computed(make_result("a"), []))
+    assert cache.stats()["entries"] == 0 and cache.size_bytes == 0
+
+
+def test_concurrent_identical_calls_share_one_computation():
+    cache = ResultCache(max_bytes=2**20)
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        release.wait(5)
+        return make_result("a", "b"), True
+
+    results = [None] * 5
+
+    def call(position: int) -> None:
+        results[position] = cache.get_or_compute(key("a", "b"), compute)
+
+    threads = [threading.Thread(target=call, args=(position,)) for position in range(5)]
+    for thread in threads:
+        thread.start()
+    wait_until(lambda: cache.stats()["shared"] == 4)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    assert all(result == results[0] for result in results)
+    assert len({id(result) for result in results}) == 5
+    assert cache.stats()["in_flight"] == 0
+
+
+def test_waiting_callers_get_the_leader_error():
+    cache = ResultCache(max_bytes=2**20)
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("boom")
+
+    errors = []
+
+    def call() -> None:
+        try:
+            cache.get_or_compute(key("a"), compute)
+        except RuntimeError as e:
+            errors.append(e)
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    wait_until(lambda: cache.stats()["shared"] == 1)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert [str(e) for e in errors] == ["boom", "boom"]
+    # A failure is not cached: the next call computes again
+    assert cache.get_or_compute(key("a"), lambda: (make_result("a"), True)).docs[0].text == "a"
+
+
+def test_get_result_cache_budget(monkeypatch):
+    monkeypatch.setattr(result_cache, "_cache", None)
+    assert get_result_cache({}) is None
+    cache = get_result_cache({"result_cache_mb": 1000, "result_cache_ttl": 30})
+    assert cache.max_bytes == MAX_RESULT_CACHE_MB * 1024 * 1024 and cache.ttl == 30
+    assert get_result_cache({"result_cache_mb": 1}) is cache
+
+
+def test_repeated_invocation_sends_no_request(monkeypatch):
+    monkeypatch.setattr(result_cache, "_cache", None)
+    sent = []
+
+    def rerank(self, query, documents, top_k):
+        sent.append(list(documents))
+        return [
+            ScoredDocument(index=index, score=float(len(text)), text=text)
+            for index, text in enumerate(documents)
+        ]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": "http://result-cache:8000", "result_cache_mb": 1}
+    first = model._invoke("bge", credentials, "q", ["a", "bb"], top_n=2)
+    second = model._invoke("bge", credentials, "q", ["a", "bb"], top_n=2)
+    assert len(sent) == 1
+    assert second == first
+    model._invoke("bge", credentials, "q", ["a", "bb"], top_n=1)
+    assert len(sent) == 2
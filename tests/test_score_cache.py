@@ -0,0 +1,107 @@
+import pytest
+
+from models.rerank import score_cache
+from models.rerank.rerank import BGERerankModel
+from models.rerank.score_cache import (
+    ENTRY_BYTES,
+    MAX_SCORE_CACHE_MB,
+    ScoreCache,
+    cache_namespace,
+    get_score_cache,
+    pair_keys,
+)
+from models.rerank.sharding import ScoredDocument
+from models.rerank.transport import RerankTransport
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(score_cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def keys(*documents: str) -> list[bytes]:
+    return pair_keys("bge\0http\0svc", "q", documents)
+
+
+def test_pair_keys_depend_on_everything_that_changes_the_score():
+    first = pair_keys("bge\0http\0svc", "q", ["a"])[0]
+    assert first == pair_keys("bge\0http\0svc", "q", ["a"])[0]
+    assert first != pair_keys("bge\0http\0svc", "q", ["b"])[0]
+    assert first != pair_keys("bge\0http\0svc", "q2", ["a"])[0]
+    assert first != pair_keys("other\0http\0svc", "q", ["a"])[0]
+    # The separator keeps the query and the document apart
+    assert pair_keys("ns", "ab", ["c"]) != pair_keys("ns", "a", ["bc"])
+    assert len(first) == 16
+
+
+def test_namespace_is_per_model_and_service():
+    http = {"api_url": "http://svc:8000/"}
+    assert cache_namespace("bge", http) == cache_namespace("bge", {"api_url": "http://svc:8000"})
+    assert cache_namespace("bge", http) != cache_namespace("bge-v2", http)
+    assert cache_namespace("bge", http) != cache_namespace("bge", {"api_url": "http://other:8000"})
+    local = {"backend": "local", "local_model_path": "/models/bge"}
+    assert cache_namespace("bge", local) != cache_namespace("bge", http)
+
+
+def test_hits_and_misses(clock):
+    cache = ScoreCache(max_bytes=100 * ENTRY_BYTES)
+    a, b = keys("a", "b")
+    cache.put_many([(a, 0.5)])
+    assert cache.get_many([a, b]) == {a: 0.5}
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_entries_expire_after_the_ttl(clock):
+    cache = ScoreCache(max_bytes=100 * ENTRY_BYTES, ttl=10)
+    (a,) = keys("a")
+    cache.put_many([(a, 0.5)])
+    clock[0] += 9.9
+    assert cache.get_many([a]) == {a: 0.5}
+    clock[0] += 0.1
+    assert cache.get_many([a]) == {}
+    assert cache.stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_evicted_at_the_byte_cap(clock):
+    cache = ScoreCache(max_bytes=2 * ENTRY_BYTES)
+    a, b, c = keys("a", "b", "c")
+    cache.put_many([(a, 1.0), (b, 2.0)])
+    cache.get_many([a])
+    cache.put_many([(c, 3.0)])
+    assert cache.get_many([a, b, c]) == {a: 1.0, c: 3.0}
+    assert cache.evictions == 1
+    assert cache.size_bytes <= cache.max_bytes
+
+
+def test_get_score_cache_budget(monkeypatch):
+    monkeypatch.setattr(score_cache, "_cache", None)
+    assert get_score_cache({}) is None
+    assert get_score_cache({"score_cache_mb": 0}) is None
+    cache = get_score_cache({"score_cache_mb": 1024, "score_cache_ttl": 60})
+    assert cache.max_bytes == MAX_SCORE_CACHE_MB * 1024 * 1024
+    assert cache.ttl == 60
+    assert get_score_cache({"score_cache_mb": 1}) is cache
+    assert cache.max_bytes == 1024 * 1024
+
+
+def test_cached_pairs_are_not_sent_again(monkeypatch):
+    monkeypatch.setattr(score_cache, "_cache", None)
+    sent: list[list[str]] = []
+
+    def rerank(self, query, documents, top_k):
+        sent.append(list(documents))
+        return [
+            ScoredDocument(index=index, score=float(len(text)), text=text)
+            for index, text in enumerate(documents)
+        ]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": "http://score-cache:8000", "score_cache_mb": 1}
+    model._invoke("bge", credentials, "q", ["a", "bb"], top_n=2)
+    result = model._invoke("bge", credentials, "q", ["bb", "ccc", "a"], top_n=3)
+
+    assert sent == [["a", "bb"], ["ccc"]]
+    assert [(doc.index, doc.text) for doc in result.docs] == [(1, "ccc"), (0, "bb"), (2, "a")]
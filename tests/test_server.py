@@ -0,0 +1,109 @@
+import socket
+import threading
+
+import pytest
+
+from models.rerank.transport import RerankTransport
+from server import DocumentStore, DynamicBatcher, ToyScorer
+from server.batcher import Overloaded, RequestTooLarge
+from server.handler import make_handler
+from server.workers import _Server
+
+
+class RecordingScorer(ToyScorer):
+    """
+    Toy scorer that records its batches and can be held back
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.batches: list[list[tuple[str, str]]] = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def score(self, pairs):
+        self.release.wait(5)
+        self.batches.append(list(pairs))
+        return super().score(pairs)
+
+
+def test_toy_scorer_prefers_documents_covering_the_query():
+    query = "red apples"
+    scores = ToyScorer().score(
+        [(query, "red apples and red apples"), (query, "apples"), (query, "pears")]
+    )
+    assert scores[0] > scores[1] > scores[2] == -10.0
+
+
+def test_concurrent_requests_share_batches():
+    scorer = RecordingScorer()
+    scorer.release.clear()
+    batcher = DynamicBatcher(scorer, max_batch_pairs=64, max_wait=0.05)
+    jobs = [batcher.submit(f"query {number}", ["short text", "other text"]) for number in range(5)]
+    scorer.release.set()
+    scores = [job.wait(5) for job in jobs]
+
+    assert len(scores) == 5 and all(len(job_scores) == 2 for job_scores in scores)
+    assert sum(len(batch) for batch in scorer.batches) == 10
+    assert len(scorer.batches) < 5
+
+
+def test_pairs_of_different_length_are_batched_apart():
+    scorer = RecordingScorer()
+    batcher = DynamicBatcher(scorer, max_batch_pairs=64, max_wait=0.05, buckets=(64,))
+    job = batcher.submit("q", ["short", "long " * 100, "tiny"])
+    job.wait(5)
+    assert sorted(len(batch) for batch in scorer.batches) == [1, 2]
+
+
+def test_full_bucket_is_scored_without_waiting():
+    scorer = RecordingScorer()
+    batcher = DynamicBatcher(scorer, max_batch_pairs=4, max_wait=60)
+    batcher.submit("q", ["a", "b", "c", "d"]).wait(5)
+    assert [len(batch) for batch in scorer.batches] == [4]
+
+
+def test_full_queue_is_overloaded():
+    batcher = DynamicBatcher(RecordingScorer(), max_wait=60, max_queue_pairs=4)
+    with pytest.raises(RequestTooLarge):
+        batcher.submit("q", ["x"] * 5)
+    batcher.submit("q", ["a", "b", "c"])
+    with pytest.raises(Overloaded) as error:
+        batcher.submit("q", ["d", "e"])
+    assert error.value.retry_after >= 1
+    assert batcher.stats()["rejected_requests"] == 1
+    batcher.submit("q", ["d"])
+
+
+@pytest.fixture
+def server_url(tmp_path):
+    batcher = DynamicBatcher(ToyScorer(), max_wait=0.001)
+    store = DocumentStore(str(tmp_path / "documents.sqlite3"))
+    listener = socket.create_server(("127.0.0.1", 0))
+    server = _Server(listener, make_handler(batcher, store, request_timeout=5))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{listener.getsockname()[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+DOCUMENTS = ["pears and plums", "red apples", "apples"]
+
+
+def test_plugin_transport_against_the_reference_server(server_url):
+    transport = RerankTransport({"api_url": server_url})
+    result = transport.rerank("red apples", DOCUMENTS, 2)
+    assert [(doc.index, doc.text) for doc in result] == [(1, "red apples"), (2, "apples")]
+
+    batch = transport.rerank_batch([("red apples", DOCUMENTS, 1), ("pears", DOCUMENTS, 1)])
+    assert [[doc.index for doc in results] for results in batch] == [[1], [0]]
+
+
+def test_uploaded_documents_are_scored_by_hash(server_url):
+    transport = RerankTransport({"api_url": server_url, "document_upload": "on"})
+    first = transport.rerank("red apples", DOCUMENTS, 3)
+    second = transport.rerank("red apples", DOCUMENTS, 3)
+    assert first == second
+    assert [doc.index for doc in second] == [1, 2, 0]
+    assert transport.uploader.supported
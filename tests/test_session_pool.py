@@ -0,0 +1,91 @@
+import pytest
+import requests
+
+from models.rerank import session_pool
+from models.rerank.session_pool import SessionPool, get_session, normalize_api_url
+
+URL = "http://pool:8000"
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(session_pool.time, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def closed(monkeypatch):
+    sessions = []
+    monkeypatch.setattr(requests.Session, "close", lambda self: sessions.append(self))
+    return sessions
+
+
+def max_connections(session: requests.Session) -> int:
+    return session.get_adapter(URL)._pool_maxsize
+
+
+def test_normalize_api_url():
+    assert normalize_api_url("HTTP://Host:80/api/") == "http://host/api"
+    assert normalize_api_url("https://host:443") == "https://host"
+    assert normalize_api_url("http://host:8000/") == "http://host:8000"
+
+
+def test_session_is_reused_across_calls():
+    pool = SessionPool()
+    session = pool.get(URL)
+    assert pool.get(URL) is session
+    assert pool.get("HTTP://POOL:8000/") is session
+    assert pool.get("http://other:8000") is not session
+
+
+def test_pool_size_is_honoured():
+    pool = SessionPool()
+    assert max_connections(pool.get(URL, pool_size=3)) == 3
+    assert max_connections(pool.get(URL, pool_size=20)) == 20
+
+
+def test_different_pool_sizes_do_not_replace_each_other(closed):
+    pool = SessionPool()
+    small = pool.get(URL, pool_size=2)
+    large = pool.get(URL, pool_size=8)
+    assert small is not large
+    assert pool.get(URL, pool_size=2) is small
+    assert pool.get(URL, pool_size=8) is large
+    assert closed == []
+
+
+def test_idle_session_is_evicted_without_closing_it(clock, closed):
+    pool = SessionPool(idle_timeout=60)
+    session = pool.get(URL)
+    clock[0] += 59
+    assert pool.get(URL) is session
+
+    clock[0] += 61
+    fresh = pool.get(URL)
+    assert fresh is not session
+    # A thread may still be sending a request on the evicted session
+    assert closed == []
+
+
+def test_idle_timeout_is_kept_per_session(clock):
+    pool = SessionPool()
+    short = pool.get(URL, idle_timeout=5)
+    long = pool.get("http://other:8000", idle_timeout=300)
+    clock[0] += 10
+    assert pool.get("http://other:8000") is long
+    assert pool.get(URL) is not short
+
+
+def test_close_all(closed):
+    pool = SessionPool()
+    session = pool.get(URL)
+    pool.close_all()
+    assert closed == [session]
+    assert pool.get(URL) is not session
+
+
+def test_get_session_reads_credentials():
+    session = get_session("http://credentials:8000", {"pool_size": "4"})
+    assert session.get_adapter("http://credentials:8000")._pool_maxsize == 4
+    assert get_session("http://credentials:8000", {"pool_size": 4}) is session
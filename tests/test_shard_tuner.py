@@ -0,0 +1,101 @@
+import json
+import random
+
+import pytest
+
+from models.rerank import shard_tuner
+from models.rerank.shard_tuner import (
+    MIN_SAMPLES,
+    SHARD_SIZES,
+    ShardSizeTuner,
+    _TunerRegistry,
+    get_shard_tuner,
+)
+
+
+def network_stage(size: int, documents: int) -> float:
+    """
+    Seconds a service takes when shards are scored in parallel: a fixed
+    overhead plus 1 ms per document of the largest shard
+    """
+    return 0.002 + 0.001 * min(size, documents)
+
+
+def test_tuner_is_off_by_default():
+    assert get_shard_tuner({"api_url": "http://tuned"}) is None
+    with pytest.raises(ValueError):
+        get_shard_tuner({"api_url": "http://tuned", "shard_autotune": "on", "shard_latency_slo_ms": "-1"})
+
+
+def test_calls_that_fit_in_one_shard_are_recorded():
+    tuner = ShardSizeTuner(latency_slo=1.0, start_size=64)
+    tuner.record(64, 20, 0.05)
+    assert tuner.to_dict()["sizes"]["64"][2] == 1
+
+
+def test_small_calls_still_move_the_size(monkeypatch):
+    random.seed(7)
+    tuner = ShardSizeTuner(latency_slo=1.0, start_size=64)
+    for _ in range(2000):
+        size = tuner.choose(40)
+        tuner.record(size, 40, network_stage(size, 40))
+    assert tuner.current < 64
+
+
+def test_highest_throughput_within_the_slo_wins():
+    tuner = ShardSizeTuner(latency_slo=0.1, start_size=64)
+    for _ in range(MIN_SAMPLES):
+        # 128 has the best throughput but misses the SLO
+        tuner.record(128, 1000, 0.5)
+        tuner.record(64, 1000, 0.08)
+        tuner.record(32, 1000, 0.09)
+    assert tuner.current == 64
+
+
+def test_fastest_size_wins_when_none_meets_the_slo():
+    tuner = ShardSizeTuner(latency_slo=0.01, start_size=64)
+    for _ in range(MIN_SAMPLES):
+        tuner.record(64, 1000, 0.5)
+        tuner.record(32, 1000, 0.3)
+    assert tuner.current == 32
+
+
+def test_too_large_caps_the_ladder():
+    tuner = ShardSizeTuner(latency_slo=1.0, start_size=128)
+    tuner.shrink(128, too_large=True)
+    assert tuner.current == 64
+    for _ in range(MIN_SAMPLES):
+        tuner.record(64, 1000, 1.0)
+        tuner.record(128, 1000, 0.01)
+    assert tuner.current == 64
+    random.seed(1)
+    assert max(tuner.choose(10_000) for _ in range(500)) == 64
+
+
+def test_timeout_moves_one_step_down():
+    tuner = ShardSizeTuner(latency_slo=1.0, start_size=64)
+    tuner.shrink(64, too_large=False)
+    assert tuner.current == 32
+    assert tuner.to_dict()["ceiling"] == SHARD_SIZES[-1]
+
+
+def test_state_survives_a_restart(tmp_path, monkeypatch):
+    path = str(tmp_path / "tuner.json")
+    registry = _TunerRegistry()
+    tuner = registry.get("svc", path, 1.0, 64)
+    tuner.shrink(512, too_large=True)
+    for _ in range(MIN_SAMPLES):
+        tuner.record(128, 1000, 0.1)
+        tuner.record(64, 1000, 0.5)
+    registry.save("svc", force=True)
+    assert json.load(open(path))["svc"]["current"] == 128
+
+    restarted = _TunerRegistry().get("svc", path, 1.0, 64)
+    assert restarted.current == 128
+    assert restarted.to_dict()["ceiling"] == 256
+
+
+def test_unreadable_state_is_ignored(tmp_path):
+    path = tmp_path / "tuner.json"
+    path.write_text("{not json")
+    assert _TunerRegistry().get("svc", str(path), 1.0, 32).current == 32
@@ -0,0 +1,91 @@
+import threading
+import time
+
+import pytest
+
+from models.rerank.sharding import ScoredDocument, fan_out, merge_top_k, split_shards
+
+
+def doc(index: int, score: float, text: str = "") -> ScoredDocument:
+    return ScoredDocument(index=index, score=score, text=text or f"d{index}")
+
+
+def test_split_shards_keeps_offsets():
+    documents = ["a", "b", "c", "d", "e"]
+    assert split_shards(documents, 0) == [(0, documents)]
+    assert split_shards(documents, 5) == [(0, documents)]
+    assert split_shards(documents, 2) == [(0, ["a", "b"]), (2, ["c", "d"]), (4, ["e"])]
+
+
+def test_merge_top_k_across_shards():
+    merged = merge_top_k([[doc(0, 0.1), doc(1, 0.9)], [doc(2, 0.5), doc(3, 0.7)]], 3)
+    assert [d.index for d in merged] == [1, 3, 2]
+
+
+def test_merge_top_k_applies_the_threshold_before_cutting():
+    merged = merge_top_k([[doc(0, 0.1), doc(1, 0.9)], [doc(2, 0.5)]], 5, score_threshold=0.5)
+    assert [d.index for d in merged] == [1, 2]
+
+
+def test_merge_top_k_keeps_shard_order_for_ties():
+    merged = merge_top_k([[doc(3, 0.5), doc(0, 0.5)], [doc(1, 0.5), doc(2, 0.9)]], 3)
+    assert [d.index for d in merged] == [2, 3, 0]
+
+
+def test_merge_top_k_edge_cases():
+    assert merge_top_k([], 3) == []
+    assert merge_top_k([[doc(0, 0.5)]], 0) == []
+    assert merge_top_k([[doc(0, 0.5)]], 3, score_threshold=0.9) == []
+
+
+def test_fan_out_returns_results_in_shard_order():
+    shards = split_shards(["a", "b", "c", "d", "e"], 2)
+
+    def send(offset, shard):
+        time.sleep(0.01 * (3 - offset // 2))
+        return [doc(offset + position, 0.0, text) for position, text in enumerate(shard)]
+
+    results = fan_out(shards, send, max_workers=3)
+    assert [[d.index for d in result] for result in results] == [[0, 1], [2, 3], [4]]
+
+
+def test_fan_out_bounds_shards_in_flight():
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def send(offset, shard):
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.02)
+        with lock:
+            running[0] -= 1
+        return []
+
+    fan_out(split_shards(list("abcdefgh"), 1), send, max_workers=2)
+    assert peak[0] == 2
+
+
+def test_fan_out_fails_with_the_first_failed_shard():
+    def send(offset, shard):
+        if offset == 1:
+            raise RuntimeError("shard failed")
+        return []
+
+    with pytest.raises(RuntimeError, match="shard failed"):
+        fan_out(split_shards(["a", "b", "c"], 1), send)
+
+
+def test_fan_out_timeout_leaves_slow_shards_out():
+    released = threading.Event()
+
+    def send(offset, shard):
+        if offset == 1:
+            released.wait(5)
+        return [doc(offset, 1.0)]
+
+    try:
+        results = fan_out(split_shards(["a", "b", "c"], 1), send, timeout=0.1)
+    finally:
+        released.set()
+    assert results[1] is None
+    assert [result[0].index for result in (results[0], results[2])] == [0, 2]
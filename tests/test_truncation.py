@@ -0,0 +1,87 @@
+import pytest
+
+from models.rerank.rerank import BGERerankModel
+from models.rerank.sharding import ScoredDocument
+from models.rerank.transport import RerankTransport
+from models.rerank.truncation import (
+    HEAD_TAIL_SEPARATOR,
+    SPECIAL_TOKENS,
+    Truncator,
+    estimate_tokens,
+    get_truncator,
+    truncate_text,
+)
+
+WORDS = " ".join(f"word{number}" for number in range(100))
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("cat dog") == 2
+    # Long words count one token per eight characters
+    assert estimate_tokens("a" * 17) == 3
+    assert estimate_tokens("hello, world!") == 4
+    assert estimate_tokens("日本語") == 3
+
+
+def test_text_within_budget_is_kept_as_is():
+    assert truncate_text(WORDS, 100) is WORDS
+
+
+def test_head_tail_and_head_tail_strategies():
+    head = truncate_text(WORDS, 10, "head")
+    assert head == " ".join(f"word{number}" for number in range(10))
+
+    tail = truncate_text(WORDS, 10, "tail")
+    assert tail == " ".join(f"word{number}" for number in range(90, 100))
+
+    both = truncate_text(WORDS, 10, "head_tail")
+    first, last = both.split(HEAD_TAIL_SEPARATOR)
+    assert first == "word0 word1 word2"
+    assert last == "word96 word97 word98 word99"
+    assert estimate_tokens(both) == 10
+    # Too small a budget for both ends keeps the head
+    assert truncate_text(WORDS, 3, "head_tail") == "word0 word1 word2"
+
+
+def test_long_word_is_cut_rather_than_dropped():
+    assert truncate_text("x" * 100, 2) == "x" * 16
+
+
+def test_every_pair_fits_the_context():
+    truncator = Truncator(context_size=64, strategy="head")
+    query, documents, truncated = truncator.truncate(WORDS, [WORDS, "short one"])
+    assert estimate_tokens(query) <= 30
+    assert estimate_tokens(query) + estimate_tokens(documents[0]) + SPECIAL_TOKENS <= 64
+    assert documents[1] == "short one"
+    assert truncated == 1
+
+
+def test_get_truncator():
+    assert get_truncator({}) is None
+    assert get_truncator({"truncation": "none"}) is None
+    truncator = get_truncator({"truncation": "tail", "context_size": "128"})
+    assert (truncator.strategy, truncator.context_size) == ("tail", 128)
+    with pytest.raises(ValueError):
+        get_truncator({"truncation": "middle"})
+
+
+def test_invocation_sends_trimmed_texts_but_returns_the_originals(monkeypatch):
+    sent = []
+
+    def rerank(self, query, documents, top_k):
+        sent.append((query, list(documents)))
+        return [
+            ScoredDocument(index=index, score=float(len(text)), text=text)
+            for index, text in enumerate(documents)
+        ]
+
+    monkeypatch.setattr(RerankTransport, "rerank", rerank)
+    model = BGERerankModel(model_schemas=[])
+    credentials = {"api_url": "http://truncation:8000", "truncation": "head", "context_size": 32}
+    result = model._invoke("bge", credentials, "q", [WORDS, "short"], top_n=2)
+
+    ((query, documents),) = sent
+    assert query == "q" and documents[1] == "short"
+    assert estimate_tokens(documents[0]) <= 32 - SPECIAL_TOKENS - 1
+    assert sorted(doc.text for doc in result.docs) == sorted([WORDS, "short"])
@@ -0,0 +1,82 @@
+import gzip
+
+import requests
+
+from models.rerank import wire_codecs
+from models.rerank.wire_codecs import (
+    PLAIN_CODEC,
+    WireCodec,
+    get_codec,
+    is_rejection,
+    loads_json,
+    mark_rejected,
+)
+
+GZIP = WireCodec("json", "gzip")
+
+
+def make_response(status_code: int, text: str = "") -> requests.Response:
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = text.encode("utf-8")
+    response.encoding = "utf-8"
+    return response
+
+
+def test_gzip_round_trip():
+    payload = {"query": "вопрос", "texts": ["документ " * 200]}
+    body, headers = GZIP.encode(payload)
+    assert headers["Content-Encoding"] == "gzip"
+    assert loads_json(gzip.decompress(body)) == payload
+
+
+def test_plain_json_is_not_escaped():
+    body, headers = PLAIN_CODEC.encode({"query": "вопрос"})
+    assert "вопрос".encode("utf-8") in body
+    assert "Content-Encoding" not in headers
+    assert loads_json(body) == {"query": "вопрос"}
+
+
+def test_unsupported_media_type_is_a_rejection():
+    _, headers = GZIP.encode({"texts": ["a" * 2048]})
+    assert is_rejection(GZIP, headers, make_response(415))
+
+
+def test_unreadable_body_is_a_rejection():
+    _, headers = GZIP.encode({"texts": ["a" * 2048]})
+    for status_code, text in (
+        (400, '{"error": "Failed to parse request body"}'),
+        (422, '{"detail": [{"type": "json_invalid"}]}'),
+        (400, "Unsupported Content-Encoding: gzip"),
+    ):
+        assert is_rejection(GZIP, headers, make_response(status_code, text))
+
+
+def test_validation_errors_keep_the_codec():
+    _, headers = GZIP.encode({"texts": ["a" * 2048]})
+    assert not is_rejection(GZIP, headers, make_response(400, '{"error": "query is empty"}'))
+    assert not is_rejection(GZIP, headers, make_response(422, '{"detail": "texts too long"}'))
+    assert not is_rejection(GZIP, headers, make_response(500, "parse error"))
+
+
+def test_plain_bodies_are_never_rejections():
+    _, headers = GZIP.encode({"texts": ["a"]})
+    assert "Content-Encoding" not in headers
+    assert not is_rejection(GZIP, headers, make_response(415))
+    assert not is_rejection(PLAIN_CODEC, {}, make_response(415))
+
+
+def test_rejected_codec_falls_back_to_plain_json_until_it_expires(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(wire_codecs.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(wire_codecs, "_rejected", {})
+    credentials = {"api_url": "http://codec-a:8000", "compression": "gzip"}
+    other = {"api_url": "http://codec-b:8000", "compression": "gzip"}
+
+    assert get_codec(credentials).name == GZIP.name
+    mark_rejected(credentials["api_url"], GZIP)
+    assert get_codec(credentials) is PLAIN_CODEC
+    assert get_codec(other).name == GZIP.name
+
+    now[0] += wire_codecs.REJECTION_TTL + 1
+    assert get_codec(credentials).name == GZIP.name